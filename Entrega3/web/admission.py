@@ -0,0 +1,165 @@
+"""Admission control: how many requests may use the database at once.
+
+Every request that may query the database holds a slot of a :class:`Gate`
+while it runs (a streamed page until its last row). There are as many slots
+as pooled connections, so an admitted request gets a connection at once and
+the others wait here, in a short bounded queue, instead of inside
+``pool.connection()``.
+
+Requests are admitted by priority class. A class may only fill its
+``share`` of the slots, which keeps the others for the classes above it,
+and some routes have a concurrency limit of their own. A request that is
+not admitted within the deadline of its class, or that finds the queue
+full of requests of its priority or higher, is shed: answered ``503`` with
+``Retry-After`` straight away.
+"""
+import itertools
+import math
+import threading
+import time
+from typing import NamedTuple
+
+from werkzeug.exceptions import ServiceUnavailable
+
+import metrics
+
+
+# Seconds a shed client is asked to wait before retrying.
+RETRY_AFTER = 1
+
+
+class Class(NamedTuple):
+    """A priority class of requests."""
+
+    priority: int
+    # Fraction of the slots the class may fill.
+    share: float
+    # Seconds a request may wait to be admitted.
+    deadline: float
+    # Milliseconds a statement of the request may run, 0 for no limit.
+    statement_timeout: int
+
+
+class Shed(ServiceUnavailable):
+    """The request was not admitted: ``503`` with ``Retry-After``."""
+
+    description = "The server is busy. Retry shortly."
+
+    def __init__(self, reason):
+        super().__init__(retry_after=RETRY_AFTER)
+        self.reason = reason
+
+
+class Ticket:
+    """The slot of one admitted request, given back by :meth:`release`."""
+
+    def __init__(self, gate, route, name, cls, seq):
+        self.gate = gate
+        self.route = route
+        self.name = name
+        self.cls = cls
+        self.seq = seq
+        self.admitted = False
+        # Dropped from the queue for a request of a higher priority.
+        self.evicted = False
+
+    def release(self):
+        if self.admitted:
+            self.admitted = False
+            self.gate._release(self)
+
+
+class Gate:
+    """``capacity`` slots, shared by the requests of the ``classes`` by name.
+
+    ``limits`` caps the requests of some routes; ``queue_size`` is how many
+    requests may wait at once.
+    """
+
+    def __init__(self, capacity, classes, queue_size, limits=None):
+        self.capacity = capacity
+        self.classes = classes
+        self.queue_size = queue_size
+        self.limits = limits or {}
+        self.active = 0
+        self.by_class = dict.fromkeys(classes, 0)
+        self.routes = {}
+        self.waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def slots(self, cls):
+        """The slots ``cls`` may fill."""
+        return max(1, math.floor(self.capacity * cls.share))
+
+    def _fits(self, ticket):
+        return (
+            self.active < self.slots(ticket.cls)
+            and self.routes.get(ticket.route, 0) < self.limits.get(ticket.route, self.capacity)
+        )
+
+    def _next(self):
+        """The waiting request to admit next: the first of the highest priority that fits."""
+        fitting = [ticket for ticket in self.waiting if self._fits(ticket)]
+        return min(fitting, key=lambda ticket: (ticket.cls.priority, ticket.seq), default=None)
+
+    def admit(self, route, name):
+        """Wait for a slot for a request of class ``name`` to ``route``; return its ticket.
+
+        Raises :class:`Shed` if the queue is full or the deadline of the
+        class passes first.
+        """
+        cls = self.classes[name]
+        ticket = Ticket(self, route, name, cls, next(self._seq))
+        start = time.perf_counter()
+        with self._cond:
+            self.waiting.append(ticket)
+            if self._next() is not ticket:
+                if len(self.waiting) > self.queue_size:
+                    # The queue keeps the requests of the highest priority:
+                    # the last of the lowest is shed, be it this one or not.
+                    last = max(self.waiting, key=lambda ticket: (ticket.cls.priority, ticket.seq))
+                    self.waiting.remove(last)
+                    if last is ticket:
+                        metrics.ADMISSION_SHED.inc(route, name, "queue_full")
+                        raise Shed("queue_full")
+                    last.evicted = True
+                    self._cond.notify_all()
+                metrics.ADMISSION_QUEUED.inc(route, name)
+                deadline = start + cls.deadline
+                while self._next() is not ticket:
+                    if ticket.evicted:
+                        metrics.ADMISSION_SHED.inc(route, name, "queue_full")
+                        raise Shed("queue_full")
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.waiting.remove(ticket)
+                        self._cond.notify_all()
+                        metrics.ADMISSION_SHED.inc(route, name, "deadline")
+                        raise Shed("deadline")
+                    self._cond.wait(remaining)
+            self.waiting.remove(ticket)
+            self.active += 1
+            self.by_class[name] += 1
+            self.routes[route] = self.routes.get(route, 0) + 1
+            ticket.admitted = True
+            # The next in line may fit too.
+            self._cond.notify_all()
+        metrics.ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, name)
+        return ticket
+
+    def _release(self, ticket):
+        with self._cond:
+            self.active -= 1
+            self.by_class[ticket.name] -= 1
+            self.routes[ticket.route] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """The admitted (``active``) and ``waiting`` requests of each class."""
+        with self._cond:
+            stats = {name: {"active": active, "waiting": 0} for name, active in self.by_class.items()}
+            for ticket in self.waiting:
+                stats[ticket.name]["waiting"] += 1
+        return stats
+
@@ -1,10 +1,21 @@
 #!/usr/bin/python3
+import os
 import sys
 
 sys.path.insert(0, "~/.local/lib/python3.9/site-packages/")
 
+# A CGI process serves one request: it opens a single connection and
+# prepares no statements, none would run twice.
+os.environ.setdefault("DB_POOL_MIN_SIZE", "1")
+os.environ.setdefault("DB_POOL_MAX_SIZE", "1")
+os.environ.setdefault("DB_PREPARE_STATEMENTS", "0")
+
 from wsgiref.handlers import CGIHandler
 
 from app import app
+from app import shut_down
 
-CGIHandler().run(app)
+try:
+    CGIHandler().run(app)
+finally:
+    shut_down()
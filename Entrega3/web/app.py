@@ -1,28 +1,129 @@
 #!/usr/bin/python3
+import functools
+import hashlib
+import io
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as Date
 from logging.config import dictConfig
+from pathlib import Path
 
 import psycopg
+from flask import abort
 from flask import flash
 from flask import Flask
+from flask import g
 from flask import jsonify
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import stream_template
+from flask import stream_with_context
 from flask import url_for
 from psycopg.rows import namedtuple_row
 from psycopg_pool import ConnectionPool
+from psycopg_pool import PoolTimeout
+from werkzeug.http import is_resource_modified
+
+import admission
+import bulk_export
+import bulk_import
+import compression
+import live
+import metrics
+import pagination
+import queries
+import replicas
+import serialization
+from cache import TTLCache
+from migrations import apply_migrations
+from queries import CLIENTS
+from queries import ORDERS
+from queries import PRODUCTS
+from queries import SUPPLIERS
 
 
 # postgres://{user}:{password}@{hostname}:{port}/{database-name}
-DATABASE_URL = "postgres://db:db@postgres/db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
+
+
+# Connections per process. A pre-fork server sizes them from its number of
+# workers and threads (see gunicorn.conf.py).
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 4))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", POOL_MIN_SIZE))
+# Preparing every statement pays off over many requests, not in a process
+# that serves one (app.cgi).
+PREPARE_STATEMENTS = os.environ.get("DB_PREPARE_STATEMENTS", "1") != "0"
+# Seconds to wait for a pooled connection. Admitted requests (see the
+# admission control below) rarely wait at all; this bounds the rest.
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+# Milliseconds any statement may run, unless the class of its request allows
+# otherwise; 0 for no limit.
+STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 5000))
+# Options of every pooled connection. psycopg never prepares statements on
+# its own: it would deallocate them all, those of queries.py too, on the
+# next rollback.
+CONNECTION_OPTIONS = {
+    "options": f"-c statement_timeout={STATEMENT_TIMEOUT}",
+    "prepare_threshold": None,
+}
+
+# The pool is opened by open_pool() in the process that uses it, never at
+# import: a worker forked from a process that imported the app must not
+# share the connections and threads of its parent.
+pool = ConnectionPool(
+    conninfo=DATABASE_URL,
+    min_size=POOL_MIN_SIZE,
+    max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+    configure=queries.prepare if PREPARE_STATEMENTS else None,
+    kwargs=CONNECTION_OPTIONS,
+    timeout=POOL_TIMEOUT,
+    open=False,
+)
+metrics.POOLS["main"] = pool
 
+# Streaming replicas the GET requests read from (see replicas.py), pooled
+# like the primary.
+REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+router = replicas.Router(
+    pool,
+    REPLICA_URLS,
+    min_size=POOL_MIN_SIZE,
+    max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+    configure=queries.prepare if PREPARE_STATEMENTS else None,
+    kwargs=CONNECTION_OPTIONS,
+    timeout=POOL_TIMEOUT,
+)
+for replica in router.replicas:
+    metrics.POOLS[replica.name] = replica
+
+_pool_pid = None
+_pool_lock = threading.Lock()
 
-pool = ConnectionPool(conninfo=DATABASE_URL)
-# the pool starts connecting immediately.
+
+def open_pool(wait=False):
+    """Open the pool in this process, if not yet; ``wait`` for its first connections."""
+    global _pool_pid
+    if _pool_pid == os.getpid():
+        return
+    with _pool_lock:
+        if _pool_pid == os.getpid():
+            return
+        if _pool_pid is not None:
+            raise RuntimeError("The connection pool was opened before the process forked.")
+        pool.open(wait=wait)
+        router.open(wait=wait)
+        _pool_pid = os.getpid()
 
 dictConfig(
     {
         "version": 1,
+        # Keeps the loggers of a server that imported the app first (gunicorn).
+        "disable_existing_loggers": False,
         "formatters": {
             "default": {
                 "format": "[%(asctime)s] %(levelname)s in %(module)s:%(lineno)s - %(funcName)20s(): %(message)s",
@@ -42,6 +143,584 @@ dictConfig(
 app = Flask(__name__)
 log = app.logger
 
+# Static assets are linked with a version of their content (static_url), so
+# browsers may keep them for as long as they like.
+STATIC_MAX_AGE = 365 * 24 * 3600
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
+
+_static_versions = {}
+
+
+@app.template_global()
+def static_url(filename):
+    """URL of a static asset that changes whenever the asset does."""
+    version = _static_versions.get(filename)
+    if version is None:
+        with app.open_resource(f"static/{filename}") as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:12]
+        _static_versions[filename] = version
+    return url_for("static", filename=filename, v=version)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    start = g.get("request_start")
+    if start is not None:
+        # The route pattern rather than the path keeps the label set bounded.
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - start, route, request.method, response.status_code
+        )
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    return compression.compress(response, request.accept_encodings)
+
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+
+def migrate():
+    global _migrated
+    open_pool()
+    with _migrate_lock:
+        if not _migrated:
+            with pool.connection() as conn:
+                # Backfills may take longer than any request.
+                conn.execute("SET LOCAL statement_timeout = 0;", prepare=False)
+                apply_migrations(conn, log)
+            _migrated = True
+
+
+@app.before_request
+def ensure_migrated():
+    # The endpoints that use no pooled connection (probes, metrics, static
+    # files, forms) answer even while the database cannot be reached; /ready
+    # migrates itself, to report why it cannot.
+    if request.endpoint in ADMISSION_EXEMPT:
+        return
+    open_pool()
+    if not _migrated:
+        migrate()
+
+
+def warm_up():
+    """Get the process ready to serve: pool connections up and prepared, schema migrated."""
+    open_pool(wait=True)
+    migrate()
+
+
+def shut_down():
+    """End the live streams and close the pools of this process."""
+    broker.close()
+    if _pool_pid == os.getpid():
+        router.close()
+        pool.close()
+
+
+# Read your writes: the LSN of the last commit of a client is kept in a
+# session cookie, and its reads wait for a replica that has replayed it (or
+# go to the primary). A forged LSN only slows down the reads of its client.
+LSN_COOKIE = "lsn"
+
+
+def request_lsn():
+    """The LSN of the last write of the client, or 0."""
+    try:
+        return replicas.parse_lsn(request.cookies.get(LSN_COOKIE, "0/0"))
+    except ValueError:
+        return 0
+
+
+@contextmanager
+def read_connection():
+    """A connection for the reads of this request.
+
+    GET requests read from a replica that has caught up with the writes of
+    the client, the others from the primary, as they may write too.
+    """
+    if request.method not in ("GET", "HEAD"):
+        connection = pool.connection()
+    else:
+        route = g.get("read_route")
+        if route is None:
+            route = g.read_route = router.route(request_lsn())
+        connection = route.connection()
+    with connection as conn:
+        set_statement_timeout(conn)
+        yield conn
+
+
+@contextmanager
+def write_connection():
+    """A connection to the primary, whose commits the client reads from then on."""
+    with pool.connection() as conn:
+        set_statement_timeout(conn)
+        yield conn
+        # The LSN is read once the writes are committed, so it is past the
+        # commit record whether or not the caller committed them itself.
+        conn.commit()
+        if router.replicas:
+            g.write_lsn = router.record_write(conn)
+
+
+@app.after_request
+def remember_write(response):
+    lsn = g.get("write_lsn")
+    if lsn is not None and lsn > request_lsn():
+        response.set_cookie(LSN_COOKIE, replicas.format_lsn(lsn), httponly=True, samesite="Lax")
+    return response
+
+
+def collect_replica_lag():
+    lag = list(router.lag())
+    yield "db_replica_lag_bytes", "gauge", "WAL the replica has yet to replay.", [
+        ({"replica": name}, behind) for name, behind, _ in lag
+    ]
+    yield "db_replica_lag_seconds", "gauge", "Time since the replica replayed the last transaction.", [
+        ({"replica": name}, seconds) for name, _, seconds in lag
+    ]
+
+
+metrics.Collector(collect_replica_lag)
+
+
+# Admission control (see admission.py): a request waits for one of as many
+# slots as there are pooled connections, for at most the deadline of its
+# class, or is answered 503 with Retry-After.
+ADMISSION_DEADLINE = float(os.environ.get("ADMISSION_DEADLINE", 0.5))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 4 * max(POOL_MAX_SIZE, POOL_MIN_SIZE)))
+# Imports and bulk deletes may run longer than the other statements.
+BULK_STATEMENT_TIMEOUT = int(os.environ.get("DB_BULK_STATEMENT_TIMEOUT", 60000))
+
+# Placing and paying orders come first, and may use every slot; browsing
+# leaves a quarter of them, the bulk routes and exports half.
+ADMISSION_CLASSES = {
+    "checkout": admission.Class(0, 1.0, 4 * ADMISSION_DEADLINE, STATEMENT_TIMEOUT),
+    "write": admission.Class(1, 0.9, 2 * ADMISSION_DEADLINE, STATEMENT_TIMEOUT),
+    "browse": admission.Class(2, 0.75, ADMISSION_DEADLINE, STATEMENT_TIMEOUT),
+    "bulk": admission.Class(3, 0.5, ADMISSION_DEADLINE, BULK_STATEMENT_TIMEOUT),
+    # An export runs for as long as its client takes to download it.
+    "export": admission.Class(3, 0.5, ADMISSION_DEADLINE, 0),
+}
+
+# endpoint -> class; the other GET routes browse, the rest write.
+ROUTE_CLASSES = {
+    "checkout": "checkout",
+    "insert_order": "checkout",
+    "insert_pay": "checkout",
+    "orders_update_quantity": "checkout",
+    "product_delete": "write",
+    "supplier_delete": "write",
+    "client_delete": "write",
+    "import_rows": "bulk",
+    "bulk_delete": "bulk",
+    "export_rows": "export",
+}
+
+# Requests of these endpoints at once, at most; overridden by
+# ADMISSION_ROUTE_LIMITS, e.g. "report_view=4,import_rows=2".
+ROUTE_LIMITS = {"import_rows": 1, "bulk_delete": 1, "report_view": 2, "export_rows": 2}
+for limit in os.environ.get("ADMISSION_ROUTE_LIMITS", "").split(","):
+    if limit.strip():
+        endpoint, _, n = limit.partition("=")
+        ROUTE_LIMITS[endpoint.strip()] = int(n)
+
+# Endpoints that use no pooled connection, or have a timeout of their own.
+ADMISSION_EXEMPT = {
+    "static",
+    "index",
+    "insert_client",
+    "insert_supplier",
+    "insert_product",
+    "payment_method",
+    "final_payment",
+    "choose_quantity",
+    "cache_stats",
+    "query_stats",
+    "events",
+    "metrics_view",
+    "ready",
+    "ping",
+}
+
+gate = admission.Gate(
+    max(POOL_MAX_SIZE, POOL_MIN_SIZE), ADMISSION_CLASSES, ADMISSION_QUEUE_SIZE, ROUTE_LIMITS
+)
+
+
+def admission_class():
+    """The name of the class of this request, or ``None`` if it is not admitted through the gate."""
+    if request.endpoint is None or request.endpoint in ADMISSION_EXEMPT:
+        return None
+    default = "browse" if request.method in ("GET", "HEAD") else "write"
+    return ROUTE_CLASSES.get(request.endpoint, default)
+
+
+def admit_request():
+    """Wait for this request to be admitted; return its ticket, or ``None`` if exempt."""
+    name = admission_class()
+    if name is None:
+        return None
+    return gate.admit(request.endpoint, name)
+
+
+@app.before_request
+def admit():
+    # The ASGI list views are admitted beforehand, off the event loop.
+    if "admission" not in g:
+        g.admission = admit_request()
+
+
+@app.teardown_request
+def release_admission(exc):
+    # Streamed pages are torn down, hence hold their slot, until sent.
+    ticket = g.pop("admission", None)
+    if ticket is not None:
+        ticket.release()
+
+
+def set_statement_timeout(conn):
+    """Give the transaction on ``conn`` the statement timeout of the class of this request."""
+    ticket = g.get("admission")
+    if ticket is not None and ticket.cls.statement_timeout != STATEMENT_TIMEOUT:
+        conn.execute(
+            "SELECT set_config('statement_timeout', %s, true);",
+            (str(ticket.cls.statement_timeout),),
+            prepare=False,
+        )
+
+
+def busy(reason):
+    """Count a request shed for ``reason`` and answer it 503 with Retry-After."""
+    metrics.ADMISSION_SHED.inc(request.endpoint, admission_class(), reason)
+    return (
+        jsonify({"message": "The server is busy. Retry shortly.", "status": "error"}),
+        503,
+        {"Retry-After": str(admission.RETRY_AFTER)},
+    )
+
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    log.warning(f"No connection for {request.endpoint}: {e}")
+    return busy("pool_timeout")
+
+
+@app.errorhandler(psycopg.errors.QueryCanceled)
+def statement_timeout(e):
+    log.warning(f"Statement canceled in {request.endpoint}: {e}")
+    return busy("statement_timeout")
+
+
+def collect_admission_stats():
+    stats = gate.stats()
+    yield "http_requests_admitted", "gauge", "Requests holding an admission slot.", [
+        ({"class": name}, values["active"]) for name, values in stats.items()
+    ]
+    yield "http_requests_waiting", "gauge", "Requests waiting to be admitted.", [
+        ({"class": name}, values["waiting"]) for name, values in stats.items()
+    ]
+    yield "http_admission_slots", "gauge", "Slots each class may fill.", [
+        ({"class": name}, gate.slots(cls)) for name, cls in ADMISSION_CLASSES.items()
+    ]
+
+
+metrics.Collector(collect_admission_stats)
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply the pending schema migrations."""
+    migrate()
+
+
+# Catalog pages and single products, served without touching the database
+# until a product write invalidates them or they expire.
+CACHE_SIZE = 512
+CACHE_TTL = 30
+
+catalog_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+product_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+def invalidate_product(SKU):
+    catalog_cache.invalidate()
+    product_cache.invalidate(SKU)
+    invalidate_sales()
+
+
+# OLAP report results, by report, year and grouping. The fact table they read
+# is kept current by triggers; the cache is dropped on every write that
+# reaches it (payments, order lines, prices, addresses).
+REPORT_TTL = 300
+
+report_cache = TTLCache(maxsize=CACHE_SIZE, ttl=REPORT_TTL)
+
+
+def invalidate_sales():
+    report_cache.invalidate()
+
+
+def cache_stats_by_name():
+    return {
+        "catalog": catalog_cache.stats(),
+        "product": product_cache.stats(),
+        "report": report_cache.stats(),
+    }
+
+
+def collect_cache_stats():
+    stats = cache_stats_by_name()
+    for key, metric, type, help in (
+        ("hits", "cache_hits_total", "counter", "Lookups served from the cache."),
+        ("misses", "cache_misses_total", "counter", "Lookups that went to the database."),
+        ("size", "cache_entries", "gauge", "Entries currently cached."),
+    ):
+        yield metric, type, help, [({"cache": name}, values[key]) for name, values in stats.items()]
+
+
+metrics.Collector(collect_cache_stats)
+
+
+def page_query(keyset):
+    """Parse the cursor and limit arguments into the query of one page.
+
+    Returns ``(cursor, limit, query, params)``, ``query`` being a
+    :class:`queries.Query`.
+    """
+    try:
+        cursor = pagination.decode_cursor(request.args.get("cursor"), keyset.key)
+        limit = pagination.page_size(request.args.get("limit"))
+        query = queries.PAGES[keyset.name][keyset.variant(cursor)]
+    except pagination.InvalidCursor as e:
+        abort(400, str(e))
+    return cursor, limit, query, keyset.params(cursor, limit)
+
+
+def page_cache_key(limit):
+    # Keyed by the version of the table too (see check_not_modified), so a
+    # page cached before another process wrote is not served under the ETag
+    # of the newer version.
+    row = g.get("table_version")
+    return (row.version if row is not None else None, request.args.get("cursor"), limit)
+
+
+def fetch_page(keyset, cache=None, params=None):
+    """Fetch the page of ``keyset`` selected by the cursor and limit arguments.
+
+    ``params`` are the parameters of the ``where`` condition of ``keyset``.
+    """
+    cursor, limit, query, page_params = page_query(keyset)
+    params = {**(params or {}), **page_params}
+
+    def load():
+        with read_connection() as conn:
+            with queries.cursor(conn) as cur:
+                rows = query.execute(cur, params).fetchall()
+                log.debug(f"Found {cur.rowcount} rows.")
+        return keyset.page(rows, cursor, limit)
+
+    if cache is None:
+        return load()
+    return cache.get(page_cache_key(limit), load)
+
+
+def fetch_product(SKU):
+    """Fetch one product by SKU, or ``None`` if there is no such product."""
+
+    def load():
+        with read_connection() as conn:
+            with queries.cursor(conn) as cur:
+                product = queries.PRODUCT_BY_SKU.execute(cur, {"SKU": SKU}).fetchone()
+                log.debug(f"Found {cur.rowcount} rows.")
+        return product
+
+    return product_cache.get(SKU, load)
+
+
+def wants_json():
+    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
+    return (
+        request.accept_mimetypes["application/json"]
+        and not request.accept_mimetypes["text/html"]
+    )
+
+
+def api_shape():
+    """The shape of the rows of a JSON response (see serialization.py), from ``?shape=``."""
+    shape = request.args.get("shape") or "records"
+    if shape not in serialization.SHAPES:
+        abort(400, f"Shape is required to be one of {', '.join(serialization.SHAPES)}.")
+    return shape
+
+
+def render_page(page, template, name, **context):
+    """Respond with ``page`` as JSON or render it as ``name`` in ``template``."""
+    if wants_json():
+        return serialization.response(serialization.page(page, api_shape()))
+
+    return render_template(template, page=page, **{name: page.items}, **context)
+
+
+# Streamed list pages: the rows are read from a server-side cursor in
+# batches and every row is rendered as soon as it arrives, so the response
+# starts before the query finishes and the worker never holds the whole page.
+STREAM_BATCH = 50
+# Rendered pieces are sent in chunks of about this many bytes.
+STREAM_CHUNK = 8192
+
+
+def stream_rows(query, params):
+    """Return an iterator over the rows of ``query``, read from a server-side (named) cursor.
+
+    The statement runs and its first batch is fetched before this returns,
+    so a timeout or a missing connection is answered by the error handlers,
+    not by cutting the page short once its status has been sent.
+    """
+    rows = read_rows(query, params)
+    next(rows)
+    return rows
+
+
+def read_rows(query, params):
+    """Yield ``None`` once the first batch of ``query`` is fetched, then its rows."""
+    start = time.perf_counter()
+    count = 0
+    with read_connection() as conn:
+        # DECLARE takes the statement itself, not an EXECUTE of the prepared one.
+        with conn.cursor(name=query.name, row_factory=namedtuple_row) as cur:
+            cur.itersize = STREAM_BATCH
+            cur.execute(query.sql, params)
+            # DECLARE only plans the statement; the first FETCH runs it.
+            batch = cur.fetchmany(STREAM_BATCH)
+            yield None
+            for row in itertools.chain(batch, cur):
+                count += 1
+                yield row
+    query.record(time.perf_counter() - start, count)
+
+
+def buffered(chunks, size=STREAM_CHUNK):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def stream_page(keyset, template, name, cache=None, params=None, **context):
+    """Respond with the page of ``keyset`` as :func:`render_page` does, streaming HTML.
+
+    A page found in ``cache`` is rendered from there; otherwise its rows are
+    rendered as they are read and the page is cached once complete.
+    """
+    if wants_json():
+        return render_page(fetch_page(keyset, cache, params), template, name, **context)
+
+    cursor, limit, query, page_params = page_query(keyset)
+    page = None
+    done = None
+    if cache is not None:
+        key = page_cache_key(limit)
+        hit, page, version = cache.lookup(key)
+        if not hit:
+            done = functools.partial(cache.store, key, version=version)
+    rows = None
+    if page is None:
+        rows = stream_rows(query, {**(params or {}), **page_params})
+        page = keyset.stream(rows, cursor, limit, done)
+
+    chunks = stream_template(template, page=page, **{name: page.items}, **context)
+    response = app.response_class(buffered(chunks), mimetype="text/html")
+    if rows is not None:
+        # A page never sent in full (HEAD, a client gone) returns its
+        # connection when the response is closed.
+        response.call_on_close(rows.close)
+    return response
+
+# Conditional GET of the lists. A list is versioned by the change counter of
+# its table (migrations 0005 and 0009), and its ETag names that version and the
+# representation, so a client or shared cache holding the current page is
+# answered 304 without running the list query.
+VERSIONED = {
+    "product_index": "product",
+    "order_index": "product",
+    "product_search": "product",
+    "order_search": "product",
+    "supplier_index": "supplier",
+    "client_index": "customer",
+    "start_order": "orders",
+}
+
+# The HTML pages also change with the templates.
+TEMPLATES_VERSION = hashlib.sha256(
+    b"".join(path.read_bytes() for path in sorted(Path(app.root_path, "templates").glob("*.html")))
+).hexdigest()[:12]
+
+
+def fetch_table_version(table):
+    """The ``(version, changed_at)`` of ``table``, or ``None`` if it is not versioned."""
+    with read_connection() as conn:
+        with queries.cursor(conn) as cur:
+            return queries.TABLE_VERSION.execute(cur, {"name": table}).fetchone()
+
+
+def list_etag(table, version):
+    # Strong, so every representation (JSON or HTML, and each content
+    # encoding) of a version has its own tag.
+    representation = f"json-{api_shape()}" if wants_json() else f"html-{TEMPLATES_VERSION}"
+    encoding = compression.negotiate(request.accept_encodings) or "identity"
+    return f"{table}-{version}-{representation}-{encoding}"
+
+
+@app.before_request
+def check_not_modified():
+    table = VERSIONED.get(request.endpoint)
+    if table is None:
+        return None
+    # The ASGI list views read the version on the async pool beforehand, and
+    # set it even if None: reading it here would block their event loop.
+    row = g.table_version if "table_version" in g else fetch_table_version(table)
+    if row is None:
+        return None
+    g.table_version = row
+    g.validators = (list_etag(table, row.version), row.changed_at)
+    if not is_resource_modified(request.environ, etag=g.validators[0], last_modified=row.changed_at):
+        return app.response_class(status=304)
+    return None
+
+
+@app.after_request
+def set_validators(response):
+    validators = g.get("validators")
+    if validators is not None and response.status_code in (200, 304):
+        etag, last_modified = validators
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Shared caches may keep the lists, but revalidate them on every use.
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.must_revalidate = True
+        response.vary.add("Accept")
+        response.vary.add("Accept-Encoding")
+    return response
+
+
 @app.route('/')
 def index():
   try:
@@ -54,103 +733,43 @@ def index():
 def product_index():
     """Show all the products, cheapest first."""
 
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            products = cur.execute(
-                """
-                SELECT name, SKU, description, price, ean
-                FROM product
-                ORDER BY price ASC;
-                """,
-                {},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(products)
-
-    return render_template("product.html", products=products)
+    return stream_page(PRODUCTS, "product.html", "products", catalog_cache)
 
 @app.route("/suppliers", methods=("GET",))
 def supplier_index():
     """Show all the suppliers, first the most recents."""
 
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            suppliers = cur.execute(
-                """
-                SELECT TIN, supplier.name, supplier.address, SKU, date
-                FROM supplier
-                ORDER BY date DESC;
-                """,
-                {},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(suppliers)
-
-    return render_template("supplier.html", suppliers=suppliers)
+    return stream_page(SUPPLIERS, "supplier.html", "suppliers")
 
 @app.route("/clients", methods=("GET",))
 def client_index():
     """Show all the clients, first the most recents."""
 
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            clients = cur.execute(
-                """
-                SELECT cust_no, customer.name, email, phone, customer.address
-                FROM customer
-                ORDER BY cust_no DESC;
-                """,
-                {},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(clients)
-
-    return render_template("client.html", clients=clients)
+    return stream_page(CLIENTS, "client.html", "clients")
 
 @app.route("/orders/<order_no>/<cust_no>/insert_pay")
 def insert_pay(order_no, cust_no):
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                INSERT INTO pay VALUES(%(order_no)s, %(cust_no)s);
-                """,
-                {"order_no": order_no, "cust_no": cust_no}
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
+            queries.INSERT_PAY.execute(
+                cur,
+                {"order_no": order_no, "cust_no": cust_no},
             )
         conn.commit()
+        invalidate_sales()
         return redirect(url_for("index"))
 
 @app.route("/list_products", methods=("POST","GET"))
 def insert_order():
     """Insert a order."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
             cust_no = request.args.get('cust_no')
             order_no = request.args.get('order_no')
             date = request.args.get('date')
-            cur.execute(
-                """
-                INSERT INTO orders VALUES(%(order_no)s, %(cust_no)s, %(date)s);
-                """,
-                {"order_no": order_no, "cust_no": cust_no, "date": date}
+            queries.INSERT_ORDER.execute(
+                cur,
+                {"order_no": order_no, "cust_no": cust_no, "date": date},
             )
         conn.commit()
         return redirect(url_for("order_index", order_no = order_no, cust_no = cust_no, date = date))
@@ -159,41 +778,56 @@ def insert_order():
 def order_index(order_no, cust_no, date):
     """Show all the products available to order."""
 
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            orders = cur.execute(
-                """
-                SELECT name, SKU, description, price, ean
-                FROM product
-                ORDER BY price ASC;
-                """,
-                {},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(orders)
+    return stream_page(PRODUCTS, "make_order.html", "orders", catalog_cache, order_no=order_no, cust_no = cust_no, date = date)
+
+
+# Substring and fuzzy searches go through the trigram indexes, which cannot
+# narrow down terms shorter than a trigram.
+SEARCH_MIN_LENGTH = 3
+
+
+def search_args():
+    """The keyset and parameters of the product search given by the ``q`` and ``mode`` arguments."""
+    q = request.args.get("q", "").strip()
+    mode = request.args.get("mode") or "prefix"
+    if mode not in queries.SEARCHES:
+        abort(400, f"Mode is required to be one of {', '.join(queries.SEARCHES)}.")
+    if not q:
+        abort(400, "Search terms are required.")
+    if mode != "prefix" and len(q) < SEARCH_MIN_LENGTH:
+        abort(400, f"Search terms are required to have at least {SEARCH_MIN_LENGTH} characters.")
+    return queries.SEARCHES[mode], queries.search_params(mode, q)
+
+
+@app.route("/products/search", methods=("GET",))
+def product_search():
+    """Search the products by name (prefix) or name and description (substring, fuzzy)."""
+
+    keyset, params = search_args()
+
+    return stream_page(keyset, "product.html", "products", params=params)
+
+@app.route("/list_products/<order_no>/<cust_no>/<date>/search", methods=("GET",))
+def order_search(order_no, cust_no, date):
+    """Search the products available to order."""
 
-    return render_template("make_order.html", orders=orders, order_no=order_no, cust_no = cust_no, date = date)
+    keyset, params = search_args()
+
+    return stream_page(keyset, "make_order.html", "orders", params=params, order_no=order_no, cust_no = cust_no, date = date)
 
 @app.route("/client/execute_insert", methods=("POST",))
 def insert_client_into_db():
     """Insert the client."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
             cust_no = request.form['cust_no']
             name = request.form['name']
             email = request.form['email']
             phone = request.form['phone']
             address = request.form['address']
-            cur.execute(
-                """
-                INSERT INTO customer VALUES(%(cust_no)s, %(name)s, %(email)s, %(phone)s, %(address)s);
-                """,
-                {"cust_no": cust_no, "name": name, "email": email, "phone": phone, "address": address}
+            queries.INSERT_CLIENT.execute(
+                cur,
+                {"cust_no": cust_no, "name": name, "email": email, "phone": phone, "address": address},
             )
         conn.commit()
     return redirect(url_for("client_index"))
@@ -208,18 +842,16 @@ def insert_client():
 @app.route("/supplier/execute_insert", methods=("POST",))
 def insert_supplier_into_db():
     """Insert the supplier."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
             TIN = request.form['TIN']
             name = request.form['name']
             address = request.form['address']
             SKU = request.form['SKU']
             date = request.form['date']
-            cur.execute(
-                """
-                INSERT INTO supplier VALUES(%(TIN)s, %(name)s, %(address)s, %(SKU)s, %(date)s);
-                """,
-                {"TIN": TIN, "name": name, "address": address, "SKU": SKU, "date": date}
+            queries.INSERT_SUPPLIER.execute(
+                cur,
+                {"TIN": TIN, "name": name, "address": address, "SKU": SKU, "date": date},
             )
         conn.commit()
     return redirect(url_for("supplier_index"))
@@ -234,20 +866,19 @@ def insert_supplier():
 @app.route("/product/execute_insert", methods=("POST",))
 def insert_product_into_db():
     """Insert the product."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
             SKU = request.form['SKU']
             name = request.form['name']
             description = request.form['description']
             price = request.form['price']
             ean = request.form['ean']
-            cur.execute(
-                """
-                INSERT INTO product VALUES(%(SKU)s, %(name)s, %(description)s, %(price)s, %(ean)s);
-                """,
-                {"SKU": SKU, "name": name, "description": description, "price": price, "ean": ean}
+            queries.INSERT_PRODUCT.execute(
+                cur,
+                {"SKU": SKU, "name": name, "description": description, "price": price, "ean": ean},
             )
         conn.commit()
+    invalidate_product(SKU)
     return redirect(url_for("product_index"))
 
 @app.route('/product/insert_product')
@@ -257,158 +888,148 @@ def insert_product():
   except Exception as e:
     return str(e)
 
+BULK_DELETES = {
+    "products": queries.DELETE_PRODUCTS,
+    "clients": queries.DELETE_CLIENTS,
+    "suppliers": queries.DELETE_SUPPLIERS,
+}
+
+MAX_BULK_DELETE = 10000
+
+
+def delete_keys(query, keys):
+    """Run one of the cascade deletes on ``keys``; return the rows deleted."""
+    with write_connection() as conn:
+        with queries.cursor(conn) as cur:
+            query.execute(cur, {"keys": list(keys)})
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
+
+
 @app.route("/remove_product/<SKU>")
 def product_delete(SKU):
     """Delete the product."""
-    
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE 
-                FROM contains 
-                WHERE sku=%(SKU)s;
-                """,
-                {"SKU": SKU},
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM process 
-                WHERE order_no NOT IN 
-                ( SELECT order_no FROM orders JOIN contains USING (order_no));
-                """
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM pay  
-                WHERE order_no NOT IN 
-                ( SELECT order_no FROM orders JOIN contains USING (order_no));
-                """
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM orders
-                WHERE order_no NOT IN 
-                ( SELECT order_no FROM orders JOIN contains USING (order_no));
-                """
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE 
-                FROM delivery d USING supplier
-                WHERE d.tin IN
-                (SELECT tin FROM supplier WHERE SKU=%(SKU)s); 
-                """,
-                {"SKU": SKU},
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM supplier
-                WHERE SKU=%(SKU)s;
-                """,
-                {"SKU": SKU},
-                )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE  FROM product
-                WHERE SKU=%(SKU)s;
-                """,
-                {"SKU": SKU},
-            )
-        conn.commit()
+    delete_keys(queries.DELETE_PRODUCTS, [SKU])
+    invalidate_product(SKU)
     return redirect(url_for("product_index"))
 
 @app.route("/remove_supplier/<TIN>")
 def supplier_delete(TIN):
     """Delete the supplier."""
-
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM delivery
-                WHERE tin=%(TIN)s;
-                """,
-                {"TIN": TIN},
-            )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM supplier
-                WHERE tin=%(TIN)s;
-                """,
-                {"TIN": TIN},
-            )
-        conn.commit()
+    delete_keys(queries.DELETE_SUPPLIERS, [TIN])
     return redirect(url_for("supplier_index"))
 
 @app.route("/remove_client/<cust_no>")
 def client_delete(cust_no):
     """Delete the client."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE  
-                FROM contains c USING orders 
-                WHERE c.order_no IN (SELECT order_no FROM orders WHERE cust_no=%(cust_no)s);
-                """,
-                {"cust_no": cust_no},
-            )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE
-                FROM process p USING orders
-                WHERE p.order_no IN (SELECT order_no FROM orders WHERE cust_no=%(cust_no)s);
-                """,
-                {"cust_no": cust_no},
-            )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM pay
-                WHERE cust_no=%(cust_no)s;
-
-                """,
-                {"cust_no": cust_no},
-            )
-        conn.commit()
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM orders  
-                WHERE cust_no=%(cust_no)s;
-                """,
-                {"cust_no": cust_no},
-            )
-        conn.commit()    
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                DELETE FROM customer 
-                WHERE cust_no=%(cust_no)s;
-                """,
-                {"cust_no": cust_no},
-            )
-        conn.commit()    
+    delete_keys(queries.DELETE_CLIENTS, [cust_no])
+    invalidate_sales()
     return redirect(url_for("client_index"))
+
+@app.route("/remove/<kind>", methods=("POST",))
+def bulk_delete(kind):
+    """Delete a list of SKUs, cust_nos or TINs in one transaction.
+
+    The keys are sent as a JSON body ``{"keys": [...]}`` or as repeated
+    ``keys`` form fields.
+    """
+    query = BULK_DELETES.get(kind)
+    if query is None:
+        abort(404)
+
+    if request.is_json:
+        keys = (request.get_json(silent=True) or {}).get("keys")
+    else:
+        keys = request.form.getlist("keys")
+    if not isinstance(keys, list) or not keys:
+        abort(400, "A list of keys is required.")
+    if len(keys) > MAX_BULK_DELETE:
+        abort(400, f"At most {MAX_BULK_DELETE} keys can be deleted at once.")
+    keys = [str(key) for key in keys]
+    if kind == "clients" and not all(key.isnumeric() for key in keys):
+        abort(400, "Customer numbers are required to be numeric.")
+
+    deleted = delete_keys(query, keys)
+    if kind == "products":
+        invalidate_product(None)
+    elif kind == "clients":
+        invalidate_sales()
+    return jsonify({"deleted": deleted, "status": "success"})
  
+@app.route("/import/<kind>", methods=("POST",))
+def import_rows(kind):
+    """Import products, clients or suppliers from a CSV or NDJSON upload.
+
+    The file is sent as the ``file`` field of a multipart form or as the raw
+    request body; the format is taken from ``?format=``, the file name or the
+    content type, defaulting to CSV.
+    """
+    if kind not in bulk_import.TARGETS:
+        abort(404)
+
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, filename, mimetype = upload.stream, upload.filename or "", upload.mimetype
+    else:
+        stream, filename, mimetype = request.stream, "", request.mimetype
+
+    format = request.args.get("format")
+    if format is None:
+        ndjson = filename.endswith((".ndjson", ".jsonl")) or mimetype in (
+            "application/x-ndjson",
+            "application/jsonl",
+        )
+        format = "ndjson" if ndjson else "csv"
+    if format not in bulk_import.FORMATS:
+        abort(400, f"Format is required to be one of {', '.join(bulk_import.FORMATS)}.")
+
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    try:
+        with write_connection() as conn:
+            result = bulk_import.import_stream(conn, kind, text, format)
+    except UnicodeDecodeError:
+        abort(400, "Uploads are required to be UTF-8 text.")
+    finally:
+        text.detach()
+
+    if kind == "products":
+        invalidate_product(None)
+    elif kind == "clients":
+        invalidate_sales()
+    return jsonify(result.as_dict())
+
+@app.route("/export/<kind>", methods=("GET",))
+def export_rows(kind):
+    """Export a table, or the product sales, as CSV or NDJSON.
+
+    ``?format=`` is ``csv`` (the default) or ``ndjson``; ``?from=`` and
+    ``?to=`` limit the rows to a range of days, both included. The rows are
+    streamed as the database writes them.
+    """
+    if kind not in bulk_export.SOURCES:
+        abort(404)
+
+    format = request.args.get("format") or "csv"
+    if format not in bulk_export.FORMATS:
+        abort(400, f"Format is required to be one of {', '.join(bulk_export.FORMATS)}.")
+    try:
+        start = bulk_export.parse_date(request.args.get("from"), "from")
+        end = bulk_export.parse_date(request.args.get("to"), "to")
+        bulk_export.export_query(kind, format, start, end)
+    except bulk_export.ExportError as e:
+        abort(400, str(e))
+
+    def chunks():
+        with read_connection() as conn:
+            yield from bulk_export.export_stream(conn, kind, format, start, end)
+
+    return app.response_class(
+        stream_with_context(chunks()),
+        mimetype=bulk_export.MIMETYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
+
 @app.route('/orders/<order_no>/<cust_no>/payment_method')
 def payment_method(order_no, cust_no):
   try:
@@ -432,25 +1053,10 @@ def final_payment(order_no, cust_no):
 @app.route("/orders", methods=("GET",))  
 def start_order():
     """Choose the order number and client number"""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            orders = cur.execute(
-                """
-                SELECT order_no, cust_no, date
-                FROM orders
-                ORDER BY order_no ASC;
-                """,
-                {},
-            ).fetchall()
-            log.debug(f"Found {cur.rowcount} rows.")
-    # API-like response is returned to clients that request JSON explicitly (e.g., fetch)
-    if (
-        request.accept_mimetypes["application/json"]
-        and not request.accept_mimetypes["text/html"]
-    ):
-        return jsonify(orders)
 
-    return render_template("start_order.html", orders=orders, params=request.args)
+    page = fetch_page(ORDERS)
+
+    return render_page(page, "start_order.html", "orders", params=request.args)
  
 @app.route('/orders/<SKU>/<order_no>/<cust_no>/<date>')
 def choose_quantity(SKU,order_no,cust_no,date):
@@ -473,31 +1079,95 @@ def orders_update_quantity(SKU, order_no, cust_no, date):
     if error is not None:
         flash(error)
     else:
-        with pool.connection() as conn:
-            with conn.cursor(row_factory=namedtuple_row) as cur:
-                cur.execute(
-                    """
-                    INSERT INTO contains VALUES(%(order_no)s,%(SKU)s,%(quantity)s);
-                    """,
+        with write_connection() as conn:
+            with queries.cursor(conn) as cur:
+                queries.INSERT_CONTAINS.execute(
+                    cur,
                     {"order_no": order_no, "SKU": SKU, "quantity": quantity},
                 )
             conn.commit()
+        invalidate_sales()
     return redirect(url_for("order_index", order_no = order_no, cust_no = cust_no, date =date))
 
+def checkout_error(message, status=400):
+    return jsonify({"message": message, "status": "error"}), status
+
+
+@app.route("/checkout", methods=("POST",))
+def checkout():
+    """Place a whole order in one request and one transaction.
+
+    Takes a JSON body ``{"order_no", "cust_no", "date", "lines": [{"sku",
+    "qty"}, ...], "pay": false}``. The order, all its ``contains`` rows and,
+    if ``pay`` is set, the payment are sent in a single pipeline and
+    committed together, so the deferred order_in_contains check sees the
+    complete order.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return checkout_error("A JSON object is required.")
+
+    order_no, cust_no, date = data.get("order_no"), data.get("cust_no"), data.get("date")
+    if not isinstance(order_no, int) or not isinstance(cust_no, int):
+        return checkout_error("order_no and cust_no are required to be integers.")
+    try:
+        date = Date.fromisoformat(date)
+    except (TypeError, ValueError):
+        return checkout_error("date is required to be a YYYY-MM-DD date.")
+
+    lines = data.get("lines")
+    if not isinstance(lines, list) or not lines:
+        return checkout_error("At least one order line is required.")
+    quantities = {}
+    for line in lines:
+        if not isinstance(line, dict) or not line.get("sku"):
+            return checkout_error("Every order line requires a sku.")
+        qty = line.get("qty")
+        if not isinstance(qty, int) or qty < 1:
+            return checkout_error("Quantity is required to be a positive integer.")
+        quantities[line["sku"]] = quantities.get(line["sku"], 0) + qty
+
+    try:
+        with write_connection() as conn:
+            with conn.pipeline():
+                with queries.cursor(conn) as cur:
+                    queries.INSERT_ORDER.execute(
+                        cur,
+                        {"order_no": order_no, "cust_no": cust_no, "date": date},
+                    )
+                    queries.INSERT_CONTAINS.executemany(
+                        cur,
+                        [
+                            {"order_no": order_no, "SKU": SKU, "quantity": qty}
+                            for SKU, qty in quantities.items()
+                        ],
+                    )
+                    if data.get("pay"):
+                        queries.INSERT_PAY.execute(
+                            cur,
+                            {"order_no": order_no, "cust_no": cust_no},
+                        )
+                conn.commit()
+    except psycopg.errors.UniqueViolation:
+        return checkout_error(f"Order {order_no} already exists.", 409)
+    except (psycopg.errors.ForeignKeyViolation, psycopg.errors.DataError) as e:
+        return checkout_error(e.diag.message_detail or e.diag.message_primary)
+
+    if data.get("pay"):
+        invalidate_sales()
+    return jsonify(
+        {
+            "order_no": order_no,
+            "lines": len(quantities),
+            "paid": bool(data.get("pay")),
+            "status": "success",
+        }
+    ), 201
+
 @app.route("/products/<SKU>/update_product_price", methods=("GET", "POST"))
 def product_price_update(SKU):
     """Update the product price."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            product = cur.execute(
-                """
-                SELECT name, SKU, description, price, ean
-                FROM product
-                WHERE SKU = %(SKU)s;
-                """,
-                {"SKU": SKU},
-            ).fetchone()
-            log.debug(f"Found {cur.rowcount} rows.")
+    product = fetch_product(SKU)
 
     if request.method == "POST":
         price = request.form["price"]
@@ -512,17 +1182,14 @@ def product_price_update(SKU):
         if error is not None:
             flash(error)
         else:
-            with pool.connection() as conn:
-                with conn.cursor(row_factory=namedtuple_row) as cur:
-                    cur.execute(
-                        """
-                        UPDATE product
-                        SET price = %(price)s
-                        WHERE SKU = %(SKU)s;
-                        """,
+            with write_connection() as conn:
+                with queries.cursor(conn) as cur:
+                    queries.UPDATE_PRODUCT_PRICE.execute(
+                        cur,
                         {"SKU": SKU, "price": price},
                     )
                 conn.commit()
+            invalidate_product(SKU)
             return redirect(url_for("product_index"))
 
     return render_template("update_product_price.html", product=product)
@@ -530,17 +1197,7 @@ def product_price_update(SKU):
 @app.route("/products/<SKU>/update_product_description", methods=("GET", "POST"))
 def product_description_update(SKU):
     """Update the product description."""
-    with pool.connection() as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            product = cur.execute(
-                """
-                SELECT name, SKU, description, price, ean
-                FROM product
-                WHERE SKU = %(SKU)s;
-                """,
-                {"SKU": SKU},
-            ).fetchone()
-            log.debug(f"Found {cur.rowcount} rows.")
+    product = fetch_product(SKU)
 
     if request.method == "POST":
         description = request.form["description"]
@@ -555,22 +1212,181 @@ def product_description_update(SKU):
         if error is not None:
             flash(error)
         else:
-            with pool.connection() as conn:
-                with conn.cursor(row_factory=namedtuple_row) as cur:
-                    cur.execute(
-                        """
-                        UPDATE product
-                        SET description = %(description)s
-                        WHERE SKU = %(SKU)s;
-                        """,
+            with write_connection() as conn:
+                with queries.cursor(conn) as cur:
+                    queries.UPDATE_PRODUCT_DESCRIPTION.execute(
+                        cur,
                         {"SKU": SKU, "description": description},
                     )
                 conn.commit()
+            invalidate_product(SKU)
             return redirect(url_for("product_index"))
 
     return render_template("update_product_description.html", product=product)
 
 
+def fetch_report(report, grouping, year):
+    """Fetch the ``(columns, rows)`` of one grouping of an OLAP report for ``year``."""
+
+    def load():
+        with read_connection() as conn:
+            with serialization.cursor(conn) as cur:
+                rows = queries.REPORTS[report][grouping].execute(cur, {"year": year}).fetchall()
+                log.debug(f"Found {cur.rowcount} rows.")
+                return serialization.columns(cur), rows
+
+    return report_cache.get((report, year, grouping), load)
+
+
+@app.route("/reports/<report>", methods=("GET",))
+def report_view(report):
+    """Serve the ``sales`` or ``daily_average`` OLAP report as JSON.
+
+    ``?year=`` defaults to the current year; ``?by=`` selects the groupings
+    and may be repeated, defaulting to every grouping of the report;
+    ``?shape=columns`` writes the rows of each grouping column by column.
+    """
+    groupings = queries.REPORTS.get(report)
+    if groupings is None:
+        abort(404)
+
+    year = request.args.get("year", "")
+    if not year:
+        year = Date.today().year
+    elif year.isnumeric():
+        year = int(year)
+    else:
+        abort(400, "Year is required to be numeric.")
+
+    by = request.args.getlist("by") or list(groupings)
+    for grouping in by:
+        if grouping not in groupings:
+            abort(400, f"Grouping is required to be one of {', '.join(groupings)}.")
+    shape = api_shape()
+
+    return serialization.response(
+        {
+            "report": report,
+            "year": year,
+            "groupings": {
+                grouping: serialization.shape_rows(*fetch_report(report, grouping, year), shape)
+                for grouping in by
+            },
+        }
+    )
+
+
+@app.route("/orders/<int:order_no>/total", methods=("GET",))
+def order_total(order_no):
+    """Show the total value of an order, and whether it is paid."""
+    with read_connection() as conn:
+        with serialization.cursor(conn) as cur:
+            total = queries.ORDER_TOTAL.execute(cur, {"order_no": order_no}).fetchone()
+            names = serialization.columns(cur)
+    if total is None:
+        abort(404)
+    return serialization.response(dict(zip(names, total)))
+
+
+TOP_CLIENTS = 10
+MAX_TOP_CLIENTS = 100
+
+
+@app.route("/clients/top", methods=("GET",))
+def top_clients():
+    """Show the clients who paid the most, highest paid value first.
+
+    ``?limit=`` is how many, 10 by default and at most ``MAX_TOP_CLIENTS``;
+    ``?shape=columns`` writes the rows column by column.
+    """
+    limit = request.args.get("limit", "")
+    if not limit:
+        limit = TOP_CLIENTS
+    elif limit.isnumeric() and int(limit) > 0:
+        limit = min(int(limit), MAX_TOP_CLIENTS)
+    else:
+        abort(400, "Limit is required to be a positive number.")
+    shape = api_shape()
+
+    with read_connection() as conn:
+        with serialization.cursor(conn) as cur:
+            clients = queries.TOP_CUSTOMERS.execute(cur, {"limit": limit}).fetchall()
+            names = serialization.columns(cur)
+    return serialization.response(
+        {"clients": serialization.shape_rows(names, clients, shape), "limit": limit}
+    )
+
+
+@app.route("/cache/stats", methods=("GET",))
+def cache_stats():
+    """Show the hit/miss counters of the catalog caches."""
+    return jsonify(cache_stats_by_name())
+
+
+@app.route("/queries/stats", methods=("GET",))
+def query_stats():
+    """Show the execution counts and timings of every SQL statement."""
+    return jsonify(queries.stats())
+
+
+# One LISTEN connection per process feeds every open /events stream.
+broker = live.Broker(DATABASE_URL, log)
+
+# Streams served at once by this process, at most, if it serves them on
+# threads: each holds its thread for as long as it is open, so a cap below
+# the threads of a worker keeps some for the other routes (see
+# gunicorn.conf.py). The streams of asgi.py hold no thread and are not
+# capped.
+LIVE_MAX_STREAMS = os.environ.get("LIVE_MAX_STREAMS")
+live_streams = threading.BoundedSemaphore(int(LIVE_MAX_STREAMS)) if LIVE_MAX_STREAMS else None
+
+
+def collect_live_stats():
+    stats = broker.stats()
+    yield "live_subscribers", "gauge", "Open live feed streams.", [({}, stats["subscribers"])]
+
+
+metrics.Collector(collect_live_stats)
+
+
+@app.route("/events", methods=("GET",))
+def events():
+    """Stream new orders, payments and product changes as Server-Sent Events."""
+    if live_streams is not None and not live_streams.acquire(blocking=False):
+        return busy("live_streams")
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    response = app.response_class(
+        broker.stream(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if live_streams is not None:
+        response.call_on_close(live_streams.release)
+    return response
+
+
+@app.route("/metrics", methods=("GET",))
+def metrics_view():
+    """Expose request, statement, pool and cache metrics to Prometheus."""
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
+READY_TIMEOUT = 2
+
+
+@app.route("/ready", methods=("GET",))
+def ready():
+    """Check that the schema is migrated and a pooled connection can be checked out and used."""
+    try:
+        migrate()
+        with pool.connection(timeout=READY_TIMEOUT) as conn:
+            conn.execute("SELECT 1;")
+    except (psycopg.Error, PoolTimeout) as e:
+        log.warning(f"Not ready: {e}")
+        return jsonify({"message": str(e), "status": "error"}), 503
+    return jsonify({"message": "ready", "status": "success"})
+
+
 @app.route("/ping", methods=("GET",))
 def ping():
     log.debug("ping!")
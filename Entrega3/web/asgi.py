@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+"""ASGI entry point: the app served on an asyncio event loop.
+
+The list endpoints (products, suppliers, clients, orders and the order
+product list) run natively on an ``AsyncConnectionPool``, so a worker keeps
+serving other requests while their queries are in flight. They reuse the
+keysets, statements, caches and templates of ``app.py``, read from the same
+replicas and are admitted by the same gate (see ``admission.py``), waiting
+for it in a thread. The live feed (``/events``) runs natively too, so an
+open stream holds no thread. Every other route is the Flask app itself, run
+in a thread through ``WsgiToAsgi``.
+
+Run with::
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5001
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import g
+from flask import request
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from psycopg_pool import PoolTimeout
+from werkzeug.exceptions import HTTPException
+
+import metrics
+import queries
+import live
+from app import admit_request
+from app import app
+from app import broker
+from app import catalog_cache
+from app import CONNECTION_OPTIONS
+from app import DATABASE_URL
+from app import migrate
+from app import page_cache_key
+from app import page_query
+from app import POOL_TIMEOUT
+from app import render_page
+from app import request_lsn
+from app import router
+from app import VERSIONED
+from queries import CLIENTS
+from queries import ORDERS
+from queries import PRODUCTS
+from queries import SUPPLIERS
+
+
+apool = AsyncConnectionPool(
+    conninfo=DATABASE_URL,
+    open=False,
+    configure=queries.prepare_async,
+    kwargs=CONNECTION_OPTIONS,
+    timeout=POOL_TIMEOUT,
+)
+metrics.POOLS["async"] = apool
+
+# The replicas of ``router``, in the same order.
+areplicas = [
+    AsyncConnectionPool(
+        conninfo=replica.conninfo,
+        open=False,
+        configure=queries.prepare_async,
+        kwargs=CONNECTION_OPTIONS,
+        timeout=POOL_TIMEOUT,
+    )
+    for replica in router.replicas
+]
+for replica, areplica in zip(router.replicas, areplicas):
+    metrics.POOLS[f"async-{replica.name}"] = areplica
+
+# endpoint -> (keyset, cache, template, name of the rows in the template)
+LIST_VIEWS = {
+    "product_index": (PRODUCTS, catalog_cache, "product.html", "products"),
+    "supplier_index": (SUPPLIERS, None, "supplier.html", "suppliers"),
+    "client_index": (CLIENTS, None, "client.html", "clients"),
+    "order_index": (PRODUCTS, catalog_cache, "make_order.html", "orders"),
+    "start_order": (ORDERS, None, "start_order.html", "orders"),
+}
+
+urls = app.url_map.bind("")
+wsgi = WsgiToAsgi(app)
+
+
+@asynccontextmanager
+async def read_connection():
+    """Async counterpart of ``app.read_connection``, for the GET list views."""
+    pool = g.get("read_pool")
+    if pool is None:
+        conn, pool = await router.checkout_async(areplicas, apool, request_lsn())
+        g.read_pool = pool
+    else:
+        conn = await pool.getconn()
+    try:
+        async with conn:
+            yield conn
+    finally:
+        await pool.putconn(conn)
+
+
+async def fetch_page(keyset, cache=None):
+    """Async counterpart of ``app.fetch_page``."""
+    cursor, limit, query, params = page_query(keyset)
+    if cache is not None:
+        hit, page, version = cache.lookup(page_cache_key(limit))
+        if hit:
+            return page
+
+    async with read_connection() as conn:
+        async with queries.async_cursor(conn) as cur:
+            await query.execute_async(cur, params)
+            rows = await cur.fetchall()
+            app.logger.debug(f"Found {cur.rowcount} rows.")
+    page = keyset.page(rows, cursor, limit)
+
+    if cache is not None:
+        cache.store(page_cache_key(limit), page, version)
+    return page
+
+
+async def fetch_table_version(table):
+    """Async counterpart of ``app.fetch_table_version``."""
+    async with read_connection() as conn:
+        async with queries.async_cursor(conn) as cur:
+            await queries.TABLE_VERSION.execute_async(cur, {"name": table})
+            return await cur.fetchone()
+
+
+async def list_view(scope, send, endpoint, view_args):
+    keyset, cache, template, name = LIST_VIEWS[endpoint]
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+    with app.test_request_context(
+        scope["path"],
+        method=scope["method"],
+        query_string=scope["query_string"].decode("latin-1"),
+        headers=headers,
+    ):
+        try:
+            # Waiting for a slot blocks, so not on the event loop.
+            g.admission = await asyncio.to_thread(admit_request)
+            if endpoint in VERSIONED:
+                g.table_version = await fetch_table_version(VERSIONED[endpoint])
+            # The before_request hooks (request timer, migrations, conditional
+            # GET) as in Flask.
+            rv = app.preprocess_request()
+            if rv is None:
+                page = await fetch_page(keyset, cache)
+                rv = render_page(page, template, name, params=request.args, **view_args)
+        except HTTPException as e:
+            rv = e.get_response()
+        except (PoolTimeout, psycopg.errors.QueryCanceled) as e:
+            # 503 with Retry-After, as the error handlers of the app answer.
+            rv = app.handle_user_exception(e)
+        response = app.process_response(app.make_response(rv))
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (k.lower().encode("latin-1"), v.encode("latin-1"))
+                for k, v in response.headers.items()
+            ],
+        }
+    )
+    body = b"" if scope["method"] == "HEAD" else response.get_data()
+    await send({"type": "http.response.body", "body": body})
+
+
+async def events_view(scope, receive, send):
+    """Async counterpart of ``app.events``: a stream costs a task, not a thread."""
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    last_event_id = headers.get("last-event-id") or query.get("last_event_id", [None])[0]
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    subscriber = broker.subscribe(lambda: loop.call_soon_threadsafe(wakeup.set), last_event_id)
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    gone = asyncio.ensure_future(disconnected())
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+        body = f"retry: {live.RETRY}\n\n"
+        while not gone.done():
+            wakeup.clear()
+            events, closed = subscriber.drain()
+            body += "".join(event.format() for event in events)
+            if body:
+                await send({"type": "http.response.body", "body": body.encode(), "more_body": True})
+            if closed:
+                break
+            woken = asyncio.ensure_future(wakeup.wait())
+            done, _ = await asyncio.wait({woken, gone}, timeout=live.HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            body = "" if done else ": keep-alive\n\n"
+        if not gone.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        broker.unsubscribe(subscriber)
+        gone.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await apool.open(wait=True)
+                for areplica in areplicas:
+                    await areplica.open(wait=True)
+                await asyncio.to_thread(migrate)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await apool.close()
+            for areplica in areplicas:
+                await areplica.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] == "GET" and scope["path"] == "/events":
+        return await events_view(scope, receive, send)
+
+    if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+        try:
+            endpoint, view_args = urls.match(scope["path"], scope["method"])
+        except HTTPException:
+            endpoint = None
+        if endpoint in LIST_VIEWS:
+            return await list_view(scope, send, endpoint, view_args)
+
+    return await wsgi(scope, receive, send)
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+"""Compare the sync (Flask) and async (ASGI) serving modes under load.
+
+Starts each mode in turn against the configured database, drives the list
+endpoints with many concurrent keep-alive clients and prints throughput and
+p50/p95/p99 latency per mode as JSON.
+
+Usage::
+
+    python bench/async_vs_sync.py --concurrency 256 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import loadgen
+from loadgen import Request
+
+
+WEB_DIR = Path(__file__).resolve().parent.parent
+
+MODES = {
+    "sync": ["-m", "flask", "--app", "wsgi", "run", "--with-threads", "--port", "{port}"],
+    "async": ["-m", "uvicorn", "asgi:application", "--no-access-log", "--port", "{port}"],
+}
+
+HEADERS = {"Accept": "application/json"}
+
+MIX = [
+    Request("products", "GET", "/products", weight=4),
+    Request("orders", "GET", "/orders", weight=2),
+    Request("clients", "GET", "/clients", weight=1),
+    Request("suppliers", "GET", "/suppliers", weight=1),
+]
+
+
+def serve(mode, port, env=None):
+    args = [arg.format(port=port) for arg in MODES[mode]]
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=WEB_DIR,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def bench(mode, args):
+    server = serve(mode, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(loadgen.wait_ready(base_url))
+        asyncio.run(loadgen.run(base_url, MIX, min(args.concurrency, 8), args.warmup, headers=HEADERS))
+        return asyncio.run(
+            loadgen.run(
+                base_url,
+                MIX,
+                args.concurrency,
+                args.duration,
+                headers=HEADERS,
+            )
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["sync", "async"])
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--port", type=int, default=5101)
+    args = parser.parse_args(argv)
+
+    results = {
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "modes": {mode: bench(mode, args) for mode in args.modes},
+    }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
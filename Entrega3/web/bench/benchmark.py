@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+"""Reproducible latency benchmark of the web app.
+
+Seeds a database at the given scale, starts the app on it and replays a mix
+of catalog browsing, ordering and catalog writes with many keep-alive
+clients. Prints throughput and p50/p95/p99 latency (ms) per route as JSON.
+
+Given a baseline (the JSON of an earlier run, e.g. saved with
+``--save-baseline``), every route is compared against it and the exit
+status is 1 when a route got slower, or lost throughput, by more than
+``--tolerance``.
+
+Usage::
+
+    python bench/benchmark.py --scale 1000 --save-baseline bench/baseline.json
+    python bench/benchmark.py --scale 1000 --baseline bench/baseline.json
+
+The database is dropped and recreated on every run; point ``--database``
+(or ``BENCH_DATABASE_URL``) at a database kept for benchmarking.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import date
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict
+from psycopg.conninfo import make_conninfo
+
+import loadgen
+import seed
+from async_vs_sync import MODES
+from async_vs_sync import serve
+from loadgen import Request
+
+
+BENCH_DATABASE_URL = os.environ.get("BENCH_DATABASE_URL", "postgres://db:db@postgres/bench")
+
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+# Metrics compared against the baseline; throughput is the only one where
+# higher is better.
+COMPARED = ("throughput", "p50", "p95", "p99")
+
+WARMUP_SEED_OFFSET = 10**6
+
+
+def traffic(scale):
+    """The request mix: mostly browsing, then ordering, then catalog writes."""
+    orders = scale * seed.ORDERS_PER_PRODUCT
+    customers = scale * seed.CUSTOMERS_PER_PRODUCT
+
+    def product(rng):
+        return seed.sku(rng.randint(1, scale))
+
+    def order(rng):
+        i = rng.randint(1, orders)
+        return i, 1 + i * 7 % customers, date(2021, 1, 1) + timedelta(days=i % 1095)
+
+    def new_key(rng):
+        # Above every seeded key, so inserts rarely collide.
+        return rng.randrange(10**8, 2**31 - 1)
+
+    def order_products(rng):
+        order_no, cust_no, day = order(rng)
+        return f"/list_products/{order_no}/{cust_no}/{day}"
+
+    def update_quantity_path(rng):
+        # Adds a line to an order. The route inserts it, so a product the
+        # order already has (one of its one to three lines) counts as an
+        # error; at any useful scale that is rare.
+        order_no, cust_no, day = order(rng)
+        return f"/orders/{product(rng)}/{order_no}/{cust_no}/{day}/update_quantity"
+
+    def quantity(rng):
+        return urlencode({"quantity": rng.randint(1, 10)})
+
+    def checkout(rng):
+        return {
+            "order_no": new_key(rng),
+            "cust_no": rng.randint(1, customers),
+            "date": str(date(2021, 1, 1) + timedelta(days=rng.randrange(1095))),
+            "lines": [{"sku": product(rng), "qty": rng.randint(1, 5)} for _ in range(rng.randint(1, 3))],
+            "pay": rng.random() < 0.7,
+        }
+
+    def new_client(rng):
+        key = new_key(rng)
+        return urlencode(
+            {
+                "cust_no": key,
+                "name": f"Client {key}",
+                "email": f"client{key}@example.com",
+                "phone": str(key),
+                "address": f"Rua {key}, 1000-001 Lisboa",
+            }
+        )
+
+    def new_product(rng):
+        key = new_key(rng)
+        return urlencode(
+            {
+                "SKU": f"new{key}",
+                "name": f"Product {key}",
+                "description": f"Description of product {key}",
+                "price": f"{rng.uniform(1, 500):.2f}",
+                "ean": 3000000000000 + key,
+            }
+        )
+
+    def price(rng):
+        return urlencode({"price": f"{rng.uniform(1, 500):.2f}"})
+
+    return [
+        Request("products", "GET", "/products", weight=30),
+        Request("products_full_page", "GET", "/products?limit=200", weight=5),
+        Request("suppliers", "GET", "/suppliers", weight=4),
+        Request("clients", "GET", "/clients", weight=4),
+        Request("orders", "GET", "/orders", weight=4),
+        Request("order_products", "GET", order_products, weight=10),
+        Request("update_quantity", "POST", update_quantity_path, weight=8, body=quantity, headers=FORM),
+        Request("checkout", "POST", "/checkout", weight=5, body=checkout),
+        Request("sales_report", "GET", "/reports/sales?year=2022", weight=2),
+        Request("order_total", "GET", lambda rng: f"/orders/{order(rng)[0]}/total", weight=3),
+        Request("top_clients", "GET", "/clients/top", weight=1),
+        Request("insert_client", "POST", "/client/execute_insert", weight=2, body=new_client, headers=FORM),
+        Request("insert_product", "POST", "/product/execute_insert", weight=2, body=new_product, headers=FORM),
+        Request(
+            "update_price",
+            "POST",
+            lambda rng: f"/products/{product(rng)}/update_product_price",
+            weight=3,
+            body=price,
+            headers=FORM,
+        ),
+        Request("delete_product", "GET", lambda rng: f"/remove_product/{product(rng)}", weight=1),
+    ]
+
+
+def create_database(url):
+    """Create the database of ``url`` if it does not exist yet."""
+    name = conninfo_to_dict(url)["dbname"]
+    with psycopg.connect(make_conninfo(url, dbname="postgres"), autocommit=True) as conn:
+        exists = conn.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,)).fetchone()
+        if not exists:
+            conn.execute(
+                sql.SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0;").format(
+                    sql.Identifier(name)
+                )
+            )
+
+
+def compare(result, baseline, tolerance):
+    """Per route change (%) of every compared metric, and the regressions."""
+    changes = {}
+    regressions = []
+    for name, stats in result["routes"].items():
+        base = baseline["routes"].get(name)
+        if base is None:
+            continue
+        changes[name] = {}
+        for metric in COMPARED:
+            new, old = stats.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            changes[name][metric] = round(change * 100, 1)
+            if (change < -tolerance) if metric == "throughput" else (change > tolerance):
+                regressions.append(f"{name}.{metric}")
+        if stats["errors"] and not base["errors"]:
+            regressions.append(f"{name}.errors")
+    return {
+        "comparable": result["config"] == baseline.get("config"),
+        "change_percent": changes,
+        "regressions": regressions,
+    }
+
+
+def bench(args):
+    if args.seed_database:
+        print(f"Seeding at scale {args.scale}...", file=sys.stderr)
+        create_database(args.database)
+        with psycopg.connect(args.database) as conn:
+            seed.seed(conn, args.scale)
+
+    mix = traffic(args.scale)
+    server = serve(args.mode, args.port, env={"DATABASE_URL": args.database})
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(loadgen.wait_ready(base_url))
+        # The warm-up clients draw other keys than the measured ones.
+        warmup_seed = args.seed + WARMUP_SEED_OFFSET
+        asyncio.run(loadgen.run(base_url, mix, min(args.concurrency, 8), args.warmup, seed=warmup_seed))
+        print(f"Running for {args.duration}s...", file=sys.stderr)
+        return asyncio.run(loadgen.run(base_url, mix, args.concurrency, args.duration, seed=args.seed))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default=BENCH_DATABASE_URL)
+    parser.add_argument("--scale", type=int, default=1000, help="number of products")
+    parser.add_argument("--no-seed", dest="seed_database", action="store_false", help="reuse the data as is")
+    parser.add_argument("--mode", choices=sorted(MODES), default="sync")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--port", type=int, default=5102)
+    parser.add_argument("--baseline", type=Path, help="JSON of an earlier run to compare with")
+    parser.add_argument("--save-baseline", type=Path, help="also write the result here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    result = {
+        "config": {
+            "scale": args.scale,
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        "routes": bench(args),
+    }
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(result, indent=2) + "\n")
+
+    status = 0
+    if args.baseline is not None:
+        result["comparison"] = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+        status = 1 if result["comparison"]["regressions"] else 0
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
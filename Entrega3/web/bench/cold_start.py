@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+"""Cold-start time of the app, as paid by every request served through CGI.
+
+Runs ``app.cgi`` in a new process per request and prints, as JSON, the
+median and p95 wall time (ms) of the import alone and of a whole request,
+for each path.
+
+Usage::
+
+    python bench/cold_start.py --runs 20 /products /clients
+    python bench/cold_start.py --env DB_PREPARE_STATEMENTS=1 /products
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+WEB_DIR = Path(__file__).resolve().parent.parent
+
+CGI_ENV = {
+    "REQUEST_METHOD": "GET",
+    "QUERY_STRING": "",
+    "SERVER_NAME": "localhost",
+    "SERVER_PORT": "80",
+    "SERVER_PROTOCOL": "HTTP/1.1",
+    "HTTP_ACCEPT": "application/json",
+}
+
+
+def timed(args, env):
+    start = time.perf_counter()
+    done = subprocess.run(args, cwd=WEB_DIR, env=env, capture_output=True)
+    elapsed = time.perf_counter() - start
+    if done.returncode != 0 or (args[-1] == "app.cgi" and not done.stdout.startswith(b"Status: 2")):
+        raise RuntimeError(f"{' '.join(args)} failed: {done.stdout[:200]!r} {done.stderr[-500:]!r}")
+    return elapsed
+
+
+def summary(seconds):
+    ms = sorted(s * 1000 for s in seconds)
+    return {
+        "p50": round(statistics.median(ms), 1),
+        "p95": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="*", default=["/products"])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE set for the app")
+    args = parser.parse_args(argv)
+
+    env = {**os.environ, **dict(item.split("=", 1) for item in args.env)}
+    result = {
+        "import": summary(
+            [timed([sys.executable, "-c", "import app"], env) for _ in range(args.runs)]
+        )
+    }
+    for path in args.paths:
+        cgi_env = {**env, **CGI_ENV, "PATH_INFO": path}
+        result[path] = summary(
+            [timed([sys.executable, "app.cgi"], cgi_env) for _ in range(args.runs)]
+        )
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+"""Bulk insert throughput under the integrity triggers of RI-2 and RI-3.
+
+Orders with their lines, and workplaces with their offices and warehouses,
+are inserted in batches of each ``--batches`` size, then the deferred checks
+are run (``SET CONSTRAINTS ALL IMMEDIATE``), with the triggers as each
+variant has them:
+
+- ``none``: no integrity triggers, the cost of the inserts alone;
+- ``row``: the row-level triggers of ``schema.sql``;
+- ``statement``: the statement-level triggers of migration 0008.
+
+Every run is rolled back. Prints as JSON the rows per second of each
+variant and the time the triggers add per row over ``none``.
+
+Usage::
+
+    python bench/integrity.py --orders 100000 --rows 10000 --batches 1,100,10000
+    python bench/integrity.py --no-seed
+
+The public schema of the database is replaced when seeding; point
+``--database`` (or ``BENCH_DATABASE_URL``) at a database kept for
+benchmarking.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import psycopg
+
+import seed  # noqa: F401 (puts the app on the path)
+import datagen
+from benchmark import create_database
+from migrations import apply_migrations
+
+
+BENCH_DATABASE_URL = os.environ.get("BENCH_DATABASE_URL", "postgres://db:db@postgres/bench")
+
+# Turns the triggers of migration 0008 into each variant, in the transaction
+# of the run.
+WITHOUT_TRIGGERS = """
+    DROP TRIGGER check_warehouse_office ON warehouse;
+    DROP TRIGGER check_warehouse_office ON office;
+    DROP TRIGGER workplace_pending ON workplace;
+    DROP TRIGGER orders_pending ON orders;
+"""
+
+VARIANTS = {
+    "none": WITHOUT_TRIGGERS,
+    "row": WITHOUT_TRIGGERS
+    + """
+    CREATE TRIGGER check_workplace_trigger AFTER INSERT ON warehouse
+    FOR EACH ROW EXECUTE FUNCTION check_warehouse_office();
+
+    CREATE TRIGGER check_workplace_trigger AFTER INSERT ON office
+    FOR EACH ROW EXECUTE FUNCTION check_warehouse_office();
+
+    CREATE CONSTRAINT TRIGGER check_workplace_trigger AFTER INSERT ON workplace
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION check_workplace();
+
+    CREATE CONSTRAINT TRIGGER order_in_contains AFTER INSERT ON orders
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION check_order_in_contains();
+    """,
+    "statement": "",
+}
+
+# workload -> statements inserting the rows first to last of a batch. Every
+# run inserts new keys (from ``offset``): the dead index entries a rolled back
+# run leaves would slow down the next runs on the same keys.
+WORKLOADS = {
+    "orders": (
+        """
+        INSERT INTO orders
+        SELECT %(base)s + %(offset)s + i, %(cust_no)s, DATE '2024-01-01'
+        FROM generate_series(%(first)s::INTEGER, %(last)s::INTEGER) i;
+        """,
+        """
+        INSERT INTO contains
+        SELECT %(base)s + %(offset)s + i, %(sku)s, 1
+        FROM generate_series(%(first)s::INTEGER, %(last)s::INTEGER) i;
+        """,
+    ),
+    "workplaces": (
+        """
+        INSERT INTO workplace
+        SELECT 'Bench workplace ' || (%(offset)s + i), -89.5, -179 + (%(offset)s + i) / 1000000.0
+        FROM generate_series(%(first)s::INTEGER, %(last)s::INTEGER) i;
+        """,
+        """
+        INSERT INTO office
+        SELECT 'Bench workplace ' || (%(offset)s + i)
+        FROM generate_series(%(first)s::INTEGER, %(last)s::INTEGER) i
+        WHERE i %% 2 = 0;
+        """,
+        """
+        INSERT INTO warehouse
+        SELECT 'Bench workplace ' || (%(offset)s + i)
+        FROM generate_series(%(first)s::INTEGER, %(last)s::INTEGER) i
+        WHERE i %% 2 = 1;
+        """,
+    ),
+}
+
+
+def insert_seconds(conn, variant, workload, rows, batch, params):
+    """Seconds to insert ``rows`` rows of ``workload`` in batches and check them."""
+    params["offset"] += rows
+    with conn.transaction(force_rollback=True):
+        conn.execute(VARIANTS[variant])
+        start = time.perf_counter()
+        for first in range(1, rows + 1, batch):
+            batch_params = {**params, "first": first, "last": min(first + batch - 1, rows)}
+            for statement in WORKLOADS[workload]:
+                conn.execute(statement, batch_params)
+        conn.execute("SET CONSTRAINTS ALL IMMEDIATE;")
+        return time.perf_counter() - start
+
+
+def bench(conn, rows, batches, runs):
+    params = {
+        "base": conn.execute("SELECT COALESCE(MAX(order_no), 0) FROM orders;").fetchone()[0],
+        "cust_no": conn.execute("SELECT MIN(cust_no) FROM customer;").fetchone()[0],
+        "sku": conn.execute("SELECT MIN(SKU) FROM product;").fetchone()[0],
+        "offset": 0,
+    }
+    results = {}
+    for workload in WORKLOADS:
+        results[workload] = {}
+        for batch in batches:
+            # The variants take turns, so none runs on a warmer database.
+            runs_seconds = {variant: [] for variant in VARIANTS}
+            for _ in range(runs):
+                for variant in VARIANTS:
+                    runs_seconds[variant].append(insert_seconds(conn, variant, workload, rows, batch, params))
+            seconds = {variant: min(elapsed) for variant, elapsed in runs_seconds.items()}
+            results[workload][f"batch_{batch}"] = {
+                variant: {
+                    "rows_per_second": round(rows / elapsed),
+                    "trigger_us_per_row": round((elapsed - seconds["none"]) / rows * 1e6, 1),
+                }
+                for variant, elapsed in seconds.items()
+            }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default=BENCH_DATABASE_URL)
+    parser.add_argument("--orders", type=int, default=100000, help="orders of the generated data")
+    parser.add_argument("--no-seed", dest="seed_database", action="store_false", help="reuse the data as is")
+    parser.add_argument("--rows", type=int, default=10000, help="rows inserted by each run")
+    parser.add_argument("--batches", default="1,100,10000", help="rows per statement, comma separated")
+    parser.add_argument("--runs", type=int, default=3, help="runs of each variant, the fastest is kept")
+    args = parser.parse_args(argv)
+    batches = [int(batch) for batch in args.batches.split(",")]
+
+    if args.seed_database:
+        print(f"Generating {args.orders} orders...", file=sys.stderr)
+        create_database(args.database)
+        with psycopg.connect(args.database) as conn:
+            datagen.generate(conn, args.orders, log=lambda message: print(message, file=sys.stderr))
+
+    with psycopg.connect(args.database) as conn:
+        apply_migrations(conn)
+        result = {
+            "config": {"rows": args.rows, "runs": args.runs},
+            "results": bench(conn, args.rows, batches, args.runs),
+        }
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
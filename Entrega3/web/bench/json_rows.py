@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""Microbenchmark of the JSON of the product and order pages.
+
+For a page of products and a page of orders, read with the statements of
+the lists, prints as JSON the rows per second each way of serializing them
+reaches, counting the encoding alone and the fetch and encoding together:
+
+- ``jsonify``: namedtuple rows through Flask's ``jsonify``, as positional
+  arrays (how the pages were served before ``serialization.py``);
+- ``page``: the namedtuple rows of the list pages through
+  ``serialization.page``;
+- ``records`` and ``columns``: tuple rows with ``NUMERIC`` as text, from
+  ``serialization.cursor``, in either shape;
+- ``records_json``: as ``records``, encoded by the json module (what runs
+  without orjson).
+
+Usage::
+
+    python bench/json_rows.py --rows 200 --seconds 2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import psycopg
+from flask import Flask
+from flask import jsonify
+
+import seed  # noqa: F401 (puts the app on the path)
+import queries
+import serialization
+from pagination import FIRST
+from pagination import Page
+
+
+BENCH_DATABASE_URL = os.environ.get("BENCH_DATABASE_URL", "postgres://db:db@postgres/bench")
+
+PAYLOADS = {"products": queries.PRODUCTS, "orders": queries.ORDERS}
+
+
+def fetch_namedtuples(conn, query, params):
+    with queries.cursor(conn) as cur:
+        return query.execute(cur, params).fetchall(), None
+
+
+def fetch_tuples(conn, query, params):
+    with serialization.cursor(conn) as cur:
+        return query.execute(cur, params).fetchall(), serialization.columns(cur)
+
+
+def encode_jsonify(rows, names):
+    return jsonify({"items": rows, "next": None, "prev": None}).get_data()
+
+
+def encode_page(rows, names):
+    return serialization.dumps(serialization.page(Page(rows, None, None)))
+
+
+def encode_records(rows, names):
+    return serialization.dumps({"items": serialization.shape_rows(names, rows), "next": None, "prev": None})
+
+
+def encode_columns(rows, names):
+    return serialization.dumps(
+        {"items": serialization.shape_rows(names, rows, "columns"), "next": None, "prev": None}
+    )
+
+
+def encode_records_json(rows, names):
+    orjson, serialization.orjson = serialization.orjson, None
+    try:
+        return encode_records(rows, names)
+    finally:
+        serialization.orjson = orjson
+
+
+# name -> (fetch, encode)
+METHODS = {
+    "jsonify": (fetch_namedtuples, encode_jsonify),
+    "page": (fetch_namedtuples, encode_page),
+    "records": (fetch_tuples, encode_records),
+    "columns": (fetch_tuples, encode_columns),
+    "records_json": (fetch_tuples, encode_records_json),
+}
+
+
+def rate(run, rows, seconds):
+    """Rows per second of ``run``, which handles ``rows`` rows, over about ``seconds``."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        run()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return round(calls * rows / elapsed)
+
+
+def bench(conn, keyset, rows, seconds):
+    query = queries.PAGES[keyset.name][FIRST]
+    params = keyset.params(None, rows - 1)
+    results = {}
+    for name, (fetch, encode) in METHODS.items():
+        fetched, names = fetch(conn, query, params)
+        encode(fetched, names)
+        results[name] = {
+            "encode": rate(lambda: encode(fetched, names), len(fetched), seconds),
+            "fetch_and_encode": rate(lambda: encode(*fetch(conn, query, params)), len(fetched), seconds),
+            "bytes": len(encode(fetched, names)),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default=BENCH_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=200, help="rows of each page")
+    parser.add_argument("--seconds", type=float, default=2, help="time of each measurement")
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    with app.app_context(), psycopg.connect(args.database) as conn:
+        queries.prepare(conn)
+        result = {
+            "config": {"rows": args.rows, "orjson": serialization.orjson is not None},
+            "rows_per_second": {
+                payload: bench(conn, keyset, args.rows, args.seconds)
+                for payload, keyset in PAYLOADS.items()
+            },
+        }
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
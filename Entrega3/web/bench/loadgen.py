@@ -0,0 +1,182 @@
+"""A small closed-loop HTTP/1.1 load generator built on asyncio.
+
+Each virtual client keeps one keep-alive connection open and sends its next
+request as soon as the previous response is read, for a fixed duration.
+Only the standard library is used, so the same client measures every
+serving mode.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+
+class Request:
+    """One request of a traffic mix; ``path`` may be a callable."""
+
+    def __init__(self, name, method, path, weight=1, body=None, headers=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.weight = weight
+        self.body = body
+        self.headers = headers or {}
+
+    def render(self, rng):
+        path = self.path(rng) if callable(self.path) else self.path
+        body = self.body(rng) if callable(self.body) else self.body
+        if isinstance(body, (dict, list)):
+            return path, json.dumps(body).encode(), {"Content-Type": "application/json"}
+        if isinstance(body, str):
+            body = body.encode()
+        return path, body or b"", {}
+
+
+async def read_response(reader, method):
+    """Read one response; return ``(status, body_size, keep_alive)``."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    version, status = status_line.split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    size = 0
+    if method == "HEAD" or int(status) in (204, 304):
+        pass
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            chunk = int((await reader.readline()).split(b";")[0], 16)
+            if chunk:
+                size += len(await reader.readexactly(chunk))
+            await reader.readline()
+            if not chunk:
+                break
+    elif "content-length" in headers:
+        size = len(await reader.readexactly(int(headers["content-length"])))
+    else:
+        size = len(await reader.read())
+        return int(status), size, False
+
+    keep_alive = headers.get("connection", "").lower() != "close" and version == b"HTTP/1.1"
+    return int(status), size, keep_alive
+
+
+async def client(host, port, mix, weights, deadline, results, rng, headers):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        request = rng.choices(mix, weights)[0]
+        path, body, extra = request.render(rng)
+        lines = [f"{request.method} {path} HTTP/1.1", f"Host: {host}:{port}"]
+        lines += [f"{k}: {v}" for k, v in {**headers, **request.headers, **extra}.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        raw = ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(raw)
+            await writer.drain()
+            status, size, keep_alive = await read_response(reader, request.method)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            results[request.name]["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        elapsed = time.perf_counter() - start
+
+        result = results[request.name]
+        result["latencies"].append(elapsed)
+        result["bytes"] += size
+        if status >= 500:
+            result["errors"] += 1
+        result["status"][status] += 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def latency_stats(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    stats = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+    }
+    for q in (50, 95, 99):
+        value = percentile(latencies, q)
+        stats[f"p{q}"] = None if value is None else round(value * 1000, 3)
+    return stats
+
+
+def summarize(results, elapsed):
+    """Throughput and latency percentiles (in ms) per request name."""
+    summary = {}
+    for name, result in sorted(results.items()):
+        summary[name] = {
+            **latency_stats(result["latencies"], result["errors"], elapsed),
+            "bytes": result["bytes"],
+            "status": {str(k): v for k, v in sorted(result["status"].items())},
+        }
+    summary["total"] = latency_stats(
+        [latency for result in results.values() for latency in result["latencies"]],
+        sum(result["errors"] for result in results.values()),
+        elapsed,
+    )
+    return summary
+
+
+async def run(base_url, mix, concurrency, duration, seed=0, headers=None):
+    """Run ``mix`` against ``base_url`` with ``concurrency`` clients for ``duration`` s."""
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    results = defaultdict(
+        lambda: {"latencies": [], "errors": 0, "bytes": 0, "status": defaultdict(int)}
+    )
+    weights = [request.weight for request in mix]
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(
+        *(
+            client(host, port, mix, weights, deadline, results, random.Random(seed + i), headers or {})
+            for i in range(concurrency)
+        )
+    )
+    return summarize(results, time.perf_counter() - start)
+
+
+async def wait_ready(base_url, path="/ping", timeout=30):
+    """Wait until ``base_url`` answers ``path`` with a 200."""
+    url = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            status, _, _ = await read_response(reader, "GET")
+            writer.close()
+            if status == 200:
+                return
+        except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{base_url} did not become ready")
@@ -0,0 +1,448 @@
+#!/usr/bin/python3
+"""Query-plan regression check of every SQL statement of the app.
+
+Every statement of the registry (``queries.QUERIES``, which holds the
+statements the routes run) is prepared as the app prepares it and run with
+``EXPLAIN (ANALYZE, BUFFERS)`` on a database loaded by ``datagen.py``, with
+parameters drawn from its data. Each runs under a custom plan (the first
+executions) and the generic plan (what a prepared statement may settle on),
+and writes are rolled back. The statements of ``/import`` and ``/export``
+(``bulk_import.py`` and ``bulk_export.py``) are built per request and never
+prepared: they are run as they are sent, an import's after a staging table
+is filled with rows of its target, and an export's ``COPY`` by its query.
+The cost, planning and execution time, buffers and plan shape of each plan
+are printed as JSON.
+
+The exit status is 1 when a plan reads a large table with a sequential
+scan, does not use an index it is meant to use (:data:`EXPECTED_INDEXES`),
+a statement has no sample parameters here, or, given a baseline (the JSON
+of an earlier run, e.g. saved with ``--save-baseline``), a plan changed
+shape and cost or read more than ``--tolerance`` over the baseline.
+
+Usage::
+
+    python bench/plans.py --orders 1000000 --save-baseline bench/plans.json
+    python bench/plans.py --no-seed --baseline bench/plans.json
+
+The public schema of the database is replaced when seeding; point
+``--database`` (or ``BENCH_DATABASE_URL``) at a database kept for
+benchmarking.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from pathlib import Path
+
+import psycopg
+from psycopg import ClientCursor
+from psycopg.rows import namedtuple_row
+
+import seed  # noqa: F401 (puts the app on the path)
+import bulk_export
+import bulk_import
+import datagen
+import queries
+from benchmark import create_database
+from pagination import Cursor
+from pagination import DEFAULT_PAGE_SIZE
+from pagination import FIRST
+from pagination import NEXT
+from pagination import PREV
+
+
+BENCH_DATABASE_URL = os.environ.get("BENCH_DATABASE_URL", "postgres://db:db@postgres/bench")
+
+PLAN_CACHE_MODES = {"custom": "force_custom_plan", "generic": "force_generic_plan"}
+
+# Tables of more rows than this are never to be read in full.
+LARGE_TABLE_ROWS = 10000
+
+# statement -> indexes its plans are required to use. The list and search
+# indexes are the ones the keyset pagination and the product search were
+# built on (migrations 0001 and 0004); the others keep the deletes and the
+# totals from reading whole tables.
+EXPECTED_INDEXES = {
+    **{
+        f"product_page_{suffix}": {"product_price_sku_index"}
+        for suffix in ("first", "next", "prev")
+    },
+    **{
+        f"product_search_prefix_{suffix}": {"product_name_prefix_index"}
+        for suffix in ("first", "next", "prev")
+    },
+    **{
+        f"supplier_page_{suffix}": {"supplier_date_tin_index"}
+        for suffix in ("first", "next", "prev")
+    },
+    "delete_products": {"contains_sku_index", "supplier_sku_index"},
+    "delete_clients": {"orders_cust_no_index", "pay_cust_no_index"},
+    "top_customers": {"customer_paid_totals_top_index"},
+}
+
+# statement -> large tables it may read in full: a report covers a third of
+# the fact table (a year of three), which a sequential scan reads fastest.
+ALLOWED_SEQ_SCANS = {
+    **{query.name: {"product_sales_fact"} for query in queries.REPORTS["sales"].values()},
+    **{query.name: {"product_sales_fact"} for query in queries.REPORTS["daily_average"].values()},
+    # The emails of a whole upload (IMPORT_ROWS) are matched at once, which
+    # a hash join over the customers does faster than as many index lookups.
+    "import_clients_check_2": {"customer"},
+}
+
+# Rows staged to run the statements of an import on.
+IMPORT_ROWS = 1000
+
+# Time (ms) a plan may take over its baseline in any case: the noise of
+# short statements and of the triggers of the writes. Cost and buffers are
+# the steadier signals.
+TIME_SLACK = 5.0
+# Buffers a plan may read over its baseline in any case.
+BUFFER_SLACK = 8
+
+
+def sample_keys(conn):
+    """Keys of existing rows to run the statements on, from the middle of each table."""
+
+    def middle(sql):
+        count = conn.execute(f"SELECT COUNT(*) FROM ({sql}) rows;").fetchone()[0]
+        return conn.execute(f"{sql} OFFSET %s LIMIT 1;", (count // 2,)).fetchone()
+
+    product = middle("SELECT SKU, name FROM product ORDER BY price, SKU")
+    order = middle(
+        "SELECT o.order_no, o.cust_no, o.date FROM orders o JOIN pay USING (order_no) ORDER BY order_no"
+    )
+    unpaid = middle(
+        "SELECT order_no, cust_no FROM orders o"
+        " WHERE NOT EXISTS (SELECT 1 FROM pay WHERE pay.order_no = o.order_no) ORDER BY order_no"
+    )
+    new_line = conn.execute(
+        "SELECT SKU FROM product p WHERE NOT EXISTS"
+        " (SELECT 1 FROM contains c WHERE c.order_no = %s AND c.SKU = p.SKU) LIMIT 1;",
+        (order.order_no,),
+    ).fetchone()
+    supplier = middle("SELECT TIN FROM supplier ORDER BY TIN")
+    next_order, next_customer = conn.execute(
+        "SELECT (SELECT MAX(order_no) + 1 FROM orders) AS order_no,"
+        " (SELECT MAX(cust_no) + 1 FROM customer) AS cust_no;"
+    ).fetchone()
+    return {
+        "SKU": product.sku,
+        "name": product.name,
+        "order_no": order.order_no,
+        "cust_no": order.cust_no,
+        "date": order.date,
+        "year": order.date.year,
+        "unpaid_order_no": unpaid.order_no,
+        "unpaid_cust_no": unpaid.cust_no,
+        "new_line_sku": new_line.sku,
+        "TIN": supplier.tin,
+        "new_order_no": next_order,
+        "new_cust_no": next_customer,
+    }
+
+
+def page_samples(conn, keyset, where_params):
+    """Parameters of the first, next and previous page of ``keyset``: pages 1, 2 and 1."""
+    pages = queries.PAGES[keyset.name]
+    first = keyset.params(None, DEFAULT_PAGE_SIZE)
+    with ClientCursor(conn, row_factory=namedtuple_row) as cur:
+        rows = cur.execute(pages[FIRST].sql, {**where_params, **first}).fetchall()
+    # The last row of the first page (the look-ahead row aside), as the app
+    # makes its cursors.
+    last = keyset.cursor_values(rows[:DEFAULT_PAGE_SIZE][-1])
+    samples = {pages[FIRST].name: {**where_params, **first}}
+    for variant in (NEXT, PREV):
+        cursor = Cursor(variant, last)
+        samples[pages[variant].name] = {**where_params, **keyset.params(cursor, DEFAULT_PAGE_SIZE)}
+    return samples
+
+
+def samples(conn, keys):
+    """Parameters to run every statement of the registry with, by statement name."""
+    name = keys["name"].lower()
+    # Search terms matching a few products: the name of one, bar its last
+    # character, and its number.
+    terms = {
+        "prefix": name[:-1],
+        "substring": name.split()[-1],
+        "fuzzy": keys["name"],
+    }
+
+    params = {}
+    for keyset in (queries.PRODUCTS, queries.SUPPLIERS, queries.CLIENTS, queries.ORDERS):
+        params.update(page_samples(conn, keyset, {}))
+    for mode, keyset in queries.SEARCHES.items():
+        params.update(page_samples(conn, keyset, queries.search_params(mode, terms[mode])))
+
+    new_sku = f"plan{keys['new_order_no']}"
+    params.update(
+        {
+            "product_by_sku": {"SKU": keys["SKU"]},
+            "insert_product": {
+                "SKU": new_sku,
+                "name": "Plan check",
+                "description": "Plan check",
+                "price": 1,
+                "ean": None,
+            },
+            "update_product_price": {"SKU": keys["SKU"], "price": 10},
+            "update_product_description": {"SKU": keys["SKU"], "description": "Plan check"},
+            "insert_client": {
+                "cust_no": keys["new_cust_no"],
+                "name": "Plan check",
+                "email": "plan@example.com",
+                "phone": "900000000",
+                "address": "Rua Nova, 1000-001 Lisboa",
+            },
+            "insert_supplier": {
+                "TIN": new_sku,
+                "name": "Plan check",
+                "address": "Rua Nova, 1000-001 Lisboa",
+                "SKU": keys["SKU"],
+                "date": keys["date"],
+            },
+            "insert_order": {
+                "order_no": keys["new_order_no"],
+                "cust_no": keys["cust_no"],
+                "date": keys["date"],
+            },
+            "insert_contains": {
+                "order_no": keys["order_no"],
+                "SKU": keys["new_line_sku"],
+                "quantity": 1,
+            },
+            "insert_pay": {"order_no": keys["unpaid_order_no"], "cust_no": keys["unpaid_cust_no"]},
+            "delete_products": {"keys": [keys["SKU"]]},
+            "delete_clients": {"keys": [keys["cust_no"]]},
+            "delete_suppliers": {"keys": [keys["TIN"]]},
+            "table_version": {"name": "product"},
+            "order_total": {"order_no": keys["order_no"]},
+            "top_customers": {"limit": 10},
+        }
+    )
+    for groupings in queries.REPORTS.values():
+        for query in groupings.values():
+            params[query.name] = {"year": keys["year"]}
+    return params
+
+
+def bulk_statements(keys):
+    """The statements of the imports and exports, by name: ``(setup, sql, params)``.
+
+    ``setup`` is run first, in the same transaction: for an import, the
+    staging table filled with rows of the target, so the upsert updates them.
+    """
+    statements = {}
+    for kind, target in bulk_import.TARGETS.items():
+        setup = [
+            bulk_import.staging_sql(target),
+            f"""
+            INSERT INTO import_staging
+            SELECT t.*, row_number() OVER ()
+            FROM (SELECT * FROM {target.table} ORDER BY {target.key} LIMIT {IMPORT_ROWS}) t;
+            """,
+            bulk_import.index_staging_sql(target),
+        ]
+        for i, (condition, _) in enumerate(bulk_import.reject_checks(target)):
+            statements[f"import_{kind}_check_{i}"] = (setup, bulk_import.reject_sql(condition), None)
+        statements[f"import_{kind}_upsert"] = (setup, bulk_import.upsert_sql(target), None)
+
+    # The month of the sample order.
+    start = keys["date"].replace(day=1)
+    end = start + datetime.timedelta(days=30)
+    for kind, source in bulk_export.SOURCES.items():
+        statements[f"export_{kind}"] = ([], *bulk_export.export_select(kind))
+        if source.date is not None:
+            statements[f"export_{kind}_range"] = ([], *bulk_export.export_select(kind, start, end))
+    return statements
+
+
+def plan_nodes(plan):
+    """Every node of ``plan`` and its subplans."""
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def shape(plan):
+    """The plan tree as text, without costs: e.g. ``Limit(Index Scan[product_price_sku_index])``."""
+    node = plan["Node Type"]
+    if "Index Name" in plan:
+        node += f"[{plan['Index Name']}]"
+    elif "Relation Name" in plan:
+        node += f"[{plan['Relation Name']}]"
+    children = plan.get("Plans", ())
+    if children:
+        node += "(" + ", ".join(shape(child) for child in children) + ")"
+    return node
+
+
+def explain(conn, query, params, mode):
+    """Run ``query`` with ``params`` under ``mode`` plans; return the ``EXPLAIN`` output."""
+    try:
+        with conn.transaction(force_rollback=True):
+            conn.execute(f"SET LOCAL plan_cache_mode = {PLAN_CACHE_MODES[mode]};")
+            conn.execute(query.prepare_sql)
+            with ClientCursor(conn) as cur:
+                cur.execute(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.execute_sql}", params
+                )
+                return cur.fetchone()[0][0]
+    finally:
+        conn.execute("DEALLOCATE ALL;")
+
+
+def explain_statement(conn, setup, sql, params):
+    """Run ``sql`` with ``params``, unprepared, after ``setup``; return the ``EXPLAIN`` output."""
+    with conn.transaction(force_rollback=True):
+        for statement in setup:
+            conn.execute(statement)
+        with ClientCursor(conn) as cur:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.strip().rstrip(';')}", params)
+            return cur.fetchone()[0][0]
+
+
+def summarize(result, large_tables):
+    plan = result["Plan"]
+    nodes = list(plan_nodes(plan))
+    return {
+        "cost": plan["Total Cost"],
+        "rows": plan["Actual Rows"],
+        "planning_ms": round(result.get("Planning Time", 0.0), 3),
+        "execution_ms": round(result["Execution Time"], 3),
+        "trigger_ms": round(sum(trigger["Time"] for trigger in result.get("Triggers", ())), 3),
+        "shared_hit": plan.get("Shared Hit Blocks", 0),
+        "shared_read": plan.get("Shared Read Blocks", 0),
+        "indexes": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+        "seq_scans": sorted(
+            {
+                node["Relation Name"]
+                for node in nodes
+                if node["Node Type"] == "Seq Scan" and node["Relation Name"] in large_tables
+            }
+        ),
+        "shape": shape(plan),
+    }
+
+
+def check(conn, runs=3, large_rows=LARGE_TABLE_ROWS):
+    """Explain every statement; return the plans by statement and mode, and the problems found."""
+    large_tables = {
+        row[0]
+        for row in conn.execute(
+            "SELECT relname FROM pg_class"
+            " WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples > %s;",
+            (large_rows,),
+        )
+    }
+    keys = sample_keys(conn)
+    sample_params = samples(conn, keys)
+    conn.commit()
+
+    plans = {}
+    problems = []
+
+    def review(name, mode, run, allowed_scans):
+        # The best of a few runs: the first may read the disk.
+        results = [summarize(run(), large_tables) for _ in range(runs)]
+        plan = min(results, key=lambda plan: plan["execution_ms"])
+        plans.setdefault(name, {})[mode] = plan
+
+        scans = set(plan["seq_scans"]) - allowed_scans
+        if scans:
+            problems.append(f"{name}.{mode}: sequential scan of {', '.join(sorted(scans))}")
+        missing = EXPECTED_INDEXES.get(name, set()) - set(plan["indexes"])
+        if missing:
+            problems.append(f"{name}.{mode}: does not use {', '.join(sorted(missing))}")
+
+    for name, query in sorted(queries.QUERIES.items()):
+        params = sample_params.get(name)
+        if params is None:
+            problems.append(f"{name}: no sample parameters")
+            continue
+        for mode in PLAN_CACHE_MODES:
+            review(
+                name,
+                mode,
+                lambda: explain(conn, query, params, mode),
+                ALLOWED_SEQ_SCANS.get(name, set()),
+            )
+
+    for name, (setup, sql, params) in sorted(bulk_statements(keys).items()):
+        # An export reads its tables through, within a range of days too:
+        # only the baseline tells its plans apart.
+        allowed = large_tables if name.startswith("export_") else ALLOWED_SEQ_SCANS.get(name, set())
+        # Planned for their parameters, as the app sends them.
+        review(name, "custom", lambda: explain_statement(conn, setup, sql, params), allowed)
+    return plans, problems
+
+
+def compare(plans, baseline, tolerance):
+    """Regressions of every plan against ``baseline``."""
+    regressions = []
+    for name, modes in plans.items():
+        for mode, plan in modes.items():
+            base = baseline.get(name, {}).get(mode)
+            if base is None:
+                continue
+            label = f"{name}.{mode}"
+            if plan["shape"] != base["shape"] and plan["cost"] > base["cost"] * (1 + tolerance):
+                regressions.append(f"{label}.shape")
+            buffers = plan["shared_hit"] + plan["shared_read"]
+            base_buffers = base["shared_hit"] + base["shared_read"]
+            if buffers > base_buffers * (1 + tolerance) + BUFFER_SLACK:
+                regressions.append(f"{label}.buffers")
+            if plan["execution_ms"] > base["execution_ms"] * (1 + tolerance) + TIME_SLACK:
+                regressions.append(f"{label}.execution_ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default=BENCH_DATABASE_URL)
+    parser.add_argument("--orders", type=int, default=1000000, help="orders of the generated data")
+    parser.add_argument("--no-seed", dest="seed_database", action="store_false", help="reuse the data as is")
+    parser.add_argument("--runs", type=int, default=3, help="runs of each plan, the fastest is kept")
+    parser.add_argument("--large-rows", type=int, default=LARGE_TABLE_ROWS, help="rows of a large table")
+    parser.add_argument("--baseline", type=Path, help="JSON of an earlier run to compare with")
+    parser.add_argument("--save-baseline", type=Path, help="also write the result here")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed regression (0.5 = 50%%)")
+    args = parser.parse_args(argv)
+
+    if args.seed_database:
+        print(f"Generating {args.orders} orders...", file=sys.stderr)
+        create_database(args.database)
+        with psycopg.connect(args.database) as conn:
+            datagen.generate(conn, args.orders, log=lambda message: print(message, file=sys.stderr))
+
+    with psycopg.connect(args.database, row_factory=namedtuple_row, prepare_threshold=None) as conn:
+        orders = conn.execute("SELECT COUNT(*) FROM orders;").fetchone()[0]
+        plans, problems = check(conn, args.runs, args.large_rows)
+
+    result = {
+        "config": {"orders": orders, "large_rows": args.large_rows},
+        "statements": plans,
+        "problems": problems,
+    }
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(result, indent=2) + "\n")
+
+    status = 1 if problems else 0
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(plans, baseline["statements"], args.tolerance)
+        result["comparison"] = {
+            "comparable": result["config"] == baseline.get("config"),
+            "regressions": regressions,
+        }
+        status = 1 if problems or regressions else 0
+
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
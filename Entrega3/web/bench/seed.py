@@ -0,0 +1,84 @@
+"""Build a benchmark database: the schema, its migrations and seed data.
+
+The data is derived from the row numbers only, so every seed at the same
+scale produces the same database. ``scale`` is the number of products;
+there are 10 customers, 20 orders (two thirds of them paid) and one supplier
+per product, and every order has one to three lines.
+"""
+import sys
+from pathlib import Path
+
+WEB_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(WEB_DIR))
+
+from migrations import apply_migrations  # noqa: E402
+
+
+SCHEMA = WEB_DIR / "schema.sql"
+
+CUSTOMERS_PER_PRODUCT = 10
+ORDERS_PER_PRODUCT = 20
+
+CITIES = ("Lisboa", "Porto", "Braga", "Coimbra", "Faro", "Viseu", "Almada", "Aveiro")
+
+SEED = (
+    """
+    INSERT INTO product
+    SELECT 'sku' || lpad(i::TEXT, 9, '0'), 'Product ' || i, 'Description of product ' || i,
+        1 + (i * 7919 %% 100000) / 100.0, 2000000000000 + i
+    FROM generate_series(1, %(products)s) i;
+    """,
+    """
+    INSERT INTO customer
+    SELECT i, 'Customer ' || i, 'customer' || i || '@example.com', lpad(i::TEXT, 9, '9'),
+        'Rua ' || i || ', ' || (1000 + i %% 9000) || '-' || lpad((i %% 1000)::TEXT, 3, '0')
+        || ' ' || (%(cities)s::VARCHAR[])[1 + i %% cardinality(%(cities)s::VARCHAR[])]
+    FROM generate_series(1, %(customers)s) i;
+    """,
+    """
+    INSERT INTO orders
+    SELECT i, 1 + i * 7 %% %(customers)s, DATE '2021-01-01' + i %% 1095
+    FROM generate_series(1, %(orders)s) i;
+    """,
+    """
+    INSERT INTO contains
+    SELECT i, 'sku' || lpad((1 + (i * 31 + k * 97) %% %(products)s)::TEXT, 9, '0'), 1 + (i + k) %% 5
+    FROM generate_series(1, %(orders)s) i, generate_series(0, 2) k
+    WHERE k <= i %% 3
+    ON CONFLICT DO NOTHING;
+    """,
+    """
+    INSERT INTO pay
+    SELECT order_no, cust_no FROM orders WHERE order_no %% 3 <> 0;
+    """,
+    """
+    INSERT INTO supplier
+    SELECT 'tin' || lpad(i::TEXT, 9, '0'), 'Supplier ' || i, 'Rua ' || i || ', 1000-001 Lisboa',
+        'sku' || lpad(i::TEXT, 9, '0'), DATE '2021-01-01' + i %% 1095
+    FROM generate_series(1, %(products)s) i;
+    """,
+)
+
+
+def sku(i):
+    return f"sku{i:09d}"
+
+
+def seed(conn, scale):
+    """Recreate the schema on ``conn`` and fill it at ``scale``."""
+    conn.execute("DROP SCHEMA public CASCADE;")
+    conn.execute("CREATE SCHEMA public;")
+    conn.execute(SCHEMA.read_text())
+    params = {
+        "products": scale,
+        "customers": scale * CUSTOMERS_PER_PRODUCT,
+        "orders": scale * ORDERS_PER_PRODUCT,
+        "cities": list(CITIES),
+    }
+    for sql in SEED:
+        conn.execute(sql, params)
+    conn.commit()
+    # After loading, so the migrations build their indexes and tables in bulk.
+    apply_migrations(conn)
+    conn.execute("ANALYZE;")
+    conn.commit()
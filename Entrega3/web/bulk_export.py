@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""Bulk export of any table, and of the product sales, as CSV or NDJSON.
+
+The rows are written by the server with ``COPY ... TO STDOUT`` and passed
+on in chunks as they arrive, never held all at once, so memory use does not
+grow with the size of the export. Tables with a date (orders and their
+lines, payments and processing, suppliers, employees, sales) can be limited
+to a range of days.
+
+Usage::
+
+    python bulk_export.py customer > customers.csv
+    python bulk_export.py product_sales --format ndjson --from 2023-01-01 --to 2023-03-31
+"""
+import argparse
+import datetime
+import os
+import sys
+from typing import NamedTuple
+from typing import Optional
+
+import psycopg
+
+
+# postgres://{user}:{password}@{hostname}:{port}/{database-name}
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
+
+FORMATS = ("csv", "ndjson")
+
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Rows are sent on in chunks of about this many bytes.
+CHUNK_SIZE = 65536
+
+
+class Source(NamedTuple):
+    """What an export reads: ``SELECT ... FROM ...``, the date its rows are
+    filtered on (if any) and the order they are written in."""
+
+    select: str
+    order: str
+    date: Optional[str] = None
+
+
+def orders_of(alias):
+    return f"JOIN orders o ON o.order_no = {alias}.order_no"
+
+
+SOURCES = {
+    "customer": Source("SELECT * FROM customer", "cust_no"),
+    "orders": Source("SELECT * FROM orders", "order_no", "date"),
+    "pay": Source(f"SELECT p.* FROM pay p {orders_of('p')}", "p.order_no", "o.date"),
+    "employee": Source("SELECT * FROM employee", "ssn", "bdate"),
+    "process": Source(f"SELECT p.* FROM process p {orders_of('p')}", "p.order_no, p.ssn", "o.date"),
+    "department": Source("SELECT * FROM department", "name"),
+    "workplace": Source("SELECT * FROM workplace", "address"),
+    "works": Source("SELECT * FROM works", "ssn, name, address"),
+    "office": Source("SELECT * FROM office", "address"),
+    "warehouse": Source("SELECT * FROM warehouse", "address"),
+    "product": Source("SELECT * FROM product", "SKU"),
+    "contains": Source(f"SELECT c.* FROM contains c {orders_of('c')}", "c.order_no, c.SKU", "o.date"),
+    "supplier": Source("SELECT * FROM supplier", "TIN", "date"),
+    "delivery": Source("SELECT * FROM delivery", "TIN, address"),
+    # The fact table of the reports (migration 0003), with the day of sale.
+    "product_sales": Source(
+        """
+        SELECT order_no, SKU, qty, total_price, make_date(year, month, day_of_month) AS date,
+            day_of_week, city
+        FROM product_sales_fact
+        """,
+        "order_no, SKU",
+        "make_date(year, month, day_of_month)",
+    ),
+}
+
+# COPY writes JSON through the CSV format with a quote and delimiter no JSON
+# text contains (control characters are escaped in JSON), so every line is
+# left as it is; the text format would double its backslashes.
+NDJSON_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+class ExportError(ValueError):
+    """Raised when the filters of an export are not valid."""
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"{name} is required to be a YYYY-MM-DD date.") from None
+
+
+def export_select(kind, start=None, end=None):
+    """The query (and its parameters) whose rows the ``COPY`` of an export of ``kind`` writes.
+
+    ``start`` and ``end`` are the first and last day of the rows exported.
+    """
+    source = SOURCES[kind]
+    conditions = []
+    if start is not None or end is not None:
+        if source.date is None:
+            raise ExportError(f"{kind} has no date to filter on.")
+        if start is not None:
+            conditions.append(f"{source.date} >= %(start)s")
+        if end is not None:
+            conditions.append(f"{source.date} <= %(end)s")
+        if kind == "product_sales":
+            # The year narrows the scan down through product_sales_fact_year_index.
+            if start is not None:
+                conditions.append("year >= %(start_year)s")
+            if end is not None:
+                conditions.append("year <= %(end_year)s")
+
+    query = source.select.strip()
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f" ORDER BY {source.order}"
+    params = {
+        "start": start,
+        "end": end,
+        "start_year": start.year if start else None,
+        "end_year": end.year if end else None,
+    }
+    return query, params
+
+
+def export_query(kind, format="csv", start=None, end=None):
+    """The ``COPY`` statement and parameters of an export of ``kind``.
+
+    ``start`` and ``end`` are the first and last day of the rows exported.
+    """
+    query, params = export_select(kind, start, end)
+    if format == "ndjson":
+        sql = f"COPY (SELECT row_to_json(r) FROM ({query}) r) TO STDOUT ({NDJSON_OPTIONS})"
+    else:
+        sql = f"COPY ({query}) TO STDOUT (FORMAT csv, HEADER)"
+    return sql, params
+
+
+def export_stream(conn, kind, format="csv", start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield the export of ``kind`` from ``conn`` in chunks of about ``chunk_size`` bytes."""
+    sql, params = export_query(kind, format, start, end)
+    with conn.cursor() as cur:
+        with cur.copy(sql, params) as copy:
+            # The server sends a message per row: gather them into chunks.
+            chunk = bytearray()
+            for data in copy:
+                chunk += data
+                if len(chunk) >= chunk_size:
+                    yield bytes(chunk)
+                    chunk.clear()
+            if chunk:
+                yield bytes(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("kind", choices=sorted(SOURCES))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--from", dest="start", help="first day exported, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", help="last day exported, YYYY-MM-DD")
+    parser.add_argument("--output", help="file written, stdout by default")
+    parser.add_argument("--database", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    try:
+        start = parse_date(args.start, "--from")
+        end = parse_date(args.end, "--to")
+        export_query(args.kind, args.format, start, end)
+    except ExportError as e:
+        parser.error(str(e))
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    with output, psycopg.connect(args.database) as conn:
+        for chunk in export_stream(conn, args.kind, args.format, start, end):
+            output.write(chunk)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
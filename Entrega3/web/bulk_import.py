@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+"""Bulk import of products, customers and suppliers.
+
+Uploads are read as a stream, one row at a time, and sent to a temporary
+staging table with ``COPY FROM STDIN``, so memory use does not grow with the
+size of the file. Rows that cannot be parsed are rejected while streaming;
+rows that would break a constraint are rejected with one set-based query each
+once the batch is staged. What is left is upserted in the same transaction.
+
+Usage::
+
+    python bulk_import.py products catalog.csv
+    python bulk_import.py clients customers.ndjson --format ndjson
+"""
+import argparse
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+import sys
+from typing import Callable
+from typing import NamedTuple
+
+import psycopg
+
+
+# postgres://{user}:{password}@{hostname}:{port}/{database-name}
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgres://db:db@postgres/db")
+
+FORMATS = ("csv", "ndjson")
+
+# Only the first rejects are reported back; the rest are just counted.
+MAX_REPORTED_REJECTS = 1000
+
+
+class RowError(ValueError):
+    """Raised when a value in an uploaded row is not valid."""
+
+
+def text(max_length=None, required=False):
+    def parse(value):
+        if value is None or value == "":
+            if required:
+                raise RowError("is required")
+            return None
+        if isinstance(value, (dict, list)):
+            raise RowError("is required to be a single value")
+        value = str(value)
+        if "\0" in value:
+            raise RowError("contains a NUL character")
+        if max_length is not None and len(value) > max_length:
+            raise RowError(f"is longer than {max_length} characters")
+        return value
+
+    return parse
+
+
+def integer(required=False):
+    def parse(value):
+        if value is None or value == "":
+            if required:
+                raise RowError("is required")
+            return None
+        # int() would take 3.7 as 3 and true as 1.
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise RowError("is required to be an integer")
+        try:
+            number = int(value)
+        except (TypeError, ValueError, OverflowError):
+            raise RowError("is required to be an integer") from None
+        if not -(2**31) <= number < 2**31:
+            raise RowError("does not fit INTEGER")
+        return number
+
+    return parse
+
+
+def numeric(precision, scale=0, required=False):
+    def parse(value):
+        if value is None or value == "":
+            if required:
+                raise RowError("is required")
+            return None
+        try:
+            number = decimal.Decimal(str(value))
+        except decimal.InvalidOperation:
+            raise RowError("is required to be numeric") from None
+        if not number.is_finite():
+            raise RowError("is required to be numeric")
+        try:
+            number = number.quantize(decimal.Decimal(1).scaleb(-scale))
+        except decimal.InvalidOperation:
+            raise RowError(f"does not fit NUMERIC({precision}, {scale})") from None
+        if number.adjusted() >= precision - scale:
+            raise RowError(f"does not fit NUMERIC({precision}, {scale})")
+        return number
+
+    return parse
+
+
+def date():
+    def parse(value):
+        if value is None or value == "":
+            return None
+        try:
+            return datetime.date.fromisoformat(str(value))
+        except ValueError:
+            raise RowError("is required to be a YYYY-MM-DD date") from None
+
+    return parse
+
+
+class Field(NamedTuple):
+    name: str
+    parse: Callable
+
+
+class Target(NamedTuple):
+    """Where an import goes and the set-based checks done before the upsert.
+
+    Each check is a ``WHERE`` condition on the staging rows ``s`` and the
+    reason reported for the rows it matches.
+    """
+
+    table: str
+    key: str
+    fields: tuple
+    checks: tuple = ()
+
+
+TARGETS = {
+    "products": Target(
+        "product",
+        "sku",
+        (
+            Field("sku", text(25, required=True)),
+            Field("name", text(200, required=True)),
+            Field("description", text()),
+            Field("price", numeric(10, 2, required=True)),
+            Field("ean", numeric(13)),
+        ),
+        (
+            (
+                """
+                s.ean IS NOT NULL AND EXISTS (
+                    SELECT 1 FROM import_staging t
+                    WHERE t.ean = s.ean AND t.line < s.line)
+                """,
+                "ean already used earlier in the upload",
+            ),
+            (
+                """
+                s.ean IS NOT NULL AND EXISTS (
+                    SELECT 1 FROM product p
+                    WHERE p.ean = s.ean AND p.sku <> s.sku)
+                """,
+                "ean already used by another product",
+            ),
+        ),
+    ),
+    "clients": Target(
+        "customer",
+        "cust_no",
+        (
+            Field("cust_no", integer(required=True)),
+            Field("name", text(80, required=True)),
+            Field("email", text(254, required=True)),
+            Field("phone", text(15)),
+            Field("address", text(255)),
+        ),
+        (
+            (
+                """
+                EXISTS (
+                    SELECT 1 FROM import_staging t
+                    WHERE t.email = s.email AND t.line < s.line)
+                """,
+                "email already used earlier in the upload",
+            ),
+            (
+                """
+                EXISTS (
+                    SELECT 1 FROM customer c
+                    WHERE c.email = s.email AND c.cust_no <> s.cust_no)
+                """,
+                "email already used by another customer",
+            ),
+        ),
+    ),
+    "suppliers": Target(
+        "supplier",
+        "tin",
+        (
+            Field("tin", text(20, required=True)),
+            Field("name", text(200)),
+            Field("address", text(255)),
+            Field("sku", text(25)),
+            Field("date", date()),
+        ),
+        (
+            (
+                """
+                s.sku IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM product p WHERE p.sku = s.sku)
+                """,
+                "unknown product SKU",
+            ),
+        ),
+    ),
+}
+
+
+class Result:
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.rejects = []
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"line": line, "reason": reason})
+
+    def as_dict(self):
+        self.rejects.sort(key=lambda reject: reject["line"])
+        return {
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+        }
+
+
+def read_csv(stream):
+    """Yield ``(line, record)`` pairs from a CSV file with a header row."""
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # A field over the size limit, a NUL byte...: the reader goes on
+            # from the next line. (DictReader counts the lines of the rows it
+            # returned; its reader, those read.)
+            yield reader.reader.line_num, ValueError(str(e))
+            continue
+        if None in record:
+            yield reader.line_num, ValueError("too many values")
+        else:
+            yield reader.line_num, record
+
+
+def read_ndjson(stream):
+    """Yield ``(line, record)`` pairs from a file with one JSON object per line."""
+    for line, raw in enumerate(stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError as e:
+            yield line, ValueError(f"invalid JSON: {e.msg}")
+            continue
+        if not isinstance(record, dict):
+            yield line, ValueError("a JSON object is required")
+        else:
+            yield line, record
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def parse_row(target, record):
+    row = []
+    for field in target.fields:
+        try:
+            row.append(field.parse(record.get(field.name)))
+        except RowError as e:
+            raise RowError(f"{field.name} {e}") from None
+    return row
+
+
+# The statements of an import, besides its COPY into the staging table. The
+# query-plan check (bench/plans.py) runs them too.
+
+
+def staging_sql(target):
+    """Create the staging table of ``target``, dropped with the transaction."""
+    return f"""
+    CREATE TEMP TABLE import_staging (LIKE {target.table})
+    ON COMMIT DROP;
+    ALTER TABLE import_staging ADD COLUMN line BIGINT NOT NULL;
+    """
+
+
+def index_staging_sql(target):
+    """Index and analyze the staging table once it is filled."""
+    return f"""
+    CREATE INDEX ON import_staging ({target.key}, line);
+    ANALYZE import_staging;
+    """
+
+
+def reject_checks(target):
+    """The ``(condition, reason)`` of every check, run in order on the staged rows."""
+    # A key uploaded several times keeps its last row.
+    superseded = (
+        f"""
+        EXISTS (
+            SELECT 1 FROM import_staging t
+            WHERE t.{target.key} = s.{target.key} AND t.line > s.line)
+        """,
+        "superseded by a later row with the same key",
+    )
+    return [superseded, *target.checks]
+
+
+def reject_sql(condition):
+    """Delete the staged rows matching ``condition``, returning their lines."""
+    return f"""
+    DELETE FROM import_staging s
+    WHERE {condition}
+    RETURNING line;
+    """
+
+
+def upsert_sql(target):
+    """Insert or update the rows left in the staging table."""
+    columns = [field.name for field in target.fields]
+    updates = ", ".join(
+        f"{column} = EXCLUDED.{column}"
+        for column in columns
+        if column != target.key
+    )
+    return f"""
+    INSERT INTO {target.table} ({', '.join(columns)})
+    SELECT {', '.join(columns)} FROM import_staging
+    ON CONFLICT ({target.key}) DO UPDATE SET {updates};
+    """
+
+
+def import_stream(conn, kind, stream, format="csv"):
+    """Import the text ``stream`` into the table of ``kind``.
+
+    Runs in a single transaction on ``conn``; returns a :class:`Result`.
+    """
+    target = TARGETS[kind]
+    columns = [field.name for field in target.fields]
+    result = Result()
+
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute(staging_sql(target))
+            with cur.copy(
+                f"COPY import_staging ({', '.join(columns)}, line) FROM STDIN"
+            ) as copy:
+                for line, record in READERS[format](stream):
+                    if isinstance(record, Exception):
+                        result.reject(line, str(record))
+                        continue
+                    # Header names are matched case-insensitively (TIN, SKU...).
+                    record = {str(k).lower(): v for k, v in record.items()}
+                    try:
+                        row = parse_row(target, record)
+                    except RowError as e:
+                        result.reject(line, str(e))
+                        continue
+                    copy.write_row(row + [line])
+
+            cur.execute(index_staging_sql(target))
+            for condition, reason in reject_checks(target):
+                for (line,) in cur.execute(reject_sql(condition)):
+                    result.reject(line, reason)
+
+            cur.execute(upsert_sql(target))
+            result.imported = cur.rowcount
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("kind", choices=sorted(TARGETS))
+    parser.add_argument("file", help="CSV or NDJSON file, '-' for stdin")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--database", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+
+    format = args.format
+    if format is None:
+        format = "ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv"
+
+    if args.file == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    else:
+        stream = open(args.file, encoding="utf-8", newline="")
+    with stream, psycopg.connect(args.database) as conn:
+        result = import_stream(conn, args.kind, stream, format)
+
+    json.dump(result.as_dict(), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if not result.rejected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
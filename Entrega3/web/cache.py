@@ -0,0 +1,75 @@
+"""In-process read-through cache for catalog reads."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Every invalidation bumps a version number; a value loaded while an
+    invalidation happened is returned to its caller but not stored, so a slow
+    read racing a write can never put stale data back in the cache.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Return the cached value for ``key``, calling ``load()`` on a miss."""
+        hit, value, version = self.lookup(key)
+        if hit:
+            return value
+        value = load()
+        self.store(key, value, version)
+        return value
+
+    def lookup(self, key):
+        """Return ``(hit, value, version)``; pass ``version`` on to :meth:`store`.
+
+        :meth:`get` is built from these two halves; callers that cannot pass a
+        plain function as the loader (e.g. coroutines) use them directly.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], self.version
+            self.misses += 1
+            return False, None, self.version
+
+    def store(self, key, value, version):
+        """Cache ``value`` unless the cache was invalidated since ``version``."""
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = (self.clock() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop ``key``, or every entry when no key is given."""
+        with self._lock:
+            self.version += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "version": self.version,
+            }
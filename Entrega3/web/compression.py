@@ -0,0 +1,112 @@
+"""gzip/brotli compression of the HTML and JSON responses.
+
+The encoding is negotiated from ``Accept-Encoding``: brotli when the client
+accepts it and the ``brotli`` package is installed, gzip otherwise. Streamed
+responses are compressed chunk by chunk, each chunk flushed as it is
+written, so streaming a page still delivers its first rows early.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+COMPRESSIBLE = {
+    "text/html",
+    "application/json",
+    "text/css",
+    "text/plain",
+    "text/csv",
+    "application/x-ndjson",
+}
+
+# Smaller bodies are sent as they are; the headers would outweigh the saving.
+MIN_SIZE = 512
+
+# Levels suited to compressing every response on the fly.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+class Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+# encoding -> compressor, in order of preference
+ENCODINGS = {"gzip": Gzip}
+if brotli is not None:
+    ENCODINGS = {"br": Brotli, **ENCODINGS}
+
+
+def negotiate(accept_encodings):
+    """The encoding of ``ENCODINGS`` the client prefers, or ``None``."""
+    return accept_encodings.best_match(list(ENCODINGS))
+
+
+def compress_stream(compressor, chunks, close=None):
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if close is not None:
+            close()
+
+
+def compress(response, accept_encodings):
+    """Compress ``response`` in the encoding negotiated from ``accept_encodings``."""
+    if (
+        response.mimetype not in COMPRESSIBLE
+        or response.direct_passthrough
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encodings)
+    if encoding is None:
+        return response
+
+    compressor = ENCODINGS[encoding]()
+    if response.is_streamed:
+        response.response = compress_stream(
+            compressor, response.iter_encoded(), getattr(response.response, "close", None)
+        )
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
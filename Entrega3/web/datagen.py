@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+"""Deterministic synthetic data for every table of the schema.
+
+The schema is rebuilt from ``schema.sql`` and every table is streamed in
+with ``COPY``, scaled from the number of orders. Each table draws from its
+own generator seeded with ``--seed``, so a given seed and scale always
+produce the same database.
+
+The data satisfies the integrity constraints by construction: employees
+are at least 18 (RI-1), every workplace is an office or a warehouse but not
+both (RI-2) and every order has at least one line (RI-3). To load at
+volume, the keys and foreign keys are dropped during the load and added
+back afterwards, and the RI-2/RI-3 triggers are replaced by one set-based
+check each before commit. The migrations run last, on the loaded data.
+
+Usage::
+
+    python datagen.py --database postgres://db:db@postgres/db --orders 10000000
+
+The public schema of the target database is dropped first.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date
+from datetime import timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+import psycopg
+from psycopg import sql
+
+from migrations import apply_migrations
+
+
+SCHEMA = Path(__file__).parent / "schema.sql"
+
+FIRST_DAY = date(2021, 1, 1)
+DAYS = 3 * 365
+# Every employee is born before LAST_BIRTHDAY, so all are of age (RI-1).
+FIRST_BIRTHDAY = date(1950, 1, 1)
+LAST_BIRTHDAY = date(2000, 1, 1)
+
+PAID = 0.7
+PROCESSED = 0.8
+MAX_LINES = 4
+
+DEPARTMENTS = ("Producao", "Marketing", "Contabilidade", "Recursos Humanos", "Logistica", "Vendas")
+CITIES = ("Lisboa", "Porto", "Braga", "Coimbra", "Faro", "Viseu", "Almada", "Aveiro", "Evora", "Setubal")
+STREETS = ("Rua Augusta", "Avenida da Liberdade", "Rua do Carmo", "Rua Direita", "Avenida Central", "Rua Nova")
+FIRST_NAMES = ("Ana", "Joao", "Maria", "Pedro", "Beatriz", "Jorge", "Catarina", "Rui", "Ines", "Tiago")
+LAST_NAMES = ("Silva", "Santos", "Ferreira", "Pereira", "Oliveira", "Costa", "Rodrigues", "Martins")
+PRODUCTS = ("Creme", "Shampoo", "Caneca", "Luvas", "Brincos", "Canetas", "Aroma", "Toalha", "Vela")
+
+
+class Scale(NamedTuple):
+    orders: int
+    customers: int
+    products: int
+    employees: int
+    workplaces: int
+    suppliers: int
+
+    @classmethod
+    def for_orders(cls, orders):
+        return cls(
+            orders=orders,
+            customers=max(orders // 10, 1),
+            products=max(orders // 100, MAX_LINES),
+            employees=max(orders // 1000, 10),
+            workplaces=max(orders // 10000, 3),
+            suppliers=max(orders // 100, 1),
+        )
+
+
+def name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def address(rng, i):
+    # "<street>, n<i>, <postal code> <city>": the city follows the postal code.
+    postal = f"{rng.randint(1000, 9999)}-{rng.randint(0, 999):03d}"
+    return f"{rng.choice(STREETS)}, n{i}, {postal} {rng.choice(CITIES)}"
+
+
+# The hot loops draw with random() rather than randint()/sample(), which are
+# several times slower, and pick dates from a precomputed list.
+ORDER_DAYS = [FIRST_DAY + timedelta(days=i) for i in range(DAYS)]
+
+
+def pick(rng, n):
+    """A number from 1 to ``n``."""
+    return 1 + int(rng.random() * n)
+
+
+def distinct(rng, n, k):
+    """``k`` different numbers from 1 to ``n`` (``k`` much smaller than ``n``)."""
+    picked = []
+    while len(picked) < k:
+        i = pick(rng, n)
+        if i not in picked:
+            picked.append(i)
+    return picked
+
+
+def day(rng):
+    return ORDER_DAYS[int(rng.random() * DAYS)]
+
+
+def sku(i):
+    return f"sku{i:09d}"
+
+
+def tin(i):
+    return f"tin{i:09d}"
+
+
+def ssn(i):
+    return f"ssn{i:09d}"
+
+
+def workplace_address(i):
+    return f"Workplace {i}, 1000-{i % 1000:03d} Lisboa"
+
+
+def is_office(i):
+    # Every third workplace is an office, the others are warehouses (RI-2).
+    return i % 3 == 0
+
+
+def warehouses(scale):
+    return [i for i in range(1, scale.workplaces + 1) if not is_office(i)]
+
+
+# Rows of each table, in load order.
+
+
+def department_rows(scale, rng):
+    for department in DEPARTMENTS:
+        yield (department,)
+
+
+def employee_rows(scale, rng):
+    days = (LAST_BIRTHDAY - FIRST_BIRTHDAY).days
+    for i in range(1, scale.employees + 1):
+        birthday = FIRST_BIRTHDAY + timedelta(days=rng.randrange(days))
+        yield ssn(i), f"{500000000 + i}", birthday, name(rng)
+
+
+def workplace_rows(scale, rng):
+    for i in range(1, scale.workplaces + 1):
+        # Distinct (lat, long) pairs from the workplace number.
+        lat = (i % 100000) / 1000 - 50
+        long = (i // 100000) / 1000 - 100
+        yield workplace_address(i), f"{lat:.6f}", f"{long:.6f}"
+
+
+def office_rows(scale, rng):
+    for i in range(1, scale.workplaces + 1):
+        if is_office(i):
+            yield (workplace_address(i),)
+
+
+def warehouse_rows(scale, rng):
+    for i in warehouses(scale):
+        yield (workplace_address(i),)
+
+
+def works_rows(scale, rng):
+    for i in range(1, scale.employees + 1):
+        for department in rng.sample(DEPARTMENTS, rng.randint(1, 2)):
+            yield ssn(i), department, workplace_address(rng.randint(1, scale.workplaces))
+
+
+def customer_rows(scale, rng):
+    for i in range(1, scale.customers + 1):
+        yield i, name(rng), f"customer{i}@example.com", f"9{i % 10**8:08d}", address(rng, i)
+
+
+def product_rows(scale, rng):
+    for i in range(1, scale.products + 1):
+        kind = rng.choice(PRODUCTS)
+        ean = 2000000000000 + i if rng.random() < 0.9 else None
+        price = f"{rng.randint(100, 50000) / 100:.2f}"
+        yield sku(i), f"{kind} {i}", f"{kind} de referencia {i}", price, ean
+
+
+def order_rows(scale, rng):
+    for i in range(1, scale.orders + 1):
+        yield i, pick(rng, scale.customers), day(rng)
+
+
+# The tables below depend on the orders: ``orders()`` replays the order rows
+# from the start, so all orders never have to be kept in memory.
+
+
+def contains_rows(scale, rng, orders):
+    for order_no, _, _ in orders():
+        # At least one line per order (RI-3).
+        for i in distinct(rng, scale.products, pick(rng, MAX_LINES)):
+            yield order_no, sku(i), pick(rng, 10)
+
+
+def pay_rows(scale, rng, orders):
+    for order_no, cust_no, _ in orders():
+        if rng.random() < PAID:
+            yield order_no, cust_no
+
+
+def process_rows(scale, rng, orders):
+    for order_no, _, _ in orders():
+        if rng.random() < PROCESSED:
+            for i in distinct(rng, scale.employees, pick(rng, 2)):
+                yield ssn(i), order_no
+
+
+def supplier_rows(scale, rng):
+    for i in range(1, scale.suppliers + 1):
+        yield tin(i), f"Fornecedor {i}", address(rng, i), sku(rng.randint(1, scale.products)), day(rng)
+
+
+def delivery_rows(scale, rng):
+    addresses = [workplace_address(i) for i in warehouses(scale)]
+    for i in range(1, scale.suppliers + 1):
+        for address in rng.sample(addresses, min(len(addresses), rng.randint(1, 2))):
+            yield address, tin(i)
+
+
+# table -> its rows, in load order
+TABLES = {
+    "department": department_rows,
+    "employee": employee_rows,
+    "workplace": workplace_rows,
+    "office": office_rows,
+    "warehouse": warehouse_rows,
+    "works": works_rows,
+    "customer": customer_rows,
+    "product": product_rows,
+    "orders": order_rows,
+    "contains": contains_rows,
+    "pay": pay_rows,
+    "process": process_rows,
+    "supplier": supplier_rows,
+    "delivery": delivery_rows,
+}
+
+ORDER_TABLES = ("contains", "pay", "process")
+
+# Integrity constraints enforced by triggers, checked once after the load.
+CHECKS = {
+    "RI-2": """
+        SELECT address FROM workplace w
+        WHERE EXISTS (SELECT 1 FROM office o WHERE o.address = w.address)
+            = EXISTS (SELECT 1 FROM warehouse h WHERE h.address = w.address)
+        LIMIT 1;
+    """,
+    "RI-3": """
+        SELECT order_no FROM orders o
+        WHERE NOT EXISTS (SELECT 1 FROM contains c WHERE c.order_no = o.order_no)
+        LIMIT 1;
+    """,
+}
+
+
+def drop_constraints(conn):
+    """Drop the keys and foreign keys of the schema; return them to restore."""
+    constraints = conn.execute(
+        """
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid), contype
+        FROM pg_constraint
+        WHERE connamespace = 'public'::regnamespace AND contype IN ('p', 'u', 'f')
+        ORDER BY contype = 'f' DESC;
+        """
+    ).fetchall()
+    for table, name, _, _ in constraints:
+        conn.execute(
+            sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(
+                sql.SQL(table), sql.Identifier(name)
+            )
+        )
+    return constraints
+
+
+def add_constraints(conn, constraints):
+    """Add ``constraints`` back, keys before the foreign keys that need them."""
+    for table, name, definition, _ in reversed(constraints):
+        conn.execute(
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {};").format(
+                sql.SQL(table), sql.Identifier(name), sql.SQL(definition)
+            )
+        )
+
+
+def copy_rows(cur, table, rows):
+    count = 0
+    with cur.copy(sql.SQL("COPY {} FROM STDIN;").format(sql.Identifier(table))) as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def generate(conn, orders, seed=0, log=None):
+    """Rebuild the schema on ``conn`` and fill it; return the rows per table."""
+    scale = Scale.for_orders(orders)
+    loaded = {}
+
+    def stream(table):
+        # One generator per table, so tables do not shift each other's data.
+        return random.Random(f"{seed}:{table}")
+
+    def replay_orders():
+        return order_rows(scale, stream("orders"))
+
+    with conn.transaction():
+        conn.execute("DROP SCHEMA public CASCADE;")
+        conn.execute("CREATE SCHEMA public;")
+        conn.execute(SCHEMA.read_text())
+        constraints = drop_constraints(conn)
+        for table in TABLES:
+            conn.execute(sql.SQL("ALTER TABLE {} DISABLE TRIGGER USER;").format(sql.Identifier(table)))
+
+        with conn.cursor() as cur:
+            for table, rows in TABLES.items():
+                start = time.perf_counter()
+                if table in ORDER_TABLES:
+                    data = rows(scale, stream(table), replay_orders)
+                else:
+                    data = rows(scale, stream(table))
+                loaded[table] = copy_rows(cur, table, data)
+                if log is not None:
+                    log(f"{table}: {loaded[table]} rows in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        add_constraints(conn, constraints)
+        for table in TABLES:
+            conn.execute(sql.SQL("ALTER TABLE {} ENABLE TRIGGER USER;").format(sql.Identifier(table)))
+        for constraint, query in CHECKS.items():
+            row = conn.execute(query).fetchone()
+            if row is not None:
+                raise ValueError(f"{constraint} does not hold for {row[0]}.")
+        if log is not None:
+            log(f"constraints: {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    apply_migrations(conn)
+    conn.execute("ANALYZE;")
+    conn.commit()
+    if log is not None:
+        log(f"migrations: {time.perf_counter() - start:.1f}s")
+    return loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", required=True, help="database whose public schema is replaced")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with psycopg.connect(args.database) as conn:
+        loaded = generate(conn, args.orders, args.seed, log=lambda message: print(message, file=sys.stderr))
+
+    json.dump(loaded, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Production serving: gunicorn, pre-forked workers with threads.
+
+The app is imported once in the master and forked into ``WEB_WORKERS``
+workers of ``WEB_THREADS`` threads each. Every worker opens its own
+connection pool after the fork, sized so the workers together stay within
+``DB_MAX_CONNECTIONS``, and fills and prepares it before taking requests.
+Each worker needs one connection at least, so there are never more workers
+than ``DB_MAX_CONNECTIONS``.
+
+On ``SIGHUP`` (reload) or ``SIGTERM`` the old workers stop accepting, end
+their live streams (the browsers reconnect to a new worker), finish the
+requests in flight for up to ``WEB_GRACEFUL_TIMEOUT`` seconds and close
+their pools. With the app preloaded, a reload restarts the workers but not
+the code; deploy new code by restarting the master (or ``SIGUSR2``).
+
+A live stream (``/events``) holds a thread for as long as it is open, so
+each worker serves at most ``LIVE_MAX_STREAMS`` of them (half its threads by
+default) and answers 503 to the next ones. For many open dashboards, route
+``/events`` to the ASGI server instead (``uvicorn asgi:application``, see
+``asgi.py``), where a stream holds no thread.
+
+Run with::
+
+    gunicorn --config gunicorn.conf.py
+"""
+import multiprocessing
+import os
+import signal
+import time
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+wsgi_app = os.environ.get("WEB_APP", "wsgi:app")
+bind = os.environ.get("WEB_BIND", "0.0.0.0:5001")
+worker_class = os.environ.get("WEB_WORKER_CLASS", "gthread")
+workers = env_int("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1)
+threads = env_int("WEB_THREADS", 8)
+graceful_timeout = env_int("WEB_GRACEFUL_TIMEOUT", 30)
+keepalive = env_int("WEB_KEEPALIVE", 5)
+preload_app = os.environ.get("WEB_PRELOAD", "1") != "0"
+
+# One connection per thread, unless the server allows fewer; then the
+# threads beyond the pool wait for admission (see admission.py), briefly,
+# or are answered 503.
+_connections = env_int("DB_MAX_CONNECTIONS", workers * threads)
+if _connections < 1:
+    raise ValueError("DB_MAX_CONNECTIONS is required to be positive.")
+# Every worker needs a connection: never more workers than connections.
+workers = min(workers, _connections)
+_pool_size = min(threads, _connections // workers)
+# Read by app.py when it is imported.
+os.environ.setdefault("DB_POOL_MIN_SIZE", str(_pool_size))
+os.environ.setdefault("DB_POOL_MAX_SIZE", str(_pool_size))
+# Live streams leave at least half the threads of a worker to the other
+# routes; a worker of a single thread serves none.
+os.environ.setdefault("LIVE_MAX_STREAMS", str(threads // 2))
+
+
+def post_worker_init(worker):
+    # Runs in the worker after the fork and before it accepts connections.
+    import app
+
+    start = time.perf_counter()
+    app.warm_up()
+    worker.log.info(f"Worker {worker.pid} ready in {time.perf_counter() - start:.2f}s.")
+
+    # Long-lived live streams would hold a graceful shutdown for the whole
+    # timeout: end them as soon as the worker is asked to stop.
+    handle_exit = worker.handle_exit
+
+    def drain(sig, frame):
+        app.broker.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.shut_down()
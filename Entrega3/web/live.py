@@ -0,0 +1,190 @@
+"""Live feed of orders, payments and product changes as Server-Sent Events.
+
+The database sends every change on the ``live_events`` channel (migration
+0006). Each process holds one ``LISTEN`` connection, in a background thread,
+and fans the events out to all of its subscribers, so open dashboards cost
+no queries at all.
+
+Every subscriber has a bounded queue. The listener never waits for a
+subscriber: one that falls ``QUEUE_SIZE`` events behind is disconnected,
+and its ``EventSource`` reconnects with the ``Last-Event-ID`` it got to.
+The last ``REPLAY_SIZE`` events are kept to replay from there; a client
+whose last event is no longer kept (or that may have missed events while
+the listener reconnected) gets a ``reset`` event instead, telling it to
+reload what it shows.
+"""
+import json
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+import psycopg
+
+import metrics
+
+
+CHANNEL = "live_events"
+
+QUEUE_SIZE = 256
+REPLAY_SIZE = 1024
+
+# Seconds between keep-alive comments on an idle stream, which also detect
+# clients that went away.
+HEARTBEAT = 15
+# Milliseconds the browser waits before reconnecting.
+RETRY = 3000
+# Seconds between attempts to reconnect the listener.
+RECONNECT_DELAY = 1
+
+
+class Event(NamedTuple):
+    id: str
+    event: str
+    data: str
+
+    def format(self):
+        fields = f"event: {self.event}\ndata: {self.data}\n\n"
+        return f"id: {self.id}\n{fields}" if self.id else fields
+
+
+# Has no id, so the client keeps resuming from the last event it got.
+RESET = Event("", "reset", "{}")
+
+
+class Subscriber:
+    """The events pending for one client; ``wake`` is called on each delivery."""
+
+    def __init__(self, wake, maxsize=QUEUE_SIZE):
+        self.wake = wake
+        self.maxsize = maxsize
+        self.events = deque()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def deliver(self, event):
+        with self._lock:
+            if self.closed:
+                return
+            if len(self.events) >= self.maxsize:
+                self.closed = True
+                metrics.LIVE_DROPPED.inc()
+            else:
+                self.events.append(event)
+        self.wake()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        self.wake()
+
+    def drain(self):
+        """Return ``(events, closed)``: the pending events, and whether to disconnect."""
+        with self._lock:
+            events = list(self.events)
+            self.events.clear()
+            return events, self.closed
+
+
+class Broker:
+    """The ``LISTEN`` connection of this process and its subscribers.
+
+    The listener thread starts with the first subscription, so a process
+    forked after import starts its own.
+    """
+
+    def __init__(self, conninfo, log=None):
+        self.conninfo = conninfo
+        self.log = log
+        self.recent = deque(maxlen=REPLAY_SIZE)
+        self.subscribers = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, wake, last_event_id=None):
+        """Register a subscriber, with the events after ``last_event_id`` pending."""
+        subscriber = Subscriber(wake)
+        with self._lock:
+            self._start()
+            if last_event_id:
+                ids = [event.id for event in self.recent]
+                if last_event_id in ids:
+                    subscriber.events.extend(list(self.recent)[ids.index(last_event_id) + 1:])
+                else:
+                    subscriber.events.append(RESET)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            self.recent.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(event)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._listen, name="live-listener", daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        connected_before = False
+        while True:
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {CHANNEL};")
+                    if connected_before:
+                        # Events sent while disconnected are lost: the
+                        # replay buffer cannot bridge the gap.
+                        with self._lock:
+                            self.recent.clear()
+                        self.publish(RESET)
+                    connected_before = True
+                    for notify in conn.notifies():
+                        self.publish(parse(notify.payload))
+            except psycopg.Error as e:
+                if self.log is not None:
+                    self.log.warning(f"Live feed listener disconnected: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+    def stream(self, last_event_id=None):
+        """Yield the Server-Sent Events of a new subscriber, as text."""
+        wakeup = threading.Event()
+        subscriber = self.subscribe(wakeup.set, last_event_id)
+        try:
+            yield f"retry: {RETRY}\n\n"
+            while True:
+                wakeup.clear()
+                events, closed = subscriber.drain()
+                if events:
+                    yield "".join(event.format() for event in events)
+                if closed:
+                    return
+                if not wakeup.wait(HEARTBEAT):
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self):
+        """Disconnect every subscriber, e.g. before the process exits.
+
+        Their browsers reconnect, to another process, and resume there.
+        """
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self.subscribers), "recent": len(self.recent)}
+
+
+def parse(payload):
+    message = json.loads(payload)
+    metrics.LIVE_EVENTS.inc(message["event"])
+    return Event(str(message["id"]), message["event"], json.dumps(message["data"]))
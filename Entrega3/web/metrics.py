@@ -0,0 +1,210 @@
+"""Process-local metrics, exposed in the Prometheus text format."""
+import math
+import threading
+
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[labels] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _labels(self.labels, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Collector:
+    """Metrics read from elsewhere at scrape time.
+
+    ``collect`` returns ``(name, type, help, [(labels dict, value), ...])``
+    tuples.
+    """
+
+    def __init__(self, collect):
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = []
+        for name, type, help, samples in self.collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+            for labels, value in samples:
+                pairs = list(labels.items())
+                lines.append(f"{name}{_labels((), (), pairs)} {_number(value)}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    """The whole registry in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("route", "method", "status"),
+)
+
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing each named SQL statement.",
+    ("query",),
+)
+
+QUERY_ROWS = Counter(
+    "db_query_rows_total",
+    "Rows returned or affected by each named SQL statement.",
+    ("query",),
+)
+
+LIVE_EVENTS = Counter(
+    "live_events_total",
+    "Events received on the live feed.",
+    ("event",),
+)
+
+LIVE_DROPPED = Counter(
+    "live_subscribers_dropped_total",
+    "Live feed subscribers disconnected for falling behind.",
+)
+
+READ_ROUTES = Counter(
+    "db_read_routes_total",
+    "Reads routed to each replica or to the primary, and why.",
+    ("target", "reason"),
+)
+
+ADMISSION_QUEUED = Counter(
+    "http_requests_queued_total",
+    "Requests that waited to be admitted, by route endpoint and priority class.",
+    ("endpoint", "class"),
+)
+
+ADMISSION_SHED = Counter(
+    "http_requests_shed_total",
+    "Requests answered 503 instead of served, and why.",
+    ("endpoint", "class", "reason"),
+)
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "http_request_admission_wait_seconds",
+    "Time requests waited to be admitted.",
+    ("class",),
+)
+
+
+# Pools whose ConnectionPool.get_stats() is exported, by name.
+POOLS = {}
+
+# name in get_stats() -> (metric, type, help, scale)
+POOL_STATS = {
+    "pool_min": ("db_pool_min_size", "gauge", "Minimum number of connections.", 1),
+    "pool_max": ("db_pool_max_size", "gauge", "Maximum number of connections.", 1),
+    "pool_size": ("db_pool_size", "gauge", "Connections currently managed by the pool.", 1),
+    "pool_available": ("db_pool_available", "gauge", "Idle connections in the pool.", 1),
+    "requests_waiting": ("db_pool_requests_waiting", "gauge", "Clients waiting for a connection.", 1),
+    "requests_num": ("db_pool_requests_total", "counter", "Connection requests made to the pool.", 1),
+    "requests_queued": ("db_pool_requests_queued_total", "counter", "Connection requests that had to wait.", 1),
+    "requests_wait_ms": ("db_pool_requests_wait_seconds_total", "counter", "Time spent waiting for a connection.", 0.001),
+    "requests_errors": ("db_pool_requests_errors_total", "counter", "Connection requests that timed out or failed.", 1),
+    "usage_ms": ("db_pool_usage_seconds_total", "counter", "Time connections were checked out.", 0.001),
+    "connections_num": ("db_pool_connections_total", "counter", "Connection attempts to the server.", 1),
+    "connections_ms": ("db_pool_connections_seconds_total", "counter", "Time spent establishing connections.", 0.001),
+    "connections_errors": ("db_pool_connections_errors_total", "counter", "Failed connection attempts.", 1),
+    "connections_lost": ("db_pool_connections_lost_total", "counter", "Connections found broken.", 1),
+    "returns_bad": ("db_pool_returns_bad_total", "counter", "Connections returned in a bad state.", 1),
+}
+
+
+def _collect_pools():
+    stats = {name: pool.get_stats() for name, pool in POOLS.items()}
+    for key, (metric, type, help, scale) in POOL_STATS.items():
+        samples = [
+            ({"pool": name}, values.get(key, 0) * scale) for name, values in stats.items()
+        ]
+        yield metric, type, help, samples
+
+
+Collector(_collect_pools)
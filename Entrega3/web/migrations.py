@@ -0,0 +1,38 @@
+"""Schema migrations applied by the app on startup.
+
+Each ``migrations/*.sql`` file runs once, in name order, and is recorded in
+``schema_migrations``. An advisory lock keeps concurrent workers from
+applying the same file twice.
+"""
+from pathlib import Path
+
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+
+def apply_migrations(conn, log=None):
+    """Apply the pending migrations on ``conn``; return their names."""
+    applied = []
+    with conn.transaction():
+        conn.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'));")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations(
+            name VARCHAR PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            """
+        )
+        done = {row[0] for row in conn.execute("SELECT name FROM schema_migrations;")}
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            if path.name in done:
+                continue
+            if log is not None:
+                log.info(f"Applying migration {path.name}.")
+            conn.execute(path.read_text())
+            conn.execute(
+                "INSERT INTO schema_migrations(name) VALUES (%(name)s);",
+                {"name": path.name},
+            )
+            applied.append(path.name)
+    return applied
@@ -0,0 +1,9 @@
+-- Indexes backing the keyset pagination of the list endpoints.
+-- customer(cust_no) and orders(order_no) are already covered by their
+-- primary keys.
+
+CREATE INDEX IF NOT EXISTS product_price_sku_index ON product(price, SKU);
+
+-- The supplier list sorts NULL dates first, as ORDER BY date DESC does.
+CREATE INDEX IF NOT EXISTS supplier_date_tin_index
+ON supplier((COALESCE(date, 'infinity'::DATE)), TIN);
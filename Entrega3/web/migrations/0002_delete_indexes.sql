@@ -0,0 +1,9 @@
+-- Indexes used by the cascade deletes to reach only the rows of the
+-- deleted products, clients and suppliers.
+
+CREATE INDEX IF NOT EXISTS contains_sku_index ON contains(SKU);
+CREATE INDEX IF NOT EXISTS process_order_no_index ON process(order_no);
+CREATE INDEX IF NOT EXISTS orders_cust_no_index ON orders(cust_no);
+CREATE INDEX IF NOT EXISTS pay_cust_no_index ON pay(cust_no);
+CREATE INDEX IF NOT EXISTS supplier_sku_index ON supplier(SKU);
+CREATE INDEX IF NOT EXISTS delivery_tin_index ON delivery(TIN);
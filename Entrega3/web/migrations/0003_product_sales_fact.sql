@@ -0,0 +1,165 @@
+-- product_sales as a fact table kept up to date by triggers, so the OLAP
+-- reports read one precomputed row per paid order line instead of joining
+-- customer, pay, orders, contains and product, and parsing the city out of
+-- the address, on every query.
+
+CREATE TABLE IF NOT EXISTS product_sales_fact(
+order_no INTEGER NOT NULL,
+SKU VARCHAR(25) NOT NULL,
+qty INTEGER,
+total_price NUMERIC,
+year INTEGER NOT NULL,
+month INTEGER NOT NULL,
+day_of_month INTEGER NOT NULL,
+day_of_week INTEGER NOT NULL,
+city VARCHAR(255),
+PRIMARY KEY (order_no, SKU)
+);
+
+CREATE INDEX IF NOT EXISTS product_sales_fact_year_index ON product_sales_fact(year);
+
+
+-- The city is what follows the postal code ("1000-100 Lisboa").
+CREATE OR REPLACE FUNCTION address_city(address VARCHAR) RETURNS VARCHAR AS $$
+    SELECT SUBSTRING(address, length(address)-position('-' in REVERSE(address))+5);
+$$ LANGUAGE sql IMMUTABLE;
+
+
+-- Recompute the fact rows of the given orders from the base tables.
+CREATE OR REPLACE FUNCTION refresh_product_sales(order_nos INTEGER[]) RETURNS VOID AS $$
+BEGIN
+    -- Serializes concurrent refreshes of the same order; the statements
+    -- below then see the rows committed by the transaction waited on.
+    PERFORM 1 FROM orders
+    WHERE order_no = ANY(order_nos)
+    ORDER BY order_no
+    FOR NO KEY UPDATE;
+
+    DELETE FROM product_sales_fact WHERE order_no = ANY(order_nos);
+
+    INSERT INTO product_sales_fact
+    SELECT c.order_no, p.SKU, c.qty, c.qty*p.price,
+        EXTRACT(YEAR FROM o.date), EXTRACT(MONTH FROM o.date),
+        EXTRACT(DAY FROM o.date), EXTRACT(DOW FROM o.date),
+        address_city(cu.address)
+    FROM customer cu JOIN pay USING (cust_no) JOIN orders o USING (order_no)
+    JOIN contains c USING (order_no)
+    JOIN product p USING (SKU)
+    WHERE pay.order_no = ANY(order_nos)
+    ON CONFLICT (order_no, SKU) DO UPDATE
+    SET qty = EXCLUDED.qty, total_price = EXCLUDED.total_price,
+        year = EXCLUDED.year, month = EXCLUDED.month,
+        day_of_month = EXCLUDED.day_of_month, day_of_week = EXCLUDED.day_of_week,
+        city = EXCLUDED.city;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- pay and contains: refresh every order a statement touched.
+CREATE OR REPLACE FUNCTION product_sales_refresh_orders() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_product_sales(ARRAY(SELECT DISTINCT order_no FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_sales(ARRAY(SELECT DISTINCT order_no FROM old_rows));
+    ELSE
+        PERFORM refresh_product_sales(ARRAY(
+            SELECT order_no FROM new_rows UNION SELECT order_no FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- orders: a new date moves the order to other days.
+CREATE OR REPLACE FUNCTION product_sales_refresh_dates() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_product_sales(ARRAY(
+        SELECT n.order_no
+        FROM new_rows n JOIN old_rows o USING (order_no)
+        WHERE n.date IS DISTINCT FROM o.date));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- product: a new price changes the total of every line of the product.
+CREATE OR REPLACE FUNCTION product_sales_refresh_prices() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE product_sales_fact s
+    SET total_price = s.qty*n.price
+    FROM new_rows n JOIN old_rows o USING (SKU)
+    WHERE s.SKU = n.SKU AND n.price IS DISTINCT FROM o.price;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- customer: a new address moves the orders the customer paid to its city.
+CREATE OR REPLACE FUNCTION product_sales_refresh_cities() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE product_sales_fact s
+    SET city = address_city(n.address)
+    FROM new_rows n JOIN old_rows o USING (cust_no) JOIN pay USING (cust_no)
+    WHERE s.order_no = pay.order_no AND n.address IS DISTINCT FROM o.address;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Statement-level triggers with transition tables, so bulk writes (imports,
+-- cascade deletes, checkout) refresh the fact table once per statement.
+-- A trigger with transition tables fires on a single event.
+
+DROP TRIGGER IF EXISTS product_sales_pay_insert ON pay;
+CREATE TRIGGER product_sales_pay_insert AFTER INSERT ON pay
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_pay_update ON pay;
+CREATE TRIGGER product_sales_pay_update AFTER UPDATE ON pay
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_pay_delete ON pay;
+CREATE TRIGGER product_sales_pay_delete AFTER DELETE ON pay
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_contains_insert ON contains;
+CREATE TRIGGER product_sales_contains_insert AFTER INSERT ON contains
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_contains_update ON contains;
+CREATE TRIGGER product_sales_contains_update AFTER UPDATE ON contains
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_contains_delete ON contains;
+CREATE TRIGGER product_sales_contains_delete AFTER DELETE ON contains
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_orders();
+
+DROP TRIGGER IF EXISTS product_sales_orders_update ON orders;
+CREATE TRIGGER product_sales_orders_update AFTER UPDATE ON orders
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_dates();
+
+DROP TRIGGER IF EXISTS product_sales_product_update ON product;
+CREATE TRIGGER product_sales_product_update AFTER UPDATE ON product
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_prices();
+
+DROP TRIGGER IF EXISTS product_sales_customer_update ON customer;
+CREATE TRIGGER product_sales_customer_update AFTER UPDATE ON customer
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION product_sales_refresh_cities();
+
+
+-- Backfill, and keep product_sales readable by the report's queries.
+SELECT refresh_product_sales(ARRAY(SELECT order_no FROM pay));
+
+DROP VIEW IF EXISTS product_sales;
+CREATE VIEW product_sales(SKU, order_no, qty, total_price, year,
+                          month, day_of_month, day_of_week, city) AS
+    SELECT SKU, order_no, qty, total_price, year,
+        month, day_of_month, day_of_week, city
+    FROM product_sales_fact;
@@ -0,0 +1,18 @@
+-- Indexes backing the product search (see queries.SEARCHES).
+
+-- Prefix search: lower(name) LIKE 'abc%' is a range scan of this index, which
+-- also returns the matches in the order of the search keyset. With the "C"
+-- collation it compares bytes like text_pattern_ops does, but unlike
+-- text_pattern_ops it also serves ORDER BY and the keyset row comparison.
+CREATE INDEX IF NOT EXISTS product_name_prefix_index
+ON product((lower(name) COLLATE "C"), SKU);
+
+-- Substring and fuzzy search: trigram indexes answer ILIKE '%abc%' and the
+-- word similarity operator (<%) without reading the whole catalog.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS product_name_trgm_index
+ON product USING GIN (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS product_description_trgm_index
+ON product USING GIN (description gin_trgm_ops);
@@ -0,0 +1,39 @@
+-- A change counter per listed table, for the ETags of the list endpoints.
+-- It is bumped in the writing transaction, so a new version becomes visible
+-- together with the rows that changed and never before them.
+
+CREATE TABLE IF NOT EXISTS table_versions(
+name VARCHAR PRIMARY KEY,
+version BIGINT NOT NULL DEFAULT 1,
+changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO table_versions(name) VALUES (TG_TABLE_NAME)
+    ON CONFLICT (name) DO UPDATE
+    SET version = table_versions.version + 1, changed_at = now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Once per statement, so bulk writes bump the version once.
+DROP TRIGGER IF EXISTS product_version ON product;
+CREATE TRIGGER product_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS supplier_version ON supplier;
+CREATE TRIGGER supplier_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON supplier
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS customer_version ON customer;
+CREATE TRIGGER customer_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customer
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS orders_version ON orders;
+CREATE TRIGGER orders_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON orders
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions(name)
+VALUES ('product'), ('supplier'), ('customer'), ('orders')
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,56 @@
+-- Notifications for the live feed (live.py, GET /events): new orders,
+-- payments and product price/description changes are sent on the
+-- live_events channel as {"id": ..., "event": ..., "data": {...}}.
+-- NOTIFY is delivered on commit, in commit order, and only if the
+-- transaction commits.
+
+CREATE SEQUENCE IF NOT EXISTS live_event_ids;
+
+CREATE OR REPLACE FUNCTION notify_live_event(event TEXT, data JSON) RETURNS VOID AS $$
+    SELECT pg_notify('live_events', json_build_object(
+        'id', nextval('live_event_ids'), 'event', event, 'data', data)::TEXT);
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION live_orders_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_event('order', row_to_json(n))
+    FROM (SELECT order_no, cust_no, date FROM new_rows ORDER BY order_no) n;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION live_pay_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_event('payment', row_to_json(n))
+    FROM (SELECT order_no, cust_no FROM new_rows ORDER BY order_no) n;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A notification carries at most 8000 bytes, so long descriptions are cut.
+CREATE OR REPLACE FUNCTION live_product_updated() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_event('product', json_build_object(
+        'sku', n.SKU, 'name', n.name, 'price', n.price,
+        'description', left(n.description, 4000)))
+    FROM new_rows n JOIN old_rows o USING (SKU)
+    WHERE n.price IS DISTINCT FROM o.price
+    OR n.description IS DISTINCT FROM o.description;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS live_orders_insert ON orders;
+CREATE TRIGGER live_orders_insert AFTER INSERT ON orders
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION live_orders_inserted();
+
+DROP TRIGGER IF EXISTS live_pay_insert ON pay;
+CREATE TRIGGER live_pay_insert AFTER INSERT ON pay
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION live_pay_inserted();
+
+DROP TRIGGER IF EXISTS live_product_update ON product;
+CREATE TRIGGER live_product_update AFTER UPDATE ON product
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION live_product_updated();
@@ -0,0 +1,186 @@
+-- The value of every order and the value each customer paid, kept up to date
+-- by triggers, so order totals and the top customers by paid value are read
+-- from one row instead of summing qty*price over product, contains and pay.
+--
+-- Every write refreshes only the orders and customers it touched: it locks
+-- them, then recomputes them from the rows as they are now. The triggers of
+-- one statement (e.g. the cascade deletes) may fire in any order and still
+-- leave the totals right.
+
+CREATE TABLE IF NOT EXISTS order_totals(
+order_no INTEGER PRIMARY KEY,
+total NUMERIC NOT NULL,
+lines INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS customer_paid_totals(
+cust_no INTEGER PRIMARY KEY,
+paid_total NUMERIC NOT NULL,
+paid_orders INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS customer_paid_totals_top_index
+ON customer_paid_totals(paid_total DESC, cust_no);
+
+
+-- Recompute the paid totals of the given customers; a customer with no paid
+-- order left has no row.
+CREATE OR REPLACE FUNCTION refresh_customer_totals(cust_nos INTEGER[]) RETURNS VOID AS $$
+BEGIN
+    -- Serializes concurrent refreshes of the same customer; the statements
+    -- below then see the totals committed by the transaction waited on.
+    PERFORM 1 FROM customer
+    WHERE cust_no = ANY(cust_nos)
+    ORDER BY cust_no
+    FOR NO KEY UPDATE;
+
+    DELETE FROM customer_paid_totals t
+    WHERE t.cust_no = ANY(cust_nos)
+    AND NOT EXISTS (SELECT 1 FROM pay WHERE pay.cust_no = t.cust_no);
+
+    INSERT INTO customer_paid_totals
+    SELECT pay.cust_no, COALESCE(SUM(t.total), 0), COUNT(*)
+    FROM pay LEFT JOIN order_totals t USING (order_no)
+    WHERE pay.cust_no = ANY(cust_nos)
+    GROUP BY pay.cust_no
+    ON CONFLICT (cust_no) DO UPDATE
+    SET paid_total = EXCLUDED.paid_total, paid_orders = EXCLUDED.paid_orders;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute the totals of the given orders, then the paid totals of the
+-- customers who paid them; an order that no longer exists has no row.
+CREATE OR REPLACE FUNCTION refresh_order_totals(order_nos INTEGER[]) RETURNS VOID AS $$
+BEGIN
+    PERFORM 1 FROM orders
+    WHERE order_no = ANY(order_nos)
+    ORDER BY order_no
+    FOR NO KEY UPDATE;
+
+    DELETE FROM order_totals t
+    WHERE t.order_no = ANY(order_nos)
+    AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.order_no = t.order_no);
+
+    INSERT INTO order_totals
+    SELECT o.order_no, COALESCE(SUM(c.qty*p.price), 0), COUNT(c.SKU)
+    FROM orders o
+    LEFT JOIN contains c USING (order_no)
+    LEFT JOIN product p USING (SKU)
+    WHERE o.order_no = ANY(order_nos)
+    GROUP BY o.order_no
+    ON CONFLICT (order_no) DO UPDATE
+    SET total = EXCLUDED.total, lines = EXCLUDED.lines;
+
+    PERFORM refresh_customer_totals(ARRAY(
+        SELECT DISTINCT cust_no FROM pay WHERE order_no = ANY(order_nos)));
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- contains and orders: refresh every order a statement touched.
+CREATE OR REPLACE FUNCTION order_totals_refresh_orders() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_order_totals(ARRAY(SELECT DISTINCT order_no FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_order_totals(ARRAY(SELECT DISTINCT order_no FROM old_rows));
+    ELSE
+        PERFORM refresh_order_totals(ARRAY(
+            SELECT order_no FROM new_rows UNION SELECT order_no FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- pay and customer: refresh every customer a statement touched.
+CREATE OR REPLACE FUNCTION order_totals_refresh_customers() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_customer_totals(ARRAY(SELECT DISTINCT cust_no FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_customer_totals(ARRAY(SELECT DISTINCT cust_no FROM old_rows));
+    ELSE
+        PERFORM refresh_customer_totals(ARRAY(
+            SELECT cust_no FROM new_rows UNION SELECT cust_no FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- product: a new price changes the total of every order of the product.
+CREATE OR REPLACE FUNCTION order_totals_refresh_prices() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_order_totals(ARRAY(
+        SELECT DISTINCT c.order_no
+        FROM new_rows n JOIN old_rows o USING (SKU) JOIN contains c USING (SKU)
+        WHERE n.price IS DISTINCT FROM o.price));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Statement-level triggers with transition tables, as for product_sales_fact
+-- (migration 0003). A trigger with transition tables fires on a single event.
+
+DROP TRIGGER IF EXISTS order_totals_contains_insert ON contains;
+CREATE TRIGGER order_totals_contains_insert AFTER INSERT ON contains
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_orders();
+
+DROP TRIGGER IF EXISTS order_totals_contains_update ON contains;
+CREATE TRIGGER order_totals_contains_update AFTER UPDATE ON contains
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_orders();
+
+DROP TRIGGER IF EXISTS order_totals_contains_delete ON contains;
+CREATE TRIGGER order_totals_contains_delete AFTER DELETE ON contains
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_orders();
+
+DROP TRIGGER IF EXISTS order_totals_orders_delete ON orders;
+CREATE TRIGGER order_totals_orders_delete AFTER DELETE ON orders
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_orders();
+
+DROP TRIGGER IF EXISTS order_totals_pay_insert ON pay;
+CREATE TRIGGER order_totals_pay_insert AFTER INSERT ON pay
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_customers();
+
+DROP TRIGGER IF EXISTS order_totals_pay_update ON pay;
+CREATE TRIGGER order_totals_pay_update AFTER UPDATE ON pay
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_customers();
+
+DROP TRIGGER IF EXISTS order_totals_pay_delete ON pay;
+CREATE TRIGGER order_totals_pay_delete AFTER DELETE ON pay
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_customers();
+
+DROP TRIGGER IF EXISTS order_totals_customer_delete ON customer;
+CREATE TRIGGER order_totals_customer_delete AFTER DELETE ON customer
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_customers();
+
+DROP TRIGGER IF EXISTS order_totals_product_update ON product;
+CREATE TRIGGER order_totals_product_update AFTER UPDATE ON product
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION order_totals_refresh_prices();
+
+
+-- Backfill in two set-based statements rather than order by order.
+INSERT INTO order_totals
+SELECT o.order_no, COALESCE(SUM(c.qty*p.price), 0), COUNT(c.SKU)
+FROM orders o
+LEFT JOIN contains c USING (order_no)
+LEFT JOIN product p USING (SKU)
+GROUP BY o.order_no
+ON CONFLICT (order_no) DO UPDATE
+SET total = EXCLUDED.total, lines = EXCLUDED.lines;
+
+INSERT INTO customer_paid_totals
+SELECT pay.cust_no, COALESCE(SUM(t.total), 0), COUNT(*)
+FROM pay LEFT JOIN order_totals t USING (order_no)
+GROUP BY pay.cust_no
+ON CONFLICT (cust_no) DO UPDATE
+SET paid_total = EXCLUDED.paid_total, paid_orders = EXCLUDED.paid_orders;
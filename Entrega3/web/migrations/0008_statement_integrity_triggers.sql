@@ -0,0 +1,142 @@
+-- The RI-2 and RI-3 triggers of schema.sql as statement-level triggers with
+-- transition tables: a bulk insert (an import, a checkout of many lines) is
+-- validated with one set-based query per statement instead of a PL/pgSQL
+-- call and its lookups per row. The errors, and when they are raised, are
+-- the ones of schema.sql.
+--
+-- An office or warehouse that is both is rejected after the statement that
+-- inserted it, as before. A workplace that is neither and an order with no
+-- line are still rejected at commit (or at SET CONSTRAINTS ... IMMEDIATE),
+-- since the office or the lines are inserted after them. Constraint
+-- triggers can only be row-level, so those statements record the rows
+-- they inserted as pending, and once per transaction a row in
+-- integrity_checks queues a deferred constraint trigger that validates
+-- and clears all the pending rows at once. Its constraint keeps the name
+-- of the trigger it replaces, for SET CONSTRAINTS.
+--
+-- The pending rows never outlive their transaction, so every transaction
+-- only ever sees its own, and the tables are unlogged.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS pending_workplaces(
+address VARCHAR NOT NULL
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS pending_orders(
+order_no INTEGER NOT NULL
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS integrity_checks(
+xact XID8 NOT NULL,
+name VARCHAR NOT NULL,
+PRIMARY KEY (xact, name)
+);
+
+
+-- (RI-2) new_rows are the offices or the warehouses a statement inserted.
+CREATE OR REPLACE FUNCTION check_warehouse_office_rows() RETURNS TRIGGER AS $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM new_rows n
+        WHERE EXISTS (SELECT 1 FROM warehouse h WHERE h.address = n.address)
+        AND EXISTS (SELECT 1 FROM office o WHERE o.address = n.address)
+    ) THEN
+        RAISE EXCEPTION 'Um Worlplace não pode ser ambos(um office e warehouse) simultaneamemte.';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Queue the deferred check of constraint trigger `name` once per transaction.
+CREATE OR REPLACE FUNCTION queue_integrity_check(name VARCHAR) RETURNS VOID AS $$
+    INSERT INTO integrity_checks VALUES (pg_current_xact_id(), name)
+    ON CONFLICT DO NOTHING;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION workplaces_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO pending_workplaces SELECT address FROM new_rows;
+    PERFORM queue_integrity_check('check_workplace_trigger');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orders_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO pending_orders SELECT order_no FROM new_rows;
+    PERFORM queue_integrity_check('order_in_contains');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- (RI-2) Every workplace inserted is an office or a warehouse.
+CREATE OR REPLACE FUNCTION check_pending_workplaces() RETURNS TRIGGER AS $$
+DECLARE
+    missing VARCHAR;
+BEGIN
+    DELETE FROM integrity_checks WHERE xact = NEW.xact AND name = NEW.name;
+    WITH pending AS (DELETE FROM pending_workplaces RETURNING address)
+    SELECT p.address INTO missing FROM pending p
+    WHERE NOT EXISTS (SELECT 1 FROM office o WHERE o.address = p.address)
+    AND NOT EXISTS (SELECT 1 FROM warehouse h WHERE h.address = p.address)
+    LIMIT 1;
+    IF FOUND THEN
+        RAISE EXCEPTION 'Um Workplace tem de ser um Warehouse ou um Office.';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- (RI-3) Every order inserted has a line in contains.
+CREATE OR REPLACE FUNCTION check_pending_orders() RETURNS TRIGGER AS $$
+DECLARE
+    missing INTEGER;
+BEGIN
+    DELETE FROM integrity_checks WHERE xact = NEW.xact AND name = NEW.name;
+    WITH pending AS (DELETE FROM pending_orders RETURNING order_no)
+    SELECT p.order_no INTO missing FROM pending p
+    WHERE NOT EXISTS (SELECT 1 FROM contains c WHERE c.order_no = p.order_no)
+    LIMIT 1;
+    IF FOUND THEN
+        RAISE EXCEPTION 'Uma "Order" tem de figurar obrigatoriamente em "Contains".';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS check_workplace_trigger ON warehouse;
+DROP TRIGGER IF EXISTS check_workplace_trigger ON office;
+DROP TRIGGER IF EXISTS check_workplace_trigger ON workplace;
+DROP TRIGGER IF EXISTS order_in_contains ON orders;
+
+DROP TRIGGER IF EXISTS check_warehouse_office ON warehouse;
+CREATE TRIGGER check_warehouse_office AFTER INSERT ON warehouse
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION check_warehouse_office_rows();
+
+DROP TRIGGER IF EXISTS check_warehouse_office ON office;
+CREATE TRIGGER check_warehouse_office AFTER INSERT ON office
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION check_warehouse_office_rows();
+
+DROP TRIGGER IF EXISTS workplace_pending ON workplace;
+CREATE TRIGGER workplace_pending AFTER INSERT ON workplace
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION workplaces_inserted();
+
+DROP TRIGGER IF EXISTS orders_pending ON orders;
+CREATE TRIGGER orders_pending AFTER INSERT ON orders
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION orders_inserted();
+
+DROP TRIGGER IF EXISTS check_workplace_trigger ON integrity_checks;
+CREATE CONSTRAINT TRIGGER check_workplace_trigger AFTER INSERT ON integrity_checks
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW WHEN (NEW.name = 'check_workplace_trigger')
+EXECUTE FUNCTION check_pending_workplaces();
+
+DROP TRIGGER IF EXISTS order_in_contains ON integrity_checks;
+CREATE CONSTRAINT TRIGGER order_in_contains AFTER INSERT ON integrity_checks
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW WHEN (NEW.name = 'order_in_contains')
+EXECUTE FUNCTION check_pending_orders();
@@ -0,0 +1,40 @@
+-- The change counters of migration 0005 spread over slots, so concurrent
+-- writers of a table no longer wait for each other on its one row until
+-- they commit. Every writing statement bumps a slot no other transaction
+-- holds, and the version of a table is the sum of its slots: each commit
+-- raises it, in whatever order the writers commit. (The largest number
+-- drawn from a sequence would not change when a writer that drew a
+-- smaller one commits after one that drew a larger one.)
+
+ALTER TABLE table_versions ADD COLUMN IF NOT EXISTS slot INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE table_versions DROP CONSTRAINT IF EXISTS table_versions_pkey;
+ALTER TABLE table_versions ADD PRIMARY KEY (name, slot);
+
+-- 32 slots per table; the counts so far stay in slot 0, so versions go on
+-- from where they were.
+INSERT INTO table_versions(name, slot, version)
+SELECT name, slot, 0
+FROM (SELECT DISTINCT name FROM table_versions) t, generate_series(1, 31) slot
+ON CONFLICT (name, slot) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS TRIGGER AS $$
+BEGIN
+    -- Every backend starts from a slot of its own, skipping those held by
+    -- other transactions.
+    UPDATE table_versions SET version = version + 1, changed_at = now()
+    WHERE (name, slot) IN (
+        SELECT name, slot FROM table_versions
+        WHERE name = TG_TABLE_NAME
+        ORDER BY (slot + pg_backend_pid()) % 32
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    );
+    -- Every slot is held (or the table has none yet): wait for one.
+    IF NOT FOUND THEN
+        INSERT INTO table_versions(name, slot) VALUES (TG_TABLE_NAME, pg_backend_pid() % 32)
+        ON CONFLICT (name, slot) DO UPDATE
+        SET version = table_versions.version + 1, changed_at = now();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
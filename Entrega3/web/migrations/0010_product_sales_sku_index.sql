@@ -0,0 +1,25 @@
+-- A price change updates the fact rows of the product, found by its SKU
+-- rather than by reading the whole fact table.
+
+CREATE INDEX IF NOT EXISTS product_sales_fact_sku_index ON product_sales_fact(SKU);
+
+-- product: a new price changes the total of every line of the product. The
+-- orders of those lines are locked first, as refresh_product_sales does, so
+-- a concurrent refresh of one of them cannot write the old price back.
+CREATE OR REPLACE FUNCTION product_sales_refresh_prices() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM 1 FROM orders
+    WHERE order_no IN (
+        SELECT s.order_no
+        FROM product_sales_fact s JOIN new_rows n USING (SKU) JOIN old_rows o USING (SKU)
+        WHERE n.price IS DISTINCT FROM o.price)
+    ORDER BY order_no
+    FOR NO KEY UPDATE;
+
+    UPDATE product_sales_fact s
+    SET total_price = s.qty*n.price
+    FROM new_rows n JOIN old_rows o USING (SKU)
+    WHERE s.SKU = n.SKU AND n.price IS DISTINCT FROM o.price;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
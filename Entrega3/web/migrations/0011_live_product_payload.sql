@@ -0,0 +1,25 @@
+-- A notification payload must be shorter than 8000 bytes, or pg_notify
+-- raises and the UPDATE of the product is rolled back with it. Cutting the
+-- description to 4000 characters (migration 0006) does not bound its bytes:
+-- multibyte text, and the escapes JSON adds, can take several per
+-- character. The description is now sent only if the whole event fits;
+-- otherwise the event carries the SKU, name and price with "truncated":
+-- true, and subscribers read the description from the product.
+CREATE OR REPLACE FUNCTION live_product_updated() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM notify_live_event('product', CASE
+        -- The id, event name and keys of the event take well under 100 bytes.
+        WHEN octet_length(p.data::TEXT) < 7900 THEN p.data
+        ELSE json_build_object('sku', p.SKU, 'name', p.name, 'price', p.price, 'truncated', true)
+        END)
+    FROM (
+        SELECT n.SKU, n.name, n.price, json_build_object(
+            'sku', n.SKU, 'name', n.name, 'price', n.price,
+            'description', n.description) AS data
+        FROM new_rows n JOIN old_rows o USING (SKU)
+        WHERE n.price IS DISTINCT FROM o.price
+        OR n.description IS DISTINCT FROM o.description
+    ) p;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,29 @@
+-- product: the price trigger of migration 0010 joined the transition tables,
+-- which have no statistics, to product_sales_fact and orders, and ran both
+-- statements even when no price changed (a description update, an import
+-- upserting the same prices). The SKUs whose price changed are now gathered
+-- first: none, and the trigger returns; a few, and their fact rows are
+-- found through product_sales_fact_sku_index.
+CREATE OR REPLACE FUNCTION product_sales_refresh_prices() RETURNS TRIGGER AS $$
+DECLARE
+    changed VARCHAR[];
+BEGIN
+    changed := ARRAY(
+        SELECT n.SKU FROM new_rows n JOIN old_rows o USING (SKU)
+        WHERE n.price IS DISTINCT FROM o.price);
+    IF cardinality(changed) = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM 1 FROM orders
+    WHERE order_no IN (SELECT order_no FROM product_sales_fact WHERE SKU = ANY(changed))
+    ORDER BY order_no
+    FOR NO KEY UPDATE;
+
+    UPDATE product_sales_fact s
+    SET total_price = s.qty*n.price
+    FROM new_rows n
+    WHERE s.SKU = n.SKU AND s.SKU = ANY(changed);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,20 @@
+-- product: as for product_sales_fact (migration 0012), the SKUs whose price
+-- changed are gathered first, so a statement that changed no price does not
+-- look up the lines of its products, and one that did finds them through
+-- contains_sku_index.
+CREATE OR REPLACE FUNCTION order_totals_refresh_prices() RETURNS TRIGGER AS $$
+DECLARE
+    changed VARCHAR[];
+BEGIN
+    changed := ARRAY(
+        SELECT n.SKU FROM new_rows n JOIN old_rows o USING (SKU)
+        WHERE n.price IS DISTINCT FROM o.price);
+    IF cardinality(changed) = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM refresh_order_totals(ARRAY(
+        SELECT DISTINCT order_no FROM contains WHERE SKU = ANY(changed)));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
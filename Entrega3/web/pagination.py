@@ -0,0 +1,288 @@
+"""Keyset (cursor) pagination for the list endpoints.
+
+Every list is ordered by a unique sort key. A page is fetched with a row
+comparison against the last (or first) key seen, so the database walks the
+matching index from that position instead of scanning and discarding
+``OFFSET`` rows, and each page costs the same no matter how deep it is.
+"""
+import base64
+import binascii
+import json
+import re
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple
+from typing import Optional
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+FIRST = "first"
+NEXT = "n"
+PREV = "p"
+VARIANTS = {FIRST: "first", NEXT: "next", PREV: "prev"}
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token or page size cannot be decoded."""
+
+
+class Cursor(NamedTuple):
+    direction: str
+    values: list
+
+
+class Column(NamedTuple):
+    """One component of a sort key.
+
+    ``expr`` is the SQL expression ordered on, ``field`` the attribute of the
+    fetched row holding its value, ``cast`` the SQL type the cursor value is
+    cast back to, and ``null`` the value ``expr`` maps NULLs to (if any).
+    """
+
+    expr: str
+    field: str
+    cast: str
+    null: Optional[str] = None
+
+
+@dataclass
+class Page:
+    items: list
+    next: Optional[str]
+    prev: Optional[str]
+
+    def as_dict(self):
+        return {"items": self.items, "next": self.next, "prev": self.prev}
+
+
+class StreamedPage:
+    """A forward page whose rows are consumed while it is rendered.
+
+    ``items`` yields the rows as they are read, so a template can emit each
+    one before the next is fetched; ``next`` and ``prev`` are known once
+    ``items`` has been iterated. ``done`` (if given) is called with the
+    equivalent :class:`Page` at the end, e.g. to cache it.
+    """
+
+    def __init__(self, keyset, rows, cursor: Optional[Cursor], limit: int, done=None):
+        self.keyset = keyset
+        self.rows = rows
+        self.cursor = cursor
+        self.limit = limit
+        self.done = done
+        self.next = None
+        self.prev = None
+
+    @property
+    def items(self):
+        kept = [] if self.done is not None else None
+        first = last = None
+        count = 0
+        for row in self.rows:
+            count += 1
+            if count > self.limit:
+                # The look-ahead row: there is a next page.
+                self.next = encode_cursor(NEXT, self.keyset.cursor_values(last))
+                continue
+            if first is None:
+                first = row
+            last = row
+            if kept is not None:
+                kept.append(row)
+            yield row
+        if first is not None and self.cursor is not None:
+            self.prev = encode_cursor(PREV, self.keyset.cursor_values(first))
+        if self.done is not None:
+            self.done(Page(kept, self.next, self.prev))
+
+
+def encode_cursor(direction, values):
+    raw = json.dumps([direction, values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _integer(value):
+    return type(value) is int and -(2**31) <= value < 2**31
+
+
+def _numeric(value):
+    # As encoded by Keyset.cursor_values: the text of a Decimal.
+    return isinstance(value, str) and NUMBER.fullmatch(value) and abs(Decimal(value).adjusted()) < 1000
+
+
+def _real(value):
+    if isinstance(value, str) and NUMBER.fullmatch(value):
+        value = float(value)
+    return type(value) in (int, float) and (value == 0 or 1e-37 < abs(value) < 1e38)
+
+
+def _date(value):
+    if not isinstance(value, str) or not ISO_DATE.fullmatch(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _text(value):
+    if not isinstance(value, str) or "\0" in value:
+        return False
+    try:
+        value.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+# Column.cast -> whether a value of the cursor can be cast to it.
+CURSOR_VALUES = {
+    "INTEGER": _integer,
+    "NUMERIC": _numeric,
+    "REAL": _real,
+    "DATE": _date,
+    "TEXT": _text,
+    "VARCHAR": _text,
+}
+
+
+def decode_cursor(token, key=None):
+    """Decode an opaque cursor token, ``None`` meaning the first page.
+
+    With ``key`` (the columns of a sort key), the values of the cursor are
+    checked against them, so a forged token fails here and not in the
+    database.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, values = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor.") from e
+    if direction not in (NEXT, PREV) or not isinstance(values, list):
+        raise InvalidCursor("Invalid cursor.")
+    if key is not None:
+        if len(values) != len(key):
+            raise InvalidCursor("Invalid cursor.")
+        for column, value in zip(key, values):
+            if value is None or value == column.null:
+                continue
+            if not CURSOR_VALUES[column.cast](value):
+                raise InvalidCursor("Invalid cursor.")
+    return Cursor(direction, values)
+
+
+def page_size(value):
+    """Parse the ``limit`` argument, capped at ``MAX_PAGE_SIZE``."""
+    if value is None or value == "":
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except ValueError as e:
+        raise InvalidCursor("Page size is required to be numeric.") from e
+    if size < 1:
+        raise InvalidCursor("Page size must be positive.")
+    return min(size, MAX_PAGE_SIZE)
+
+
+@dataclass(frozen=True)
+class Keyset:
+    """A list query paginated on a unique sort key.
+
+    ``select`` is the ``SELECT ... FROM ...`` part of the query, without
+    ``WHERE``/``ORDER BY``; ``key`` the columns of the sort key, all sorted in
+    the same direction so a single row comparison matches the index; ``where``
+    an optional condition every row of the list matches (e.g. a search).
+
+    A page is read with one of three statements: the first page, the page
+    after a cursor and the page before it (see :data:`VARIANTS`).
+    """
+
+    name: str
+    select: str
+    key: tuple
+    descending: bool = False
+    where: Optional[str] = None
+
+    def variant(self, cursor: Optional[Cursor]):
+        """Return which statement reads the page at ``cursor``."""
+        if cursor is None:
+            return FIRST
+        if len(cursor.values) != len(self.key):
+            raise InvalidCursor("Invalid cursor.")
+        return cursor.direction
+
+    def sql(self, variant):
+        """Return the statement of ``variant``; it fetches one look-ahead row."""
+        conditions = [f"({self.where})"] if self.where else []
+        if variant != FIRST:
+            # Moving forward means "after" in sort order, backwards "before".
+            op = ">" if (variant == NEXT) != self.descending else "<"
+            placeholders = [
+                f"%(cursor_{i})s::{column.cast}" for i, column in enumerate(self.key)
+            ]
+            conditions.append(
+                f"({', '.join(c.expr for c in self.key)}) {op} ({', '.join(placeholders)})"
+            )
+        sql = self.select
+        if conditions:
+            sql += f"WHERE {' AND '.join(conditions)}\n"
+        # Walking backwards reads the index in reverse and flips the rows after.
+        desc = self.descending != (variant == PREV)
+        order = ", ".join(f"{c.expr} {'DESC' if desc else 'ASC'}" for c in self.key)
+        return sql + f"ORDER BY {order}\nLIMIT %(limit)s;"
+
+    def params(self, cursor: Optional[Cursor], limit: int):
+        params = {"limit": limit + 1}
+        if cursor is not None:
+            for i, value in enumerate(cursor.values):
+                params[f"cursor_{i}"] = value
+        return params
+
+    def cursor_values(self, row):
+        values = []
+        for column in self.key:
+            value = getattr(row, column.field)
+            if value is None:
+                value = column.null
+            values.append(value if isinstance(value, int) or value is None else str(value))
+        return values
+
+    def stream(self, rows, cursor: Optional[Cursor], limit: int, done=None):
+        """Build the page from an iterator over the rows fetched with :meth:`sql`.
+
+        Rows before a cursor come in reverse order, so that page is read in
+        full and returned as a :class:`Page`.
+        """
+        if cursor is not None and cursor.direction == PREV:
+            page = self.page(list(rows), cursor, limit)
+            if done is not None:
+                done(page)
+            return page
+        return StreamedPage(self, rows, cursor, limit, done)
+
+    def page(self, rows, cursor: Optional[Cursor], limit: int) -> Page:
+        """Build the page from rows fetched with :meth:`sql`."""
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if cursor is not None and cursor.direction == PREV:
+            rows.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = cursor is not None, more
+        if not rows:
+            return Page(rows, None, None)
+        return Page(
+            rows,
+            encode_cursor(NEXT, self.cursor_values(rows[-1])) if has_next else None,
+            encode_cursor(PREV, self.cursor_values(rows[0])) if has_prev else None,
+        )
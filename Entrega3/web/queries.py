@@ -0,0 +1,577 @@
+"""The SQL statements of the app, by name.
+
+Every statement is registered in :data:`QUERIES` and server-side prepared
+(``PREPARE``) on each pooled connection as the pool opens it, through the
+pool's ``configure`` hook. Routes run them with :meth:`Query.execute`, which
+sends ``EXECUTE name(...)`` so the statement is never parsed or planned
+again, and records how often and how long each statement ran.
+"""
+import re
+import threading
+import time
+import weakref
+
+import psycopg
+from psycopg import AsyncClientCursor
+from psycopg import ClientCursor
+from psycopg.rows import namedtuple_row
+
+import metrics
+from pagination import Column
+from pagination import Keyset
+from pagination import VARIANTS
+
+
+QUERIES = {}
+
+PARAM = re.compile(r"%\((\w+)\)s")
+
+# connection -> names of the statements prepared on it
+_prepared = weakref.WeakKeyDictionary()
+
+
+class Query:
+    """A named statement using ``%(name)s`` placeholders."""
+
+    def __init__(self, name, sql):
+        if name in QUERIES:
+            raise ValueError(f"Query {name} is already registered.")
+        self.name = name
+        self.sql = sql
+        self.params = []
+
+        def number(match):
+            if match.group(1) not in self.params:
+                self.params.append(match.group(1))
+            return f"${self.params.index(match.group(1)) + 1}"
+
+        body = PARAM.sub(number, sql).replace("%%", "%").rstrip().rstrip(";")
+        self.prepare_sql = f"PREPARE {name} AS {body};"
+        args = ", ".join(f"%({param})s" for param in self.params)
+        self.execute_sql = f"EXECUTE {name}({args});" if args else f"EXECUTE {name};"
+
+        self.calls = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+        QUERIES[name] = self
+
+    def statement(self, cur):
+        """The SQL to send on ``cur``: ``EXECUTE`` if prepared on its connection."""
+        if self.name in _prepared.get(cur.connection, ()):
+            return self.execute_sql
+        return self.sql
+
+    def record(self, seconds, rows):
+        with self._lock:
+            self.calls += 1
+            self.rows += max(rows, 0)
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+        metrics.QUERY_SECONDS.observe(seconds, self.name)
+        metrics.QUERY_ROWS.inc(self.name, amount=max(rows, 0))
+
+    def execute(self, cur, params=None):
+        start = time.perf_counter()
+        cur.execute(self.statement(cur), params or {})
+        self.record(time.perf_counter() - start, cur.rowcount)
+        return cur
+
+    def executemany(self, cur, params_seq):
+        start = time.perf_counter()
+        cur.executemany(self.statement(cur), params_seq)
+        self.record(time.perf_counter() - start, cur.rowcount)
+        return cur
+
+    async def execute_async(self, cur, params=None):
+        start = time.perf_counter()
+        await cur.execute(self.statement(cur), params or {})
+        self.record(time.perf_counter() - start, cur.rowcount)
+        return cur
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "rows": self.rows,
+                "seconds": round(self.seconds, 6),
+                "max_seconds": round(self.max_seconds, 6),
+            }
+
+
+def cursor(conn, row_factory=namedtuple_row):
+    # Client-side binding, so the parameters of EXECUTE get typed by PREPARE.
+    return ClientCursor(conn, row_factory=row_factory)
+
+
+def async_cursor(conn, row_factory=namedtuple_row):
+    return AsyncClientCursor(conn, row_factory=row_factory)
+
+
+def _prepare_statements():
+    """Yield ``(names, sql)`` batches: all statements at once, then one by one."""
+    yield list(QUERIES), "\n".join(q.prepare_sql for q in QUERIES.values())
+    for query in QUERIES.values():
+        yield [query.name], query.prepare_sql
+
+
+def prepare(conn):
+    """Prepare every registered statement on ``conn`` (the pool ``configure`` hook).
+
+    Statements that cannot be prepared yet (e.g. their table is created by a
+    pending migration) are skipped and run unprepared on this connection.
+    """
+    prepared = set()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        batches = _prepare_statements()
+        names, sql = next(batches)
+        try:
+            conn.execute(sql)
+            prepared.update(names)
+        except psycopg.Error:
+            conn.execute("DEALLOCATE ALL;")
+            for names, sql in batches:
+                try:
+                    conn.execute(sql)
+                    prepared.update(names)
+                except psycopg.Error:
+                    pass
+    finally:
+        conn.autocommit = autocommit
+    _prepared[conn] = prepared
+
+
+async def prepare_async(conn):
+    """Async counterpart of :func:`prepare`."""
+    prepared = set()
+    autocommit = conn.autocommit
+    await conn.set_autocommit(True)
+    try:
+        batches = _prepare_statements()
+        names, sql = next(batches)
+        try:
+            await conn.execute(sql)
+            prepared.update(names)
+        except psycopg.Error:
+            await conn.execute("DEALLOCATE ALL;")
+            for names, sql in batches:
+                try:
+                    await conn.execute(sql)
+                    prepared.update(names)
+                except psycopg.Error:
+                    pass
+    finally:
+        await conn.set_autocommit(autocommit)
+    _prepared[conn] = prepared
+
+
+def stats():
+    return {name: query.stats() for name, query in sorted(QUERIES.items())}
+
+
+def page_queries(keyset):
+    """Register the first/next/prev page statements of ``keyset``."""
+    return {
+        variant: Query(f"{keyset.name}_{suffix}", keyset.sql(variant))
+        for variant, suffix in VARIANTS.items()
+    }
+
+
+# Lists
+
+PRODUCTS = Keyset(
+    "product_page",
+    """
+    SELECT name, SKU, description, price, ean
+    FROM product
+    """,
+    key=(Column("price", "price", "NUMERIC"), Column("SKU", "sku", "VARCHAR")),
+)
+
+SUPPLIERS = Keyset(
+    "supplier_page",
+    """
+    SELECT TIN, supplier.name, supplier.address, SKU, date
+    FROM supplier
+    """,
+    key=(
+        Column("COALESCE(date, 'infinity'::DATE)", "date", "DATE", "infinity"),
+        Column("TIN", "tin", "VARCHAR"),
+    ),
+    descending=True,
+)
+
+CLIENTS = Keyset(
+    "client_page",
+    """
+    SELECT cust_no, customer.name, email, phone, customer.address
+    FROM customer
+    """,
+    key=(Column("cust_no", "cust_no", "INTEGER"),),
+    descending=True,
+)
+
+ORDERS = Keyset(
+    "order_page",
+    """
+    SELECT order_no, cust_no, date
+    FROM orders
+    """,
+    key=(Column("order_no", "order_no", "INTEGER"),),
+)
+
+
+# Search
+#
+# The product search in three modes, each paginated like the lists. A prefix
+# search is a range scan of product_name_prefix_index, in name order; the
+# substring and fuzzy searches are answered by the trigram indexes of
+# migration 0004 and ranked by how well the words of name or description
+# match the search terms.
+
+SEARCH_RANK = "GREATEST(word_similarity(%(q)s, name), word_similarity(%(q)s, description))"
+
+SEARCHES = {
+    "prefix": Keyset(
+        "product_search_prefix",
+        """
+        SELECT name, SKU, description, price, ean, lower(name) COLLATE "C" AS sort_name
+        FROM product
+        """,
+        key=(Column('lower(name) COLLATE "C"', "sort_name", "TEXT"), Column("SKU", "sku", "VARCHAR")),
+        # A range, not LIKE: with the pattern a parameter, the generic plan of
+        # LIKE cannot bound the scan of the index.
+        where='lower(name) COLLATE "C" >= %(low)s AND lower(name) COLLATE "C" < %(high)s',
+    ),
+    "substring": Keyset(
+        "product_search_substring",
+        f"""
+        SELECT name, SKU, description, price, ean, {SEARCH_RANK} AS rank
+        FROM product
+        """,
+        key=(Column(SEARCH_RANK, "rank", "REAL"), Column("SKU", "sku", "VARCHAR")),
+        descending=True,
+        where="name ILIKE %(pattern)s OR description ILIKE %(pattern)s",
+    ),
+    "fuzzy": Keyset(
+        "product_search_fuzzy",
+        f"""
+        SELECT name, SKU, description, price, ean, {SEARCH_RANK} AS rank
+        FROM product
+        """,
+        key=(Column(SEARCH_RANK, "rank", "REAL"), Column("SKU", "sku", "VARCHAR")),
+        descending=True,
+        where="%(q)s <%% name OR %(q)s <%% description",
+    ),
+}
+
+
+def like_escape(text):
+    """Escape the ``LIKE`` wildcards of ``text``, to match it literally."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def prefix_end(prefix):
+    """The least string after every string starting with ``prefix``, in code point ("C") order."""
+    # U+10FFFF is a noncharacter, in no name: a prefix of only those matches none.
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return ""
+    last = ord(prefix[-1]) + 1
+    if 0xD800 <= last <= 0xDFFF:
+        # Surrogates are not characters of a string.
+        last = 0xE000
+    return prefix[:-1] + chr(last)
+
+
+def search_params(mode, q):
+    """The parameters of the ``mode`` search for ``q``."""
+    if mode == "prefix":
+        return {"low": q.lower(), "high": prefix_end(q.lower())}
+    if mode == "substring":
+        return {"q": q, "pattern": f"%{like_escape(q)}%"}
+    return {"q": q}
+
+
+PAGES = {
+    keyset.name: page_queries(keyset)
+    for keyset in (PRODUCTS, SUPPLIERS, CLIENTS, ORDERS, *SEARCHES.values())
+}
+
+
+# Products
+
+PRODUCT_BY_SKU = Query(
+    "product_by_sku",
+    """
+    SELECT name, SKU, description, price, ean
+    FROM product
+    WHERE SKU = %(SKU)s;
+    """,
+)
+
+INSERT_PRODUCT = Query(
+    "insert_product",
+    """
+    INSERT INTO product VALUES(%(SKU)s, %(name)s, %(description)s, %(price)s, %(ean)s);
+    """,
+)
+
+UPDATE_PRODUCT_PRICE = Query(
+    "update_product_price",
+    """
+    UPDATE product
+    SET price = %(price)s
+    WHERE SKU = %(SKU)s;
+    """,
+)
+
+UPDATE_PRODUCT_DESCRIPTION = Query(
+    "update_product_description",
+    """
+    UPDATE product
+    SET description = %(description)s
+    WHERE SKU = %(SKU)s;
+    """,
+)
+
+
+# Clients and suppliers
+
+INSERT_CLIENT = Query(
+    "insert_client",
+    """
+    INSERT INTO customer VALUES(%(cust_no)s, %(name)s, %(email)s, %(phone)s, %(address)s);
+    """,
+)
+
+INSERT_SUPPLIER = Query(
+    "insert_supplier",
+    """
+    INSERT INTO supplier VALUES(%(TIN)s, %(name)s, %(address)s, %(SKU)s, %(date)s);
+    """,
+)
+
+
+# Orders
+
+INSERT_ORDER = Query(
+    "insert_order",
+    """
+    INSERT INTO orders VALUES(%(order_no)s, %(cust_no)s, %(date)s);
+    """,
+)
+
+INSERT_CONTAINS = Query(
+    "insert_contains",
+    """
+    INSERT INTO contains VALUES(%(order_no)s, %(SKU)s, %(quantity)s);
+    """,
+)
+
+INSERT_PAY = Query(
+    "insert_pay",
+    """
+    INSERT INTO pay VALUES(%(order_no)s, %(cust_no)s);
+    """,
+)
+
+
+# Deletes
+#
+# Each delete is a single statement, so it runs in one transaction and one
+# round trip. Only the orders, suppliers and deliveries reached from the
+# deleted keys are touched; an order is removed with its payment and
+# processing once the deleted products leave it empty.
+
+DELETE_PRODUCTS = Query(
+    "delete_products",
+    """
+    WITH removed_contains AS (
+        DELETE FROM contains
+        WHERE SKU = ANY(%(keys)s::VARCHAR[])
+        RETURNING order_no
+    ),
+    emptied AS (
+        SELECT DISTINCT order_no
+        FROM removed_contains r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM contains c
+            WHERE c.order_no = r.order_no AND c.SKU <> ALL(%(keys)s::VARCHAR[]))
+    ),
+    removed_process AS (
+        DELETE FROM process WHERE order_no IN (SELECT order_no FROM emptied)
+    ),
+    removed_pay AS (
+        DELETE FROM pay WHERE order_no IN (SELECT order_no FROM emptied)
+    ),
+    removed_orders AS (
+        DELETE FROM orders WHERE order_no IN (SELECT order_no FROM emptied)
+    ),
+    removed_supplier AS (
+        DELETE FROM supplier
+        WHERE SKU = ANY(%(keys)s::VARCHAR[])
+        RETURNING TIN
+    ),
+    removed_delivery AS (
+        DELETE FROM delivery WHERE TIN IN (SELECT TIN FROM removed_supplier)
+    )
+    DELETE FROM product
+    WHERE SKU = ANY(%(keys)s::VARCHAR[]);
+    """,
+)
+
+DELETE_CLIENTS = Query(
+    "delete_clients",
+    """
+    WITH client_orders AS (
+        SELECT order_no FROM orders WHERE cust_no = ANY(%(keys)s::INTEGER[])
+    ),
+    removed_contains AS (
+        DELETE FROM contains WHERE order_no IN (SELECT order_no FROM client_orders)
+    ),
+    removed_process AS (
+        DELETE FROM process WHERE order_no IN (SELECT order_no FROM client_orders)
+    ),
+    removed_pay AS (
+        -- A union rather than OR, so both sides are read through an index.
+        DELETE FROM pay
+        WHERE order_no IN (
+            SELECT order_no FROM client_orders
+            UNION
+            SELECT order_no FROM pay WHERE cust_no = ANY(%(keys)s::INTEGER[]))
+    ),
+    removed_orders AS (
+        DELETE FROM orders WHERE cust_no = ANY(%(keys)s::INTEGER[])
+    )
+    DELETE FROM customer
+    WHERE cust_no = ANY(%(keys)s::INTEGER[]);
+    """,
+)
+
+DELETE_SUPPLIERS = Query(
+    "delete_suppliers",
+    """
+    WITH removed_delivery AS (
+        DELETE FROM delivery WHERE TIN = ANY(%(keys)s::VARCHAR[])
+    )
+    DELETE FROM supplier
+    WHERE TIN = ANY(%(keys)s::VARCHAR[]);
+    """,
+)
+
+
+# Versions
+
+TABLE_VERSION = Query(
+    "table_version",
+    """
+    SELECT SUM(version)::BIGINT AS version, MAX(changed_at) AS changed_at
+    FROM table_versions
+    WHERE name = %(name)s
+    HAVING COUNT(*) > 0;
+    """,
+)
+
+
+# Totals
+#
+# Order totals and the paid totals of the customers, kept up to date by
+# triggers (migration 0007).
+
+ORDER_TOTAL = Query(
+    "order_total",
+    """
+    SELECT o.order_no, o.cust_no, COALESCE(t.total, 0) AS total,
+        COALESCE(t.lines, 0) AS lines, pay.order_no IS NOT NULL AS paid
+    FROM orders o
+    LEFT JOIN order_totals t USING (order_no)
+    LEFT JOIN pay USING (order_no)
+    WHERE o.order_no = %(order_no)s;
+    """,
+)
+
+TOP_CUSTOMERS = Query(
+    "top_customers",
+    """
+    SELECT t.cust_no, c.name, t.paid_total, t.paid_orders
+    FROM customer_paid_totals t JOIN customer c USING (cust_no)
+    ORDER BY t.paid_total DESC, t.cust_no
+    LIMIT %(limit)s;
+    """,
+)
+
+
+# Reports
+#
+# The two OLAP reports of the project for one year, read from the
+# product_sales_fact table (migration 0003). Every grouping of a report is
+# its own statement, named after the report and the grouping.
+
+# grouping -> column of product_sales_fact the sales are totalled by
+SALES_GROUPINGS = {
+    "global": "year",
+    "city": "city",
+    "month": "month",
+    "day": "day_of_month",
+    "weekday": "day_of_week",
+}
+
+# grouping -> (column of product_sales_fact, date field of the days it spans)
+DAILY_AVERAGE_GROUPINGS = {
+    "global": ("year", "YEAR"),
+    "month": ("month", "MONTH"),
+    "weekday": ("day_of_week", "DOW"),
+}
+
+
+def sales_query(grouping):
+    """Quantity and value sold of each product, by ``grouping``."""
+    column = SALES_GROUPINGS[grouping]
+    return Query(
+        f"sales_by_{grouping}",
+        f"""
+        SELECT SKU, {column}, SUM(qty) AS total_qty, SUM(total_price) AS total_price
+        FROM product_sales_fact
+        WHERE year = %(year)s
+        GROUP BY SKU, {column}
+        ORDER BY {column}, SKU;
+        """,
+    )
+
+
+def daily_average_query(grouping):
+    """Average daily value sold of each product, by ``grouping``.
+
+    The sales of a group are divided by the number of calendar days of the
+    year in that group (every day of a month, every Monday, ...).
+    """
+    column, field = DAILY_AVERAGE_GROUPINGS[grouping]
+    return Query(
+        f"daily_average_by_{grouping}",
+        f"""
+        WITH days AS (
+            SELECT EXTRACT({field} FROM day)::INTEGER AS {column}, COUNT(*) AS days
+            FROM generate_series(
+                make_date(%(year)s, 1, 1), make_date(%(year)s, 12, 31), '1 day'::INTERVAL
+            ) AS day
+            GROUP BY 1
+        )
+        SELECT SKU, {column}, ROUND(SUM(total_price)/days, 2) AS daily_avg
+        FROM product_sales_fact JOIN days USING ({column})
+        WHERE year = %(year)s
+        GROUP BY SKU, {column}, days
+        ORDER BY {column}, SKU;
+        """,
+    )
+
+
+REPORTS = {
+    "sales": {grouping: sales_query(grouping) for grouping in SALES_GROUPINGS},
+    "daily_average": {
+        grouping: daily_average_query(grouping) for grouping in DAILY_AVERAGE_GROUPINGS
+    },
+}
@@ -0,0 +1,250 @@
+"""Read replicas, and the routing of reads between them and the primary.
+
+Writes always go to the primary. Reads go to a streaming replica, as long as
+it has replayed every write the reader must see: the writes of the client,
+whose last commit LSN it sends back (see ``app.py``), and the writes of this
+process, which its caches were invalidated for. A replica behind that LSN is
+given ``REPLICA_WAIT`` seconds to catch up; after that, or if it cannot be
+reached, the read goes to the primary.
+
+Configured with ``DATABASE_REPLICA_URLS``, a comma-separated list of
+connection strings; with no replicas every read goes to the primary.
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg
+from psycopg_pool import ConnectionPool
+from psycopg_pool import PoolTimeout
+
+import metrics
+
+
+# Seconds a read waits for a replica to replay the writes it must see, and
+# between two checks of its progress.
+REPLICA_WAIT = 0.1
+POLL_INTERVAL = 0.01
+# Seconds to wait for a replica connection before reading from the primary.
+CHECKOUT_TIMEOUT = 1
+# Seconds a replica that could not be reached is left out.
+RETRY_AFTER = 5
+
+# These run with prepare=False: psycopg would prepare statements run this
+# often, and its DEALLOCATE ALL on a later rollback would drop the statements
+# of queries.py too.
+REPLAY_LSN = "SELECT pg_last_wal_replay_lsn();"
+# The end of the WAL written so far, hence of every transaction committed.
+WRITE_LSN = "SELECT pg_current_wal_insert_lsn();"
+LAG = """
+SELECT pg_last_wal_replay_lsn(),
+    extract(epoch FROM now() - pg_last_xact_replay_timestamp());
+"""
+
+
+def parse_lsn(text):
+    """The position of an LSN such as ``"16/B374D848"``, as a number."""
+    high, low = text.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def format_lsn(position):
+    return f"{position >> 32:X}/{position & 0xFFFFFFFF:X}"
+
+
+def replay_position(replayed):
+    """The position of ``pg_last_wal_replay_lsn()``."""
+    # NULL: the server is not in recovery, so it sees every write.
+    return parse_lsn(replayed) if replayed is not None else float("inf")
+
+
+class Router:
+    """The primary pool and the replica pools of this process.
+
+    Every connection checked out of a replica first reads how far it has
+    replayed, which also finds out a replica gone down before a query fails
+    on it.
+    """
+
+    def __init__(self, primary, urls, **pool_options):
+        self.primary = primary
+        self.replicas = [
+            ConnectionPool(conninfo=url, name=f"replica-{i}", open=False, **pool_options)
+            for i, url in enumerate(urls)
+        ]
+        # When each replica may be tried again after failing.
+        self.down_until = [0.0] * len(self.replicas)
+        # The highest LSN committed by this process.
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def open(self, wait=False):
+        for replica in self.replicas:
+            replica.open(wait=wait)
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+
+    def record_write(self, conn):
+        """Return the LSN of the writes committed on ``conn``, a primary connection."""
+        position = parse_lsn(conn.execute(WRITE_LSN, prepare=False).fetchone()[0])
+        with self._lock:
+            self.written = max(self.written, position)
+        return position
+
+    def route(self, lsn=0):
+        """The reads of one request, which must see the writes up to ``lsn``."""
+        return Route(self, lsn)
+
+    def pick(self):
+        """The number of a replica to read from, or ``None`` if none is up."""
+        now = time.monotonic()
+        up = [i for i, until in enumerate(self.down_until) if until <= now]
+        return random.choice(up) if up else None
+
+    def failed(self, i):
+        """Skip replica ``i`` for ``RETRY_AFTER`` seconds."""
+        self.down_until[i] = time.monotonic() + RETRY_AFTER
+
+    def checkout(self, lsn=0):
+        """Check out a connection that sees every write up to ``lsn``; return it and its pool."""
+        if not self.replicas:
+            return self.primary.getconn(), self.primary
+        lsn = max(lsn, self.written)
+        i = self.pick()
+        if i is None:
+            return self._fall_back("unavailable")
+
+        replica = self.replicas[i]
+        try:
+            conn = replica.getconn(timeout=CHECKOUT_TIMEOUT)
+        except PoolTimeout:
+            self.failed(i)
+            return self._fall_back("unavailable")
+        try:
+            reason = self.catch_up(conn, lsn)
+        except psycopg.Error:
+            replica.putconn(conn)
+            self.failed(i)
+            return self._fall_back("unavailable")
+        if reason is None:
+            conn.rollback()
+            replica.putconn(conn)
+            return self._fall_back("lagging")
+        metrics.READ_ROUTES.inc(replica.name, reason)
+        return conn, replica
+
+    def catch_up(self, conn, lsn):
+        """Wait for the replica of ``conn`` to replay ``lsn``; return how it got there, or ``None``."""
+        deadline = time.monotonic() + REPLICA_WAIT
+        reason = "caught_up"
+        while replay_position(conn.execute(REPLAY_LSN, prepare=False).fetchone()[0]) < lsn:
+            if time.monotonic() >= deadline:
+                return None
+            reason = "waited"
+            time.sleep(POLL_INTERVAL)
+        return reason
+
+    async def checkout_async(self, replicas, primary, lsn=0):
+        """Async counterpart of :meth:`checkout`, on the async pools ``replicas`` and ``primary``.
+
+        ``replicas`` connect to the replicas of this router, in the same order.
+        """
+        if not self.replicas:
+            return await primary.getconn(), primary
+        lsn = max(lsn, self.written)
+        i = self.pick()
+        if i is None:
+            metrics.READ_ROUTES.inc("primary", "unavailable")
+            return await primary.getconn(), primary
+
+        replica = replicas[i]
+        try:
+            conn = await replica.getconn(timeout=CHECKOUT_TIMEOUT)
+        except PoolTimeout:
+            self.failed(i)
+            metrics.READ_ROUTES.inc("primary", "unavailable")
+            return await primary.getconn(), primary
+        try:
+            reason = await self.catch_up_async(conn, lsn)
+        except psycopg.Error:
+            await replica.putconn(conn)
+            self.failed(i)
+            metrics.READ_ROUTES.inc("primary", "unavailable")
+            return await primary.getconn(), primary
+        if reason is None:
+            await conn.rollback()
+            await replica.putconn(conn)
+            metrics.READ_ROUTES.inc("primary", "lagging")
+            return await primary.getconn(), primary
+        metrics.READ_ROUTES.inc(self.replicas[i].name, reason)
+        return conn, replica
+
+    async def catch_up_async(self, conn, lsn):
+        """Async counterpart of :meth:`catch_up`."""
+        deadline = time.monotonic() + REPLICA_WAIT
+        reason = "caught_up"
+        while True:
+            cur = await conn.execute(REPLAY_LSN, prepare=False)
+            if replay_position((await cur.fetchone())[0]) >= lsn:
+                return reason
+            if time.monotonic() >= deadline:
+                return None
+            reason = "waited"
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _fall_back(self, reason):
+        metrics.READ_ROUTES.inc("primary", reason)
+        return self.primary.getconn(), self.primary
+
+    def lag(self, timeout=CHECKOUT_TIMEOUT):
+        """Yield ``(name, bytes, seconds)``: how far behind the primary each replica is.
+
+        The seconds are since the last transaction replayed, so they also
+        grow while the primary is idle. Unreachable servers are left out.
+        """
+        if not self.replicas:
+            return
+        try:
+            with self.primary.connection(timeout=timeout) as conn:
+                written = parse_lsn(conn.execute(WRITE_LSN, prepare=False).fetchone()[0])
+        except (psycopg.Error, PoolTimeout):
+            return
+        for replica in self.replicas:
+            try:
+                with replica.connection(timeout=timeout) as conn:
+                    replayed, seconds = conn.execute(LAG, prepare=False).fetchone()
+            except (psycopg.Error, PoolTimeout):
+                continue
+            behind = max(written - replay_position(replayed), 0)
+            yield replica.name, behind, float(seconds or 0)
+
+
+class Route:
+    """The reads of one request.
+
+    The first read chooses the pool and every later read uses it again, so
+    all the reads of a request (its ETag and its page) see the same data or
+    newer.
+    """
+
+    def __init__(self, router, lsn=0):
+        self.router = router
+        self.lsn = lsn
+        self.pool = None
+
+    @contextmanager
+    def connection(self):
+        """Like ``ConnectionPool.connection()``, on the pool of this route."""
+        if self.pool is None:
+            conn, self.pool = self.router.checkout(self.lsn)
+        else:
+            conn = self.pool.getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.pool.putconn(conn)
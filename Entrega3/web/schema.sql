@@ -0,0 +1,162 @@
+-- The database schema of Annex A and its integrity constraints (RI-1 to
+-- RI-3), as loaded by E3-report-54.ipynb.
+
+DROP TABLE IF EXISTS customer CASCADE;
+DROP TABLE IF EXISTS orders CASCADE;
+DROP TABLE IF EXISTS pay CASCADE;
+DROP TABLE IF EXISTS employee CASCADE;
+DROP TABLE IF EXISTS process CASCADE;
+DROP TABLE IF EXISTS department CASCADE;
+DROP TABLE IF EXISTS workplace CASCADE;
+DROP TABLE IF EXISTS works CASCADE;
+DROP TABLE IF EXISTS office CASCADE;
+DROP TABLE IF EXISTS warehouse CASCADE;
+DROP TABLE IF EXISTS product CASCADE;
+DROP TABLE IF EXISTS contains CASCADE;
+DROP TABLE IF EXISTS supplier CASCADE;
+DROP TABLE IF EXISTS delivery CASCADE;
+
+CREATE TABLE customer(
+cust_no INTEGER PRIMARY KEY,
+name VARCHAR(80) NOT NULL,
+email VARCHAR(254) UNIQUE NOT NULL,
+phone VARCHAR(15),
+address VARCHAR(255)
+);
+
+CREATE TABLE orders(
+order_no INTEGER PRIMARY KEY,
+cust_no INTEGER NOT NULL REFERENCES customer,
+date DATE NOT NULL
+--order_no must exist in contains
+);
+
+CREATE TABLE pay(
+order_no INTEGER PRIMARY KEY REFERENCES orders,
+cust_no INTEGER NOT NULL REFERENCES customer
+);
+
+CREATE TABLE employee(
+ssn VARCHAR(20) PRIMARY KEY,
+TIN VARCHAR(20) UNIQUE NOT NULL,
+bdate DATE,
+name VARCHAR NOT NULL
+--age must be >=18
+);
+
+CREATE TABLE process(
+ssn VARCHAR(20) REFERENCES employee,
+order_no INTEGER REFERENCES orders,
+PRIMARY KEY (ssn, order_no)
+);
+
+CREATE TABLE department(
+name VARCHAR PRIMARY KEY
+);
+
+CREATE TABLE workplace(
+address VARCHAR PRIMARY KEY,
+lat NUMERIC(8, 6) NOT NULL,
+long NUMERIC(9, 6) NOT NULL,
+UNIQUE(lat, long)
+--address must be in warehouse or office but not both
+);
+
+CREATE TABLE office(
+address VARCHAR(255) PRIMARY KEY REFERENCES workplace
+);
+
+CREATE TABLE warehouse(
+address VARCHAR(255) PRIMARY KEY REFERENCES workplace
+);
+
+CREATE TABLE works(
+ssn VARCHAR(20) REFERENCES employee,
+name VARCHAR(200) REFERENCES department,
+address VARCHAR(255) REFERENCES workplace,
+PRIMARY KEY (ssn, name, address)
+);
+
+CREATE TABLE product(
+SKU VARCHAR(25) PRIMARY KEY,
+name VARCHAR(200) NOT NULL,
+description VARCHAR,
+price NUMERIC(10, 2) NOT NULL,
+ean NUMERIC(13) UNIQUE
+);
+
+CREATE TABLE contains(
+order_no INTEGER REFERENCES orders,
+SKU VARCHAR(25) REFERENCES product,
+qty INTEGER,
+PRIMARY KEY (order_no, SKU)
+);
+
+CREATE TABLE supplier(
+TIN VARCHAR(20) PRIMARY KEY,
+name VARCHAR(200),
+address VARCHAR(255),
+SKU VARCHAR(25) REFERENCES product,
+date DATE
+);
+
+CREATE TABLE delivery(
+address VARCHAR(255) REFERENCES warehouse,
+TIN VARCHAR(20) REFERENCES supplier,
+PRIMARY KEY (address, TIN)
+);
+
+--(RI-1)
+ALTER TABLE employee ADD CONSTRAINT
+employee_is_not_of_age
+CHECK(EXTRACT(YEAR FROM AGE(CURRENT_DATE, bdate))>=18);
+
+-- (RI-2)
+CREATE OR REPLACE FUNCTION check_warehouse_office() RETURNS TRIGGER AS $$
+    BEGIN
+    IF EXISTS (SELECT 1 FROM warehouse WHERE address = NEW.address) THEN
+        IF EXISTS (SELECT 1 FROM office WHERE address = NEW.address) THEN
+            RAISE EXCEPTION 'Um Worlplace não pode ser ambos(um office e warehouse) simultaneamemte.';
+        END IF;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION check_workplace() RETURNS TRIGGER AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM office WHERE address = NEW.address) THEN
+        IF NOT EXISTS (SELECT 1 FROM warehouse WHERE address = NEW.address) THEN
+            RAISE EXCEPTION 'Um Workplace tem de ser um Warehouse ou um Office.';
+        END IF;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+
+CREATE TRIGGER check_workplace_trigger AFTER INSERT ON warehouse
+FOR EACH ROW EXECUTE FUNCTION check_warehouse_office();
+
+CREATE TRIGGER check_workplace_trigger AFTER INSERT ON office
+FOR EACH ROW EXECUTE FUNCTION check_warehouse_office();
+
+CREATE CONSTRAINT TRIGGER check_workplace_trigger AFTER INSERT ON workplace
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION check_workplace();
+
+-- (RI-3)
+CREATE OR REPLACE FUNCTION check_order_in_contains() RETURNS TRIGGER
+AS $$
+BEGIN
+    --verifica se a ordem existe no contains
+    IF NOT EXISTS (SELECT 1 FROM contains where order_no = new.order_no) THEN
+        RAISE EXCEPTION 'Uma "Order" tem de figurar obrigatoriamente em "Contains".';
+    END IF;
+    RETURN NEW;
+END
+$$ Language plpgsql;
+
+CREATE CONSTRAINT TRIGGER order_in_contains AFTER INSERT ON orders
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION check_order_in_contains();
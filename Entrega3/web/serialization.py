@@ -0,0 +1,96 @@
+"""JSON of the API responses.
+
+Rows are tuples, or the namedtuples of the list pages, and their column
+names are read once per result rather than once per row. A list of rows is
+written as an array of objects keyed by column name (the ``records``
+shape), or, more compactly, as one array per column (the ``columns``
+shape, ``{"sku": [...], "price": [...]}``), which repeats no name.
+
+``NUMERIC`` values are written as strings holding the exact decimal, so no
+precision is lost to a float, and dates as ISO 8601 days. The encoder is
+orjson when it is installed, the json module otherwise.
+"""
+import datetime
+import decimal
+import json
+
+from flask import current_app
+from psycopg import ClientCursor
+from psycopg.rows import tuple_row
+from psycopg.types.string import TextLoader
+
+try:
+    import orjson
+except ImportError:  # optional: the json module
+    orjson = None
+
+
+SHAPES = ("records", "columns")
+
+MIMETYPE = "application/json"
+
+
+def cursor(conn):
+    """A cursor of tuple rows whose ``NUMERIC`` values are loaded as their text.
+
+    The server's text of a number is what the API writes, so it is never
+    parsed into a ``Decimal`` and formatted back.
+    """
+    cur = ClientCursor(conn, row_factory=tuple_row)
+    cur.adapters.register_loader("numeric", TextLoader)
+    return cur
+
+
+def columns(cur):
+    """The column names of the result of ``cur``."""
+    return tuple(column.name for column in cur.description)
+
+
+def row_columns(rows):
+    """The column names of namedtuple ``rows``, from the first one."""
+    return type(rows[0])._fields if rows else ()
+
+
+def shape_rows(names, rows, shape="records"):
+    """``rows`` of the columns ``names`` in the given shape."""
+    if shape == "columns":
+        if not rows:
+            return {name: [] for name in names}
+        return {name: list(values) for name, values in zip(names, zip(*rows))}
+    return [dict(zip(names, row)) for row in rows]
+
+
+def page(page, shape="records"):
+    """A :class:`pagination.Page` of namedtuples as a JSON object."""
+    rows = page.items
+    return {
+        "items": shape_rows(row_columns(rows), rows, shape),
+        "next": page.next,
+        "prev": page.prev,
+    }
+
+
+def _orjson_default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """``obj`` as JSON, in bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_orjson_default)
+    return json.dumps(obj, default=_json_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def response(obj, status=200, headers=None):
+    """A response of the app with ``obj`` as its JSON body."""
+    return current_app.response_class(dumps(obj), status, headers, mimetype=MIMETYPE)